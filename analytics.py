@@ -0,0 +1,223 @@
+import argparse
+import os
+import sqlite3
+import time
+
+from catalog import execute_script
+
+# Sales rollups kept up to date by triggers on the order tables, so every
+# report the owner dashboard shows is a primary-key lookup on a table whose
+# size depends on the menu and the calendar, never on how many orders
+# there are. Revenue and units are booked when an order is placed (in the
+# same transaction as the order rows) and completions when it is completed.
+# Archiving deletes order rows but leaves the rollups alone: they cover the
+# whole history. Days and hours are local time. Orders carried over from
+# the original single-table schema have no created_at; they count towards
+# the totals and product sales but belong to no day or hour.
+
+UNCATEGORISED = 'Uncategorised'
+
+ANALYTICS_SCHEMA = f'''
+    CREATE TABLE IF NOT EXISTS sales_totals (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        orders INTEGER NOT NULL DEFAULT 0,
+        completed INTEGER NOT NULL DEFAULT 0,
+        revenue REAL NOT NULL DEFAULT 0,
+        needs_backfill INTEGER NOT NULL DEFAULT 0
+    );
+    INSERT OR IGNORE INTO sales_totals (id) VALUES (1);
+    CREATE TABLE IF NOT EXISTS sales_hourly (
+        day TEXT NOT NULL,
+        hour INTEGER NOT NULL,
+        orders INTEGER NOT NULL DEFAULT 0,
+        completed INTEGER NOT NULL DEFAULT 0,
+        revenue REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, hour)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS sales_daily (
+        day TEXT PRIMARY KEY,
+        orders INTEGER NOT NULL DEFAULT 0,
+        completed INTEGER NOT NULL DEFAULT 0,
+        revenue REAL NOT NULL DEFAULT 0
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS product_sales (
+        product_name TEXT PRIMARY KEY,
+        category TEXT NOT NULL,
+        units INTEGER NOT NULL DEFAULT 0,
+        revenue REAL NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS idx_product_sales_units ON product_sales (units);
+    CREATE TABLE IF NOT EXISTS category_sales (
+        category TEXT PRIMARY KEY,
+        units INTEGER NOT NULL DEFAULT 0,
+        revenue REAL NOT NULL DEFAULT 0
+    ) WITHOUT ROWID;
+
+    CREATE TRIGGER IF NOT EXISTS analytics_order_placed AFTER INSERT ON orders BEGIN
+        UPDATE sales_totals SET orders = orders + 1, revenue = revenue + NEW.total_price,
+                                completed = completed + (NEW.status = 'Completed')
+        WHERE id = 1;
+        INSERT INTO sales_daily (day, orders, completed, revenue)
+        SELECT date(NEW.created_at, 'localtime'), 1, NEW.status = 'Completed', NEW.total_price
+        WHERE NEW.created_at IS NOT NULL
+        ON CONFLICT (day) DO UPDATE SET orders = orders + 1, completed = completed + excluded.completed,
+                                        revenue = revenue + excluded.revenue;
+        INSERT INTO sales_hourly (day, hour, orders, completed, revenue)
+        SELECT date(NEW.created_at, 'localtime'), CAST(strftime('%H', NEW.created_at, 'localtime') AS INTEGER),
+               1, NEW.status = 'Completed', NEW.total_price
+        WHERE NEW.created_at IS NOT NULL
+        ON CONFLICT (day, hour) DO UPDATE SET orders = orders + 1, completed = completed + excluded.completed,
+                                              revenue = revenue + excluded.revenue;
+    END;
+    CREATE TRIGGER IF NOT EXISTS analytics_order_completed AFTER UPDATE OF status ON orders
+    WHEN NEW.status = 'Completed' AND OLD.status <> 'Completed' BEGIN
+        UPDATE sales_totals SET completed = completed + 1 WHERE id = 1;
+        UPDATE sales_daily SET completed = completed + 1 WHERE day = date(NEW.created_at, 'localtime');
+        UPDATE sales_hourly SET completed = completed + 1
+        WHERE day = date(NEW.created_at, 'localtime')
+          AND hour = CAST(strftime('%H', NEW.created_at, 'localtime') AS INTEGER);
+    END;
+    CREATE TRIGGER IF NOT EXISTS analytics_item_sold AFTER INSERT ON order_items BEGIN
+        INSERT INTO product_sales (product_name, category, units, revenue)
+        VALUES (NEW.product_name,
+                COALESCE((SELECT category FROM products WHERE id = NEW.product_id), '{UNCATEGORISED}'),
+                NEW.quantity, NEW.total_price)
+        ON CONFLICT (product_name) DO UPDATE SET units = units + excluded.units, revenue = revenue + excluded.revenue;
+        INSERT INTO category_sales (category, units, revenue)
+        VALUES (COALESCE((SELECT category FROM products WHERE id = NEW.product_id), '{UNCATEGORISED}'),
+                NEW.quantity, NEW.total_price)
+        ON CONFLICT (category) DO UPDATE SET units = units + excluded.units, revenue = revenue + excluded.revenue;
+    END;
+'''
+
+ROLLUP_TABLES = ('sales_hourly', 'sales_daily', 'product_sales', 'category_sales')
+
+def create_rollups(conn):
+    # Runs inside the caller's transaction (see schema.migrate). Orders that
+    # already exist are not counted until backfill runs, which can take a
+    # while on a big database, so it is left to the owner to start.
+    execute_script(conn, ANALYTICS_SCHEMA)
+    conn.execute('UPDATE sales_totals SET needs_backfill = EXISTS (SELECT 1 FROM orders) WHERE id = 1')
+
+def order_rows(conn, schema):
+    # One row per order line, ordered by order, with the order's day and hour
+    return conn.execute(f'''
+        SELECT o.id, date(o.created_at, 'localtime'), CAST(strftime('%H', o.created_at, 'localtime') AS INTEGER),
+               o.status = 'Completed', o.total_price,
+               i.product_name, COALESCE(p.category, '{UNCATEGORISED}'), i.quantity, i.total_price
+        FROM {schema}.orders o
+        LEFT JOIN {schema}.order_items i ON i.order_id = o.id
+        LEFT JOIN main.products p ON p.id = i.product_id
+        ORDER BY o.id
+    ''')
+
+def backfill(conn, archive_path=None, progress_every=100000):
+    # Rebuilds every rollup from the order tables (and the archive, whose
+    # orders were counted before they were moved) in one streaming pass.
+    # Only the aggregates are held in memory, so a database with millions
+    # of orders needs no more memory than one with a hundred. The write lock
+    # is held throughout so no order lands between the scan and the swap.
+    attached = archive_path is not None and os.path.exists(archive_path)
+    if attached:
+        conn.execute('ATTACH DATABASE ? AS archive', (archive_path,))
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            hourly = {}
+            products = {}
+            categories = {}
+            totals = [0, 0, 0.0]  # orders, completed, revenue
+            rows = 0
+            started = time.perf_counter()
+            for schema in (['main', 'archive'] if attached else ['main']):
+                last_order = None
+                for order_id, day, hour, completed, order_total, name, category, quantity, line_total in order_rows(conn, schema):
+                    if order_id != last_order:
+                        last_order = order_id
+                        if day is not None:
+                            bucket = hourly.setdefault((day, hour), [0, 0, 0.0])
+                            bucket[0] += 1
+                            bucket[1] += completed
+                            bucket[2] += order_total
+                        totals[0] += 1
+                        totals[1] += completed
+                        totals[2] += order_total
+                    if name is not None:
+                        product = products.setdefault(name, [category, 0, 0.0])
+                        product[1] += quantity
+                        product[2] += line_total
+                        group = categories.setdefault(category, [0, 0.0])
+                        group[0] += quantity
+                        group[1] += line_total
+                    rows += 1
+                    if progress_every and rows % progress_every == 0:
+                        print(f"  {rows} order lines scanned")
+            daily = {}
+            for (day, hour), (orders, completed, revenue) in hourly.items():
+                bucket = daily.setdefault(day, [0, 0, 0.0])
+                bucket[0] += orders
+                bucket[1] += completed
+                bucket[2] += revenue
+            for table in ROLLUP_TABLES:
+                conn.execute(f'DELETE FROM {table}')
+            conn.executemany('INSERT INTO sales_hourly (day, hour, orders, completed, revenue) VALUES (?, ?, ?, ?, ?)',
+                             [(day, hour, *bucket) for (day, hour), bucket in hourly.items()])
+            conn.executemany('INSERT INTO sales_daily (day, orders, completed, revenue) VALUES (?, ?, ?, ?)',
+                             [(day, *bucket) for day, bucket in daily.items()])
+            conn.executemany('INSERT INTO product_sales (product_name, category, units, revenue) VALUES (?, ?, ?, ?)',
+                             [(name, *product) for name, product in products.items()])
+            conn.executemany('INSERT INTO category_sales (category, units, revenue) VALUES (?, ?, ?)',
+                             [(category, *group) for category, group in categories.items()])
+            conn.execute('''
+                UPDATE sales_totals SET orders = ?, completed = ?, revenue = ?, needs_backfill = 0
+                WHERE id = 1
+            ''', totals)
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+    finally:
+        if attached:
+            conn.execute('DETACH DATABASE archive')
+    print(f"Backfilled {totals[0]} orders ({rows} lines) in {time.perf_counter() - started:.1f}s")
+    return totals[0]
+
+def dashboard(conn, top=10):
+    # Everything the owner dashboard shows. Each query is a lookup or short
+    # range scan on a primary key or index, whatever the order count.
+    orders, completed, revenue, needs_backfill = conn.execute(
+        'SELECT orders, completed, revenue, needs_backfill FROM sales_totals WHERE id = 1').fetchone()
+    # One row per category, so this stays cheap
+    units = conn.execute('SELECT COALESCE(SUM(units), 0) FROM category_sales').fetchone()[0]
+    today = conn.execute("SELECT date('now', 'localtime')").fetchone()[0]
+    today_row = conn.execute('SELECT orders, completed, revenue FROM sales_daily WHERE day = ?', (today,)).fetchone()
+    today_orders, today_completed, today_revenue = today_row or (0, 0, 0.0)
+    return {
+        "orders": orders,
+        "completed": completed,
+        "revenue": revenue,
+        "units": units,
+        "average_ticket": revenue / orders if orders else 0.0,
+        "needs_backfill": bool(needs_backfill),
+        "today": {"day": today, "orders": today_orders, "completed": today_completed, "revenue": today_revenue,
+                  "average_ticket": today_revenue / today_orders if today_orders else 0.0},
+        "hours": conn.execute('SELECT hour, orders, revenue FROM sales_hourly WHERE day = ? ORDER BY hour',
+                              (today,)).fetchall(),
+        "days": conn.execute('SELECT day, orders, revenue FROM sales_daily ORDER BY day DESC LIMIT 14').fetchall(),
+        "top_products": conn.execute('SELECT product_name, category, units, revenue FROM product_sales '
+                                     'ORDER BY units DESC LIMIT ?', (top,)).fetchall(),
+        "categories": conn.execute('SELECT category, units, revenue FROM category_sales ORDER BY revenue DESC').fetchall(),
+    }
+
+if __name__ == "__main__":
+    from schema import ARCHIVE_PATH, migrate
+
+    parser = argparse.ArgumentParser(description="Rebuild the sales rollups of canteen.db from its orders")
+    parser.add_argument("database", nargs="?", default="canteen.db")
+    parser.add_argument("--archive-path", default=ARCHIVE_PATH,
+                        help="also count orders already moved to this archive database, if it exists")
+    args = parser.parse_args()
+    conn = sqlite3.connect(args.database, isolation_level=None)
+    migrate(conn)
+    backfill(conn, args.archive_path)
+    conn.close()
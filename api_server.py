@@ -0,0 +1,362 @@
+import argparse
+import asyncio
+import json
+import mimetypes
+import time
+from concurrent import futures
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+from canteen_service import CanteenService, UnknownProduct
+from framing import ReconnectingClient
+from kiosk_sync import MenuPublisher
+from metrics import Registry
+from schema import initialize_database
+from stock import OutOfStock
+
+# Headless JSON ordering API on the same canteen.db as the Tk apps, for
+# lightweight clients (phones, web kiosks, scripts). One asyncio loop owns
+# the sockets and speaks just enough keep-alive HTTP/1.1; database work runs
+# on a thread pool the size of the service's connection pool, and orders go
+# through the shared group-commit OrderWriter, so concurrent checkouts
+# share transactions instead of queueing on the write lock.
+#
+#   GET  /categories
+#   GET  /products?category=&q=&limit=
+#   GET  /menu?since=<version>   menu changes since a catalog version, for kiosk caches
+#   GET  /images/<name>          product image by the name /menu gives it
+#   POST /orders                 {"items": [{"product_id": 1, "quantity": 2}], "allow_partial": true, "key": "...",
+#                                 "customer": "..."}
+#   POST /orders/sync            {"orders": [<order as above, with a key>, ...]}
+#   GET  /orders                 pending orders
+#   GET  /orders/<id>
+#   POST /orders/<id>/complete
+#   GET  /orders/<id>/bill
+#   GET  /metrics
+#
+# An order with an idempotency key (in the body or an Idempotency-Key
+# header) is placed at most once; repeating it returns the first outcome.
+
+MAX_HEADER = 16 * 1024
+MAX_BODY = 1024 * 1024
+MAX_SYNC = 500  # orders per POST /orders/sync
+MAX_KEY = 100
+ORDER_FORMAT = 'Expected {"items": [{"product_id": ..., "quantity": ...}]}'
+ROUTES = ("categories", "products", "menu", "image", "orders", "sync", "order", "complete", "bill", "metrics", "other")
+
+class HttpError(Exception):
+    def __init__(self, status, message=None):
+        super().__init__(message or status.phrase)
+        self.status = status
+
+class ApiServer:
+    def __init__(self, host="localhost", port=8080, db_path='canteen.db', pool_size=4, order_server=None):
+        self.host = host
+        self.port = port
+        self.service = CanteenService(db_path, pool_size)
+        self.menu = MenuPublisher(db_path)
+        self.executor = futures.ThreadPoolExecutor(max_workers=pool_size)
+        # Owner screens learn about API orders through the order server, as
+        # they do for orders placed at a kiosk
+        self.order_client = ReconnectingClient(*order_server) if order_server else None
+        # Sending to the order server blocks while it is stalled, so it gets
+        # a thread of its own: a stall delays notifications, never the API
+        self.notifier = futures.ThreadPoolExecutor(max_workers=1) if order_server else None
+        self.metrics = Registry()
+        self.connections = self.metrics.gauge("api_connections", "HTTP connections currently open")
+        self.orders_placed = self.metrics.counter("api_orders_placed_total", "Orders accepted through the API")
+        self.orders_replayed = self.metrics.counter("api_orders_replayed_total",
+                                                    "Orders resubmitted with a key that was already used")
+        self.metrics.gauge("api_menu_version", "Catalog version the menu snapshot is at",
+                           function=lambda: self.menu.version)
+        self.metrics.gauge("api_menu_queries", "Database checks made for menu snapshots, whatever the kiosk count",
+                           function=lambda: self.menu.queries)
+        self.errors = self.metrics.counter("api_errors_total", "Requests answered with a 4xx or 5xx status")
+        self.latency = {route: self.metrics.histogram("api_request_seconds", "Time to handle a request",
+                                                      {"route": route})
+                        for route in ROUTES}
+
+    def run_blocking(self, function, *args):
+        return asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    async def handle_connection(self, reader, writer):
+        self.connections.inc()
+        try:
+            while True:
+                request = await self.read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                started = time.perf_counter()
+                route, status, content_type, payload = await self.dispatch(method, path, headers, body)
+                self.latency[route].observe(time.perf_counter() - started)
+                if status >= 400:
+                    self.errors.inc()
+                keep_alive = headers.get("connection", "").lower() != "close"
+                writer.write(self.response(status, content_type, payload, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except HttpError as e:
+            writer.write(self.response(e.status, "application/json", self.json_body({"error": str(e)}), False))
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass
+        finally:
+            self.connections.dec()
+            writer.close()
+
+    async def read_request(self, reader):
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError as e:
+            if e.partial.strip():
+                raise HttpError(HTTPStatus.BAD_REQUEST)
+            return None
+        except asyncio.LimitOverrunError:
+            raise HttpError(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE)
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, version = lines[0].split(" ")
+        except ValueError:
+            raise HttpError(HTTPStatus.BAD_REQUEST)
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            if name:
+                headers[name.strip().lower()] = value.strip()
+        if version == "HTTP/1.0" and headers.get("connection", "").lower() != "keep-alive":
+            headers["connection"] = "close"
+        length = headers.get("content-length", "0")
+        if not length.isdigit():
+            raise HttpError(HTTPStatus.BAD_REQUEST)
+        if int(length) > MAX_BODY:
+            raise HttpError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+        body = await reader.readexactly(int(length)) if int(length) else b""
+        return method, target, headers, body
+
+    def json_body(self, value):
+        return json.dumps(value, ensure_ascii=False).encode("utf-8")
+
+    def response(self, status, content_type, payload, keep_alive):
+        status = HTTPStatus(status)
+        head = (f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(payload)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        return head.encode("latin-1") + payload
+
+    async def dispatch(self, method, target, headers, body):
+        url = urlsplit(target)
+        parts = [part for part in url.path.split("/") if part]
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        route = "other"
+        try:
+            if parts == ["categories"] and method == "GET":
+                route = "categories"
+                return route, 200, "application/json", self.json_body(await self.run_blocking(self.service.categories))
+            if parts == ["products"] and method == "GET":
+                route = "products"
+                return route, 200, "application/json", self.json_body(await self.run_blocking(self.list_products, query))
+            if parts == ["menu"] and method == "GET":
+                route = "menu"
+                since = query.get("since", "-1")
+                if not since.lstrip("-").isdigit():
+                    raise HttpError(HTTPStatus.BAD_REQUEST, "since must be a catalog version")
+                return route, 200, "application/json", await self.run_blocking(self.menu.menu, int(since))
+            if len(parts) == 2 and parts[0] == "images" and method == "GET":
+                route = "image"
+                return route, 200, *(await self.run_blocking(self.read_image, parts[1]))
+            if parts == ["metrics"] and method == "GET":
+                route = "metrics"
+                return route, 200, "text/plain; version=0.0.4; charset=utf-8", self.metrics.render_prometheus().encode("utf-8")
+            if parts == ["orders"] and method == "POST":
+                route = "orders"
+                status, result = await self.place_order(self.parse_json(body, ORDER_FORMAT), headers.get("idempotency-key"))
+                return route, status, "application/json", self.json_body(result)
+            if parts == ["orders", "sync"] and method == "POST":
+                route = "sync"
+                return route, 200, "application/json", self.json_body(await self.sync_orders(body))
+            if parts == ["orders"] and method == "GET":
+                route = "orders"
+                orders = await self.run_blocking(self.service.pending_orders)
+                return route, 200, "application/json", self.json_body(
+                    [{"order_id": order_id, "summary": summary, "total_price": total_price}
+                     for order_id, summary, total_price in orders])
+            if len(parts) >= 2 and parts[0] == "orders":
+                if not parts[1].isdigit():
+                    raise HttpError(HTTPStatus.NOT_FOUND)
+                order_id = int(parts[1])
+                if parts[2:] == [] and method == "GET":
+                    route = "order"
+                    order = await self.run_blocking(self.service.get_order, order_id)
+                    if order is None:
+                        raise HttpError(HTTPStatus.NOT_FOUND, f"No order {order_id}")
+                    return route, 200, "application/json", self.json_body(order)
+                if parts[2:] == ["complete"] and method == "POST":
+                    route = "complete"
+                    if await self.run_blocking(self.service.complete_order, order_id):
+                        if self.order_client is not None:
+                            self.notifier.submit(self.notify_completed, order_id)
+                        return route, 200, "application/json", self.json_body({"order_id": order_id, "status": "Completed"})
+                    order = await self.run_blocking(self.service.get_order, order_id)
+                    if order is None:
+                        raise HttpError(HTTPStatus.NOT_FOUND, f"No order {order_id}")
+                    raise HttpError(HTTPStatus.CONFLICT, f"Order {order_id} is already {order['status']}")
+                if parts[2:] == ["bill"] and method == "GET":
+                    route = "bill"
+                    text = await self.run_blocking(self.service.bill_text, order_id)
+                    if text is None:
+                        raise HttpError(HTTPStatus.NOT_FOUND, f"No order {order_id}")
+                    return route, 200, "text/plain; charset=utf-8", text.encode("utf-8")
+            raise HttpError(HTTPStatus.NOT_FOUND)
+        except HttpError as e:
+            return route, e.status, "application/json", self.json_body({"error": str(e)})
+        except Exception as e:
+            print(f"Error handling {method} {target}: {e}")
+            return route, 500, "application/json", self.json_body({"error": "Internal error"})
+
+    def list_products(self, query):
+        limit = query.get("limit", "100")
+        if not limit.isdigit():
+            raise HttpError(HTTPStatus.BAD_REQUEST, "limit must be a number")
+        if query.get("q"):
+            rows = self.service.search(query["q"], int(limit))
+        else:
+            rows = self.service.products(query.get("category"))[:int(limit)]
+        return [{"product_id": product_id, "name": name, "category": category, "price": price, "stock": stock}
+                for product_id, name, category, price, image_path, stock in rows]
+
+    def read_image(self, name):
+        path = self.menu.image_path(name)
+        if path is None:
+            raise HttpError(HTTPStatus.NOT_FOUND, f"No image {name}")
+        with open(path, "rb") as image:
+            data = image.read()
+        return mimetypes.guess_type(path)[0] or "application/octet-stream", data
+
+    def parse_json(self, body, expected):
+        try:
+            return json.loads(body)
+        except ValueError:
+            raise HttpError(HTTPStatus.BAD_REQUEST, expected)
+
+    async def place_order(self, request, key=None):
+        # 201 with the order, or 200 with the original order when the key
+        # was used before
+        try:
+            items = [(int(item["product_id"]), int(item.get("quantity", 1))) for item in request["items"]]
+            allow_partial = bool(request.get("allow_partial", True))
+            key = request.get("key", key)
+            customer = request.get("customer")
+        except (ValueError, KeyError, TypeError, AttributeError):
+            raise HttpError(HTTPStatus.BAD_REQUEST, ORDER_FORMAT)
+        if not items or any(quantity <= 0 for product_id, quantity in items):
+            raise HttpError(HTTPStatus.BAD_REQUEST, "An order needs at least one item with a positive quantity")
+        if key is not None and not (isinstance(key, str) and 0 < len(key) <= MAX_KEY):
+            raise HttpError(HTTPStatus.BAD_REQUEST, f"key must be a string of at most {MAX_KEY} characters")
+        if customer is not None and not (isinstance(customer, str) and 0 < len(customer) <= MAX_KEY):
+            raise HttpError(HTTPStatus.BAD_REQUEST, f"customer must be a string of at most {MAX_KEY} characters")
+        try:
+            lines = await self.run_blocking(self.service.price_lines, items)
+        except UnknownProduct as e:
+            raise HttpError(HTTPStatus.NOT_FOUND, str(e))
+        try:
+            order, short = await asyncio.wrap_future(self.service.place_order(lines, allow_partial, key, customer))
+        except OutOfStock as e:
+            raise HttpError(HTTPStatus.CONFLICT, str(e))
+        if order is None:
+            raise HttpError(HTTPStatus.CONFLICT, "None of the items are in stock")
+        replayed = order.pop("replayed", False)
+        if replayed:
+            self.orders_replayed.inc()
+            return 200, dict(order, short=short, replayed=True)
+        self.orders_placed.inc()
+        if self.order_client is not None:
+            self.notifier.submit(self.notify_order_server, order)
+        return 201, dict(order, short=short, replayed=False)
+
+    async def sync_orders(self, body):
+        # Orders a kiosk queued while offline, each with its key. They go to
+        # the order writer together, so they share its group commits, and
+        # each gets its own result: {"key", "status", ...order} or
+        # {"key", "status", "error"}.
+        request = self.parse_json(body, 'Expected {"orders": [...]}')
+        orders = request.get("orders") if isinstance(request, dict) else None
+        if not isinstance(orders, list) or not all(isinstance(order, dict) and order.get("key") for order in orders):
+            raise HttpError(HTTPStatus.BAD_REQUEST, 'Expected {"orders": [{"key": ..., "items": [...]}, ...]}')
+        if len(orders) > MAX_SYNC:
+            raise HttpError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, f"At most {MAX_SYNC} orders per sync")
+
+        async def place(order):
+            try:
+                status, result = await self.place_order(order)
+            except HttpError as e:
+                return {"key": order["key"], "status": e.status, "error": str(e)}
+            except Exception as e:
+                print(f"Error syncing order {order['key']}: {e}")
+                return {"key": order["key"], "status": 500, "error": "Internal error"}
+            return dict(result, key=order["key"], status=status)
+
+        return {"results": await asyncio.gather(*(place(order) for order in orders))}
+
+    def notify_order_server(self, order):
+        # Runs on the notifier thread. Pipelined on the one connection, so
+        # nothing waits for the reply.
+        try:
+            reply = self.order_client.submit(f"NEW_ORDER {json.dumps(order)}")
+        except OSError as e:
+            print(f"Could not notify order server: {e}")
+            return
+        reply.add_done_callback(lambda reply: reply.exception() and
+                                print(f"Could not notify order server: {reply.exception()}"))
+
+    def notify_completed(self, order_id):
+        # Runs on the notifier thread, after any NEW_ORDER for the order. The
+        # order server knows orders by number, so look that up first, as the
+        # owner screen does.
+        try:
+            reply = self.order_client.request(f"LOOKUP {order_id}")
+            if not reply.startswith("LOOKUP "):
+                raise ValueError(reply)
+            order_number = json.loads(reply[len("LOOKUP "):]).get(str(order_id))
+            if order_number is None:
+                return
+            reply = self.order_client.submit(f"COMPLETE_ORDER {order_number}")
+        except (OSError, ValueError) as e:
+            print(f"Could not notify order server: {e}")
+            return
+        reply.add_done_callback(lambda reply: reply.exception() and
+                                print(f"Could not notify order server: {reply.exception()}"))
+
+    async def serve(self):
+        server = await asyncio.start_server(self.handle_connection, self.host, self.port, limit=MAX_HEADER, backlog=1024)
+        print(f"API server started on http://{self.host}:{self.port}")
+        async with server:
+            await server.serve_forever()
+
+    def run(self):
+        try:
+            asyncio.run(self.serve())
+        finally:
+            self.service.close()
+            self.menu.close()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Canteen JSON ordering API")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--db", default="canteen.db")
+    parser.add_argument("--pool-size", type=int, default=4,
+                        help="database connections (and worker threads) shared by all requests")
+    parser.add_argument("--order-server", metavar="HOST:PORT",
+                        help="also announce new and completed orders to this order server so owner screens see them")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    initialize_database(args.db)
+    order_server = None
+    if args.order_server:
+        host, _, port = args.order_server.rpartition(":")
+        order_server = (host or "localhost", int(port))
+    ApiServer(args.host, args.port, args.db, args.pool_size, order_server).run()
@@ -0,0 +1,96 @@
+import argparse
+import json
+import random
+
+from kitchen import Kitchen, load_prep_times
+from schema import SAMPLE_PREP_TIMES
+
+# Kitchen scheduling simulation: one stream of orders (Poisson arrivals,
+# busier through the middle third for the lunch rush) is cooked once
+# strictly first-come-first-served and once by the priority scheduler with
+# cross-order batching, and the waits are compared. Each order is quoted a
+# ready time on arrival, as the order server does, and customers collect
+# their order as soon as it is ready. Time is simulated, so days of
+# orders run in seconds.
+
+# Relative popularity of the sample menu
+POPULARITY = {"Tea": 30, "Coffee": 12, "Samosa": 20, "Sandwich": 10, "Burger": 8, "Juice": 8,
+              "Lays": 5, "Dairy Milk": 4, "KitKat": 3}
+
+def generate_orders(count, rate, rush, seed):
+    # (arrival second, details) with rate orders per minute, rush times that
+    # through the middle third
+    rng = random.Random(seed)
+    products = list(POPULARITY)
+    weights = list(POPULARITY.values())
+    orders = []
+    t = 0.0
+    for index in range(count):
+        busy = count // 3 <= index < 2 * count // 3
+        t += rng.expovariate(rate * (rush if busy else 1) / 60)
+        items = {}
+        for product in rng.choices(products, weights, k=rng.choice((1, 1, 1, 2, 2, 3))):
+            items[product] = items.get(product, 0) + rng.choice((1, 1, 1, 2))
+        orders.append((t, json.dumps({"items": [{"product_name": product, "quantity": quantity}
+                                                for product, quantity in items.items()]})))
+    return orders
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def simulate(orders, prep_times, stations, policy, max_wait):
+    kitchen = Kitchen(prep_times, stations, policy, max_wait, clock=lambda: 0.0)
+    arrived = {}
+    promised = {}
+    waits = []
+    errors = []
+
+    def collect():
+        for number, ticket in list(kitchen.tickets.items()):
+            if ticket.ready_at is not None:
+                waits.append(ticket.ready_at - arrived[number])
+                errors.append(ticket.ready_at - promised[number])
+                kitchen.remove(number, now=kitchen.now)
+
+    for number, (t, details) in enumerate(orders, start=1):
+        kitchen.advance(t)
+        collect()
+        arrived[number] = t
+        kitchen.add(number, details, now=t)
+        kitchen.promise([number])
+        promised[number] = kitchen.promised.pop(number)
+    while kitchen.tickets:
+        kitchen.advance(kitchen.now + 60)
+        collect()
+    waits.sort()
+    errors.sort()
+    absolute = sorted(abs(error) for error in errors)
+    return {
+        "policy": policy,
+        "mean_wait_s": round(sum(waits) / len(waits), 1),
+        "p50_wait_s": round(percentile(waits, 0.5), 1),
+        "p90_wait_s": round(percentile(waits, 0.9), 1),
+        "p99_wait_s": round(percentile(waits, 0.99), 1),
+        "max_wait_s": round(waits[-1], 1),
+        "quote_error_p50_s": round(percentile(absolute, 0.5), 1),
+        "quote_error_p90_s": round(percentile(absolute, 0.9), 1),
+        "ready_later_than_quoted": round(sum(error > 60 for error in errors) / len(errors), 3),
+        "finished_at_s": round(kitchen.now),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare FIFO and priority kitchen scheduling in simulation")
+    parser.add_argument("--orders", type=int, default=1500)
+    parser.add_argument("--rate", type=float, default=0.6, help="orders per minute outside the rush")
+    parser.add_argument("--rush", type=float, default=1.5, help="arrival rate multiplier through the middle third")
+    parser.add_argument("--stations", type=int, default=3)
+    parser.add_argument("--max-wait", type=float, default=600,
+                        help="seconds after which an order is cooked first regardless of priority")
+    parser.add_argument("--menu-db", help="take prep times from this database instead of the sample menu")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    prep_times = load_prep_times(args.menu_db) if args.menu_db else SAMPLE_PREP_TIMES
+    orders = generate_orders(args.orders, args.rate, args.rush, args.seed)
+    results = [simulate(orders, prep_times, args.stations, policy, args.max_wait) for policy in ("fifo", "priority")]
+    print(json.dumps({"orders": args.orders, "stations": args.stations, "rate_per_min": args.rate,
+                      "rush": args.rush, "results": results}, indent=2))
@@ -0,0 +1,327 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from framing import encode_line
+
+# Headless load generator for OrderServer and ChatServer. N simulated kiosks
+# place orders and chat, M simulated owner consoles complete orders, follow
+# the order feed and read chat, all over the same line protocols the apps
+# use. Results are printed as JSON so runs can be compared across server
+# modes and changes.
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * fraction))
+    return round(sorted_values[index] * 1000, 3)
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, operation, seconds):
+        self.latencies.setdefault(operation, []).append(seconds)
+
+    def error(self, operation):
+        self.errors[operation] = self.errors.get(operation, 0) + 1
+
+    def merge(self, latencies, errors):
+        for operation, values in latencies.items():
+            self.latencies.setdefault(operation, []).extend(values)
+        for operation, count in errors.items():
+            self.errors[operation] = self.errors.get(operation, 0) + count
+
+    def summary(self, elapsed):
+        operations = {}
+        for operation in sorted(set(self.latencies) | set(self.errors)):
+            values = sorted(self.latencies.get(operation, []))
+            errors = self.errors.get(operation, 0)
+            operations[operation] = {
+                "count": len(values),
+                "errors": errors,
+                "error_rate": round(errors / (len(values) + errors), 4) if values or errors else 0.0,
+                "throughput_per_s": round(len(values) / elapsed, 1),
+                "p50_ms": percentile(values, 0.50),
+                "p95_ms": percentile(values, 0.95),
+                "p99_ms": percentile(values, 0.99),
+                "max_ms": round(values[-1] * 1000, 3) if values else None,
+            }
+        return operations
+
+def process_stats(pid):
+    # Resident memory and thread count from /proc; None where unavailable
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            fields = dict(line.split(":", 1) for line in status if ":" in line)
+        return int(fields["VmRSS"].split()[0]), int(fields["Threads"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+class ServerProcess:
+    def __init__(self, name, command):
+        self.name = name
+        self.process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.rss_peak_kb = None
+        self.threads_peak = None
+
+    def sample(self):
+        stats = process_stats(self.process.pid)
+        if stats:
+            rss, threads = stats
+            self.rss_peak_kb = max(self.rss_peak_kb or 0, rss)
+            self.threads_peak = max(self.threads_peak or 0, threads)
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+    def report(self):
+        return {"pid": self.process.pid, "rss_peak_kb": self.rss_peak_kb, "threads_peak": self.threads_peak}
+
+def wait_for_port(host, port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"Server on {host}:{port} did not start")
+
+async def request_loop(host, port, operation, make_command, recorder, stop, think):
+    try:
+        reader, writer = await asyncio.open_connection(host, port)
+    except OSError:
+        recorder.error(operation)
+        return
+    try:
+        while not stop.is_set():
+            started = time.perf_counter()
+            writer.write(encode_line(make_command()))
+            await writer.drain()
+            line = await reader.readline()
+            if not line or line.startswith(b"ERROR"):
+                recorder.error(operation)
+                if not line:
+                    return
+                continue
+            recorder.record(operation, time.perf_counter() - started)
+            if think:
+                await asyncio.sleep(think)
+    except (OSError, asyncio.IncompleteReadError):
+        recorder.error(operation)
+    finally:
+        writer.close()
+
+async def order_feed(host, port, recorder, stop):
+    # Counts pushed ORDER_* events the way OwnerApp's OrderFeed receives them
+    try:
+        reader, writer = await asyncio.open_connection(host, port)
+    except OSError:
+        recorder.error("order_feed")
+        return 0
+    writer.write(encode_line("SUBSCRIBE"))
+    events = 0
+    try:
+        while not stop.is_set():
+            try:
+                line = await asyncio.wait_for(reader.readline(), 0.2)
+            except asyncio.TimeoutError:
+                continue
+            if not line:
+                break
+            if line.startswith(b"ORDER_"):
+                events += 1
+    finally:
+        writer.close()
+    return events
+
+async def chat_sender(host, port, name, recorder, stop, interval):
+    try:
+        reader, writer = await asyncio.open_connection(host, port)
+    except OSError:
+        recorder.error("chat_send")
+        return
+    # Drain broadcasts from everyone else so the server never evicts us
+    drain = asyncio.ensure_future(drain_lines(reader))
+    try:
+        while not stop.is_set():
+            started = time.perf_counter()
+            writer.write(encode_line(f"Customer: bench {name} {time.time():.6f}"))
+            await writer.drain()
+            recorder.record("chat_send", time.perf_counter() - started)
+            await asyncio.sleep(interval)
+    except OSError:
+        recorder.error("chat_send")
+    finally:
+        drain.cancel()
+        writer.close()
+
+async def drain_lines(reader):
+    while await reader.readline():
+        pass
+
+async def chat_receiver(host, port, recorder, stop):
+    # Latency from a kiosk's send timestamp to this owner receiving it
+    try:
+        reader, writer = await asyncio.open_connection(host, port)
+    except OSError:
+        recorder.error("chat_fanout")
+        return
+    try:
+        while not stop.is_set():
+            try:
+                line = await asyncio.wait_for(reader.readline(), 0.2)
+            except asyncio.TimeoutError:
+                continue
+            if not line:
+                recorder.error("chat_fanout")
+                break
+            if line.startswith(b"/history_begin"):
+                # Replayed history is not a fan-out measurement
+                for _ in range(int(line.split()[1]) + 1):
+                    await reader.readline()
+                continue
+            parts = line.decode().split()
+            if len(parts) == 4 and parts[1] == "bench":
+                recorder.record("chat_fanout", time.time() - float(parts[3]))
+    finally:
+        writer.close()
+
+async def run_load(args, kiosks, owners, worker):
+    recorder = Recorder()
+    stop = asyncio.Event()
+    sequence = iter(range((worker << 40) + 1, (worker + 1) << 40))
+
+    def new_order():
+        order_id = next(sequence)
+        return "NEW_ORDER " + json.dumps({"order_id": order_id, "total_price": 10.0,
+                                          "items": [{"product_name": "Tea", "quantity": 1, "total_price": 10.0}]})
+
+    tasks = []
+    feeds = []
+    for kiosk in range(kiosks):
+        tasks.append(request_loop(args.host, args.order_port, "new_order", new_order, recorder, stop, args.think))
+        if args.chat_interval > 0:
+            tasks.append(chat_sender(args.host, args.chat_port, f"w{worker}k{kiosk}", recorder, stop, args.chat_interval))
+    for owner in range(owners):
+        tasks.append(request_loop(args.host, args.order_port, "complete_order", lambda: "COMPLETE_ORDER",
+                                  recorder, stop, args.think))
+        feeds.append(order_feed(args.host, args.order_port, recorder, stop))
+        if args.chat_interval > 0:
+            tasks.append(chat_receiver(args.host, args.chat_port, recorder, stop))
+
+    async def timer():
+        await asyncio.sleep(args.duration)
+        stop.set()
+
+    results = await asyncio.gather(timer(), asyncio.gather(*feeds), *tasks)
+    return recorder.latencies, recorder.errors, sum(results[1])
+
+def client_process(job):
+    # One event loop per process so the load generator is not the bottleneck
+    args, kiosks, owners, worker = job
+    return asyncio.run(run_load(args, kiosks, owners, worker))
+
+def split(total, parts):
+    return [total // parts + (1 if i < total % parts else 0) for i in range(parts)]
+
+def generate_load(args, servers):
+    done = threading.Event()
+
+    def sampler():
+        while not done.is_set():
+            for server in servers:
+                server.sample()
+            done.wait(0.25)
+
+    sampler_thread = threading.Thread(target=sampler, daemon=True)
+    sampler_thread.start()
+    processes = max(1, args.processes)
+    jobs = [(args, kiosks, owners, worker) for worker, (kiosks, owners)
+            in enumerate(zip(split(args.kiosks, processes), split(args.owners, processes)))]
+    started = time.perf_counter()
+    try:
+        with multiprocessing.Pool(processes) as pool:
+            results = pool.map(client_process, jobs)
+    finally:
+        done.set()
+        sampler_thread.join()
+    elapsed = time.perf_counter() - started
+
+    recorder = Recorder()
+    feed_events = 0
+    for latencies, errors, events in results:
+        recorder.merge(latencies, errors)
+        feed_events += events
+    return recorder.summary(elapsed), feed_events, elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Load benchmark for the order and chat servers")
+    parser.add_argument("--kiosks", type=int, default=50, help="simulated RestaurantApp terminals")
+    parser.add_argument("--owners", type=int, default=3, help="simulated OwnerApp consoles")
+    parser.add_argument("--duration", type=float, default=10, help="seconds of load")
+    parser.add_argument("--think", type=float, default=0, help="pause between requests per client, seconds")
+    parser.add_argument("--chat-interval", type=float, default=1.0, help="seconds between chat messages per kiosk (0 disables chat)")
+    parser.add_argument("--mode", choices=["threaded", "asyncio"], default="threaded", help="order server mode to launch")
+    parser.add_argument("--workers", type=int, default=1, help="order server worker processes to launch")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--order-port", type=int, default=18888)
+    parser.add_argument("--chat-port", type=int, default=19999)
+    parser.add_argument("--processes", type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="client processes the simulated terminals are spread across")
+    parser.add_argument("--external", action="store_true", help="benchmark already running servers instead of launching them")
+    parser.add_argument("--output", help="also write the JSON result to this file")
+    args = parser.parse_args()
+
+    servers = []
+    here = os.path.dirname(os.path.abspath(__file__))
+    # The servers' journal and queue database live only as long as the run
+    with tempfile.TemporaryDirectory(prefix="bench_servers_") as workdir:
+        try:
+            if not args.external:
+                servers.append(ServerProcess("order_server", [
+                    sys.executable, os.path.join(here, "order_server.py"), "--host", args.host,
+                    "--port", str(args.order_port), "--mode", args.mode,
+                    "--journal", os.path.join(workdir, "orders.journal"),
+                    "--workers", str(args.workers), "--queue-db", os.path.join(workdir, "orders.db")]))
+                if args.chat_interval > 0:
+                    servers.append(ServerProcess("chat_server", [
+                        sys.executable, os.path.join(here, "chat_server.py"), "--host", args.host,
+                        "--port", str(args.chat_port), "--stats-interval", "0", "--history", ""]))
+                wait_for_port(args.host, args.order_port)
+                if args.chat_interval > 0:
+                    wait_for_port(args.host, args.chat_port)
+            operations, feed_events, elapsed = generate_load(args, servers)
+        finally:
+            for server in servers:
+                server.stop()
+
+    result = {
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "elapsed_s": round(elapsed, 3),
+        "operations": operations,
+        "order_feed_events": feed_events,
+        "servers": {server.name: server.report() for server in servers},
+    }
+    output = json.dumps(result, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from schema import migrate
+from stock import OutOfStock, begin_immediate, open_database, reserve_stock
+
+# Concurrency benchmark for stock reservation: many terminal processes
+# place random carts against a few hot products at once, then the final
+# stock is checked against everything that was sold.
+
+def setup_database(path, products, stock):
+    conn = sqlite3.connect(path, isolation_level=None)
+    migrate(conn)
+    conn.execute('BEGIN')
+    conn.executemany('INSERT INTO products (id, name, category, price, image, stock) VALUES (?, ?, ?, ?, ?, ?)',
+                     [(i, f"Product {i}", "Bench", 10, "", stock) for i in range(1, products + 1)])
+    conn.execute('COMMIT')
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.close()
+
+def terminal(args):
+    path, products, carts, allow_partial, seed = args
+    rng = random.Random(seed)
+    conn = open_database(path, timeout=30)
+    sold = {}
+    placed = rejected = 0
+    lock_waits = []
+    for _ in range(carts):
+        lines = [(rng.randint(1, products), rng.randint(1, 3)) for _ in range(rng.randint(1, 4))]
+        started = time.perf_counter()
+        begin_immediate(conn)
+        lock_waits.append(time.perf_counter() - started)
+        try:
+            filled = reserve_stock(conn, lines, allow_partial=allow_partial)
+        except OutOfStock:
+            conn.execute('ROLLBACK')
+            rejected += 1
+            continue
+        order_id = conn.execute('INSERT INTO orders (total_price) VALUES (?)', (sum(filled) * 10,)).lastrowid
+        for (product_id, _), got in zip(lines, filled):
+            if got:
+                conn.execute('''
+                    INSERT INTO order_items (order_id, product_id, product_name, quantity, unit_price, total_price)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (order_id, product_id, f"Product {product_id}", got, 10, got * 10))
+                sold[product_id] = sold.get(product_id, 0) + got
+        conn.execute('COMMIT')
+        placed += 1
+    conn.close()
+    return sold, placed, rejected, lock_waits
+
+def run(terminals, carts, products, stock, allow_partial):
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    try:
+        setup_database(path, products, stock)
+        jobs = [(path, products, carts, allow_partial, seed) for seed in range(terminals)]
+        started = time.perf_counter()
+        with multiprocessing.Pool(terminals) as pool:
+            results = pool.map(terminal, jobs)
+        elapsed = time.perf_counter() - started
+
+        sold = {}
+        placed = rejected = 0
+        lock_waits = []
+        for terminal_sold, terminal_placed, terminal_rejected, waits in results:
+            for product_id, units in terminal_sold.items():
+                sold[product_id] = sold.get(product_id, 0) + units
+            placed += terminal_placed
+            rejected += terminal_rejected
+            lock_waits += waits
+
+        conn = sqlite3.connect(path)
+        final = dict(conn.execute('SELECT id, stock FROM products'))
+        ordered_units = conn.execute('SELECT COALESCE(SUM(quantity), 0) FROM order_items').fetchone()[0]
+        conn.close()
+        oversold = any(final[p] < 0 or sold.get(p, 0) != stock - final[p] for p in final)
+        lock_waits.sort()
+        return {
+            "terminals": terminals,
+            "carts_per_terminal": carts,
+            "products": products,
+            "initial_stock": stock,
+            "allow_partial": allow_partial,
+            "orders_placed": placed,
+            "orders_rejected": rejected,
+            "units_sold": sum(sold.values()),
+            "units_in_orders_table": ordered_units,
+            "oversold": oversold or ordered_units != sum(sold.values()),
+            "elapsed_s": round(elapsed, 3),
+            "carts_per_s": round((placed + rejected) / elapsed, 1),
+            "lock_wait_p50_ms": round(lock_waits[len(lock_waits) // 2] * 1000, 3),
+            "lock_wait_p99_ms": round(lock_waits[int(len(lock_waits) * 0.99)] * 1000, 3),
+            "lock_wait_max_ms": round(lock_waits[-1] * 1000, 3),
+        }
+    finally:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stock reservation contention benchmark")
+    parser.add_argument("--terminals", type=int, default=8)
+    parser.add_argument("--carts", type=int, default=500, help="carts placed by each terminal")
+    parser.add_argument("--products", type=int, default=5, help="few products means heavy contention")
+    parser.add_argument("--stock", type=int, default=1000)
+    parser.add_argument("--all-or-nothing", action="store_true", help="reject short carts instead of partially filling them")
+    args = parser.parse_args()
+    result = run(args.terminals, args.carts, args.products, args.stock, not args.all_or_nothing)
+    print(json.dumps(result, indent=2))
@@ -0,0 +1,191 @@
+import os
+import queue
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+SEPARATOR = b'\n\n'  # a blank line between bills keeps the archive readable
+
+# Background bill archiver. Bills are appended to one text archive instead
+# of a bill_<id>.txt file per order, and located through an append-only
+# index of "order_id offset length" lines that is loaded into a dict on
+# start. Whatever is queued when the writer thread wakes up goes out as one
+# write and one flush per file, so completing a backlog of orders costs a
+# handful of syscalls instead of an open/write/close each.
+#
+# The archive is written before the index, so after a crash any bytes past
+# the last indexed bill are a torn write and are cut off on start. Bills
+# are derived from the database, so a lost one can be rendered again with
+# CanteenService.bill_text.
+#
+# Every owner screen has its own BillWriter on the same files, so appends
+# and recovery happen under an exclusive lock on <archive>.lock and take
+# their offsets from the real end of the archive. A bill another screen
+# wrote is found by reading the index lines added since it was last read.
+class ArchiveLock:
+    def __init__(self, path):
+        self.file = open(path, 'a+b')
+
+    def __enter__(self):
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+            return self
+        self.file.seek(0)
+        while True:
+            try:
+                msvcrt.locking(self.file.fileno(), msvcrt.LK_LOCK, 1)
+                return self
+            except OSError:
+                # LK_LOCK gives up after ten seconds; keep waiting
+                pass
+
+    def __exit__(self, *exc_info):
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        else:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def close(self):
+        self.file.close()
+
+class BillWriter:
+    def __init__(self, path='bills.txt', index_path=None, fsync=False):
+        self.path = path
+        self.index_path = index_path or path + '.idx'
+        self.fsync = fsync
+        self.lock = threading.Lock()
+        self.index = {}  # order id -> (offset, length)
+        self.index_loaded = 0  # bytes of the index file read into self.index
+        self.file_lock = ArchiveLock(self.path + '.lock')
+        with self.file_lock:
+            self.recover()
+            self.archive = open(self.path, 'ab')
+            self.index_file = open(self.index_path, 'ab')
+        self.pending = queue.Queue()
+        self.bills_written = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def recover(self):
+        # Called with the file lock held
+        archive_size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if os.path.exists(self.index_path):
+            size = 0
+            valid = 0
+            with open(self.index_path, 'rb') as index_file:
+                for line in index_file:
+                    fields = line.split()
+                    if not line.endswith(b'\n') or len(fields) != 3:
+                        break
+                    order_id, offset, length = map(int, fields)
+                    if offset + length > archive_size:
+                        break
+                    self.index[order_id] = (offset, length)
+                    size = max(size, offset + length + len(SEPARATOR))
+                    valid += len(line)
+            if valid < os.path.getsize(self.index_path):
+                with open(self.index_path, 'r+b') as index_file:
+                    index_file.truncate(valid)
+            if size < archive_size:
+                with open(self.path, 'r+b') as archive:
+                    archive.truncate(size)
+            self.index_loaded = valid
+        # Without an index nothing in the archive can be located, but it is
+        # never thrown away; new bills are appended after it
+
+    def load_index(self):
+        # Index lines other screens appended since the last look. Called
+        # with self.lock held.
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, 'rb') as index_file:
+            index_file.seek(self.index_loaded)
+            for line in index_file:
+                fields = line.split()
+                if not line.endswith(b'\n') or len(fields) != 3:
+                    break
+                order_id, offset, length = map(int, fields)
+                self.index[order_id] = (offset, length)
+                self.index_loaded += len(line)
+
+    def submit(self, bills):
+        # bills: (order_id, text) pairs. Returns at once; the bills are
+        # readable through read() as soon as the writer has flushed them.
+        bills = list(bills)
+        if bills:
+            self.pending.put(bills)
+
+    def run(self):
+        while True:
+            batch = self.pending.get()
+            if batch is None:
+                break
+            stop = False
+            while True:
+                try:
+                    more = self.pending.get_nowait()
+                except queue.Empty:
+                    break
+                if more is None:
+                    stop = True
+                    break
+                batch += more
+            self.write_batch(batch)
+            if stop:
+                break
+        self.archive.close()
+        self.index_file.close()
+        self.file_lock.close()
+
+    def write_batch(self, batch):
+        chunks = []
+        entries = []
+        try:
+            with self.file_lock:
+                # Other screens append to the same archive, so the offsets
+                # start at its real end rather than where this writer left it
+                offset = os.fstat(self.archive.fileno()).st_size
+                for order_id, text in batch:
+                    data = text.encode('utf-8')
+                    chunks.append(data + SEPARATOR)
+                    entries.append((order_id, offset, len(data)))
+                    offset += len(data) + len(SEPARATOR)
+                self.archive.write(b''.join(chunks))
+                self.archive.flush()
+                if self.fsync:
+                    os.fsync(self.archive.fileno())
+                self.index_file.write(''.join(f"{order_id} {start} {length}\n"
+                                              for order_id, start, length in entries).encode('ascii'))
+                self.index_file.flush()
+                if self.fsync:
+                    os.fsync(self.index_file.fileno())
+        except OSError as e:
+            # Later bills go after whatever part of this batch got written
+            print(f"Could not save {len(batch)} bills: {e}")
+            return
+        with self.lock:
+            for order_id, start, length in entries:
+                self.index[order_id] = (start, length)
+        self.bills_written += len(entries)
+
+    def read(self, order_id):
+        with self.lock:
+            span = self.index.get(order_id)
+            if span is None:
+                self.load_index()
+                span = self.index.get(order_id)
+        if span is None:
+            return None
+        with open(self.path, 'rb') as archive:
+            archive.seek(span[0])
+            return archive.read(span[1]).decode('utf-8')
+
+    def close(self):
+        self.pending.put(None)
+        self.thread.join()
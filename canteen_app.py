@@ -1,177 +1,86 @@
+import time
+
+# Taken before the other imports so time to first frame includes loading tkinter,
+# sqlite3 and our own modules, which is a large part of a cold start.
+STARTED = time.perf_counter()
+
+import argparse
 import tkinter as tk
-from tkinter import messagebox, ttk, scrolledtext
-from PIL import Image, ImageTk, UnidentifiedImageError
+from tkinter import messagebox
 import sqlite3
+import json
+import queue
+import re
+from concurrent import futures
 import socket
-import threading
-
-# Database Initialization
-def initialize_database():
-    conn = sqlite3.connect('canteen.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS products (
-            id INTEGER PRIMARY KEY,
-            name TEXT,
-            category TEXT,
-            price REAL,
-            image TEXT,
-            stock INTEGER
-        )
-    ''')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS orders (
-            id INTEGER PRIMARY KEY,
-            product_name TEXT,
-            quantity INTEGER,
-            total_price REAL,
-            status TEXT
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-# Populate Database
-def populate_database():
-    conn = sqlite3.connect('canteen.db')
-    cursor = conn.cursor()
-    
-    # Check if products table is empty before populating
-    cursor.execute('SELECT COUNT(*) FROM products')
-    count = cursor.fetchone()[0]
-    if count == 0:
-        products = [
-            ("Samosa", "Snacks", 10, "images/samosa.jpg", 10),
-            ("Sandwich", "Snacks", 30, "images/sandwich.jpg", 10),
-            ("Burger", "Snacks", 50, "images/burger.jpg", 10),
-            ("Tea", "Beverages", 10, "images/tea.jpg", 10),
-            ("Coffee", "Beverages", 20, "images/coffee.jpg", 10),
-            ("Juice", "Beverages", 15, "images/juice.jpg", 10),
-            ("Lays", "Chips & Chocolates", 20, "images/lays.jpg", 10),
-            ("Dairy Milk", "Chips & Chocolates", 30, "images/dairymilk.jpg", 10),
-            ("KitKat", "Chips & Chocolates", 25, "images/kitkat.png", 10)
-        ]
-        
-        cursor.executemany('INSERT INTO products (name, category, price, image, stock) VALUES (?, ?, ?, ?, ?)', products)
-        conn.commit()
-
-    conn.close()
-# Chat Server
-class ChatServer:
-    def __init__(self, host="localhost", port=9999):
-        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server.bind((host, port))
-        self.server.listen(5)
-        print(f"Chat server started on {host}:{port}")
-        self.clients = []
-
-    def broadcast(self, message, client_socket):
-        for client in self.clients:
-            if client != client_socket:
-                try:
-                    client.send(message)
-                except:
-                    client.close()
-                    self.clients.remove(client)
-
-    def handle_client(self, client_socket):
-        while True:
-            try:
-                message = client_socket.recv(1024)
-                if message:
-                    print(f"Received: {message.decode()}")
-                    self.broadcast(message, client_socket)
-            except:
-                client_socket.close()
-                self.clients.remove(client_socket)
-                break
+import uuid
 
-    def run(self):
-        while True:
-            client_socket, addr = self.server.accept()
-            self.clients.append(client_socket)
-            print(f"Client connected from {addr}")
-            client_handler = threading.Thread(target=self.handle_client, args=(client_socket,))
-            client_handler.start()
-
-# Chat Client
-class ChatClient(tk.Frame):
-    def __init__(self, master, host="localhost", port=9999):
-        super().__init__(master)
-        self.master = master
-        self.host = host
-        self.port = port
-        self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.create_widgets()
-        self.connect_to_server()
-
-    def create_widgets(self):
-        self.chat_display = scrolledtext.ScrolledText(self, state='disabled', width=50, height=15)
-        self.chat_display.pack(pady=10)
-        self.chat_display.tag_config('received', foreground='blue')
-        self.chat_display.tag_config('sent', foreground='green')
-        self.message_entry = tk.Entry(self, width=50)
-        self.message_entry.pack(pady=10)
-        self.send_button = tk.Button(self, text="Send", command=self.send_message, bg="#4CAF50", fg="white")
-        self.send_button.pack(pady=10)
-
-    def connect_to_server(self):
-        try:
-            self.client_socket.connect((self.host, self.port))
-            self.receive_thread = threading.Thread(target=self.receive_messages)
-            self.receive_thread.start()
-        except Exception as e:
-            messagebox.showerror("Connection Error", str(e))
-
-    def receive_messages(self):
-        while True:
-            try:
-                message = self.client_socket.recv(1024).decode()
-                if message:
-                    self.chat_display.config(state='normal')
-                    self.chat_display.insert(tk.END, message + "\n", 'received')
-                    self.chat_display.config(state='disabled')
-                    self.chat_display.yview(tk.END)
-            except:
-                break
-
-    def send_message(self):
-        message = self.message_entry.get()
-        if message:
-            self.client_socket.send(f"Customer: {message}".encode())
-            self.chat_display.config(state='normal')
-            self.chat_display.insert(tk.END, f"Me: {message}\n", 'sent')
-            self.chat_display.config(state='disabled')
-            self.chat_display.yview(tk.END)
-            self.message_entry.delete(0, tk.END)
+from catalog import Catalog, load_catalog_state
+from chat_client import ChatClient
+from framing import ReconnectingClient
+from canteen_service import Cart, CanteenService
+from kiosk_sync import KioskSync
+from product_grid import ProductGrid
+from schema import initialize_database
+from thumbnail_cache import ThumbnailCache
 
 # Order Client
 class OrderClient:
+    # Connects in the background and reconnects on its own; requests raise
+    # ConnectionError while the order server is unreachable
     def __init__(self, host="localhost", port=8888):
-        self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.client_socket.connect((host, port))
+        self.connection = ReconnectingClient(host, port)
+
+    def request(self, command):
+        return self.connection.request(command)
 
     def send_order(self, order_details):
-        self.client_socket.send(f"NEW_ORDER {order_details}".encode())
-        return self.client_socket.recv(1024).decode()
+        # Pipelined: returns a Future for the reply instead of waiting on it
+        return self.connection.submit(f"NEW_ORDER {order_details}")
 
     def complete_order(self):
-        self.client_socket.send("COMPLETE_ORDER".encode())
-        return self.client_socket.recv(1024).decode()
+        return self.request("COMPLETE_ORDER")
 
 # Main Application
 class RestaurantApp(tk.Tk):
-    def __init__(self):
+    def __init__(self, db_path='canteen.db', remote=None):
+        # With remote (a KioskSync) the menu comes from its local cache at
+        # db_path and orders go to the API server through its outbox
         super().__init__()
         self.title("Restaurant Management App")
         self.geometry("1000x600")
-        self.conn = sqlite3.connect('canteen.db')
+        self.remote = remote
+        self.conn = sqlite3.connect(db_path)
+        # The window is built around an empty catalog; the full load and
+        # indexing run on a worker thread and are adopted when ready
+        self.catalog = Catalog(self.conn, load=False)
+        self.catalog_load = futures.ThreadPoolExecutor(max_workers=1)
+        self.catalog_future = self.catalog_load.submit(load_catalog_state, db_path)
+        self.catalog_load.shutdown(wait=False)
+        # Order placement goes through the same service layer as the API server
+        self.service = CanteenService(db_path, catalog=self.catalog) if remote is None else None
+        self.catalog.subscribe(self.on_catalog_changed)
+        self.current_view = ("category", "All Products")
+        self.search_job = None
+        self.shown_categories = None
+        self.thumbnails = ThumbnailCache()
+        # (callback, future) pairs for Futures that finished on other threads;
+        # poll_results runs the callbacks on the Tk thread
+        self.results = queue.Queue()
         self.create_menu()
         self.create_widgets()
-        self.order_items = []
-        self.order_client = OrderClient()  # Initialize the order client
+        self.after(10, self.finish_catalog_load)
+        self.after(50, self.poll_results)
+        self.bind("<Map>", self.report_first_frame)
+        self.cart = Cart()
+        # A remote kiosk's orders reach the order server through the API server
+        self.order_client = OrderClient() if remote is None else None
         self.chat_client = None
-        self.discount = 0  # Initialize discount
+        # Identifies this kiosk's chat channel with the owners, and owns
+        # the orders it places; random so other kiosks cannot claim it
+        self.customer_id = re.sub(r"[^A-Za-z0-9_.-]", "-", f"{socket.gethostname()}-{uuid.uuid4().hex[:12]}")
+        self.placed_orders = []
+        self.remote_orders = {}  # outbox key -> whether the kiosk was told it is waiting offline
 
     def create_menu(self):
         menubar = tk.Menu(self)
@@ -189,6 +98,8 @@ class RestaurantApp(tk.Tk):
 
         self.product_frame = tk.Frame(self, bg="#ffffff")
         self.product_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.product_grid = ProductGrid(self.product_frame, self.thumbnails, self.add_to_order)
+        self.product_grid.pack(fill=tk.BOTH, expand=True)
 
         self.order_frame = tk.Frame(self, bg="#f0f0f0")
         self.order_frame.pack(side=tk.RIGHT, fill=tk.Y)
@@ -197,79 +108,115 @@ class RestaurantApp(tk.Tk):
         self.create_order_section()
 
     def create_category_buttons(self):
+        tk.Label(self.category_frame, text="Search", font=("Arial", 16), bg="#f0f0f0").pack(pady=(10, 0))
+        self.search_entry = tk.Entry(self.category_frame)
+        self.search_entry.pack(fill=tk.X, pady=5, padx=10)
+        self.search_entry.bind("<KeyRelease>", self.schedule_search)
         tk.Label(self.category_frame, text="Categories", font=("Arial", 16), bg="#f0f0f0").pack(pady=10)
+        self.category_buttons = tk.Frame(self.category_frame, bg="#f0f0f0")
+        self.category_buttons.pack(fill=tk.X)
+        self.show_category_buttons()
+
+    def show_category_buttons(self):
         categories = ["All Products"] + self.get_categories()
+        if categories == self.shown_categories:
+            return
+        self.shown_categories = categories
+        for button in self.category_buttons.winfo_children():
+            button.destroy()
         for category in categories:
-            button = tk.Button(self.category_frame, text=category, command=lambda c=category: self.show_products(c), bg="#4CAF50", fg="white")
+            button = tk.Button(self.category_buttons, text=category, command=lambda c=category: self.show_products(c), bg="#4CAF50", fg="white")
             button.pack(fill=tk.X, pady=5, padx=10)
 
+    def finish_catalog_load(self):
+        if not self.catalog_future.done():
+            self.after(10, self.finish_catalog_load)
+            return
+        try:
+            self.catalog.adopt(self.catalog_future.result())
+        except sqlite3.Error as e:
+            print(f"Background catalog load failed, loading here: {e}")
+            self.catalog.refresh()
+        print(f"Catalog ready after {(time.perf_counter() - STARTED) * 1000:.0f} ms")
+        self.warm_thumbnails()
+        self.after(2000, self.poll_catalog)
+
+    def report_first_frame(self, event):
+        if event.widget is self:
+            self.unbind("<Map>")
+            # Idle callbacks run once the mapped window has been drawn
+            self.after_idle(lambda: print(f"Time to first frame: {(time.perf_counter() - STARTED) * 1000:.0f} ms"))
+
+    def warm_thumbnails(self):
+        self.thumbnails.warm(row[4] for row in self.catalog.products() if row[5] > 0)
+
     def get_categories(self):
-        cursor = self.conn.cursor()
-        cursor.execute('SELECT DISTINCT category FROM products')
-        categories = [row[0] for row in cursor.fetchall()]
-        return categories
+        return self.catalog.categories()
 
-    def show_products(self, category):
-        for widget in self.product_frame.winfo_children():
-            widget.destroy()
+    def show_rows(self, rows):
+        # The grid recycles its tiles, so switching views creates no widgets
+        self.product_grid.set_products([(product_id, name, price, image_path)
+                                        for product_id, name, category, price, image_path, stock in rows if stock > 0])
 
-        cursor = self.conn.cursor()
-        if category == "All Products":
-            cursor.execute('SELECT name, price, image, stock FROM products')
+    def show_products(self, category):
+        self.current_view = ("category", category)
+        self.show_rows(self.catalog.products(None if category == "All Products" else category))
+
+    def schedule_search(self, event=None):
+        # Debounced so a fast typist triggers one search, not one per key
+        if self.search_job is not None:
+            self.after_cancel(self.search_job)
+        self.search_job = self.after(150, self.run_search)
+
+    def run_search(self):
+        self.search_job = None
+        text = self.search_entry.get().strip()
+        if not text:
+            self.show_products("All Products")
+            return
+        self.current_view = ("search", text)
+        self.show_rows(self.catalog.search(text, limit=100))
+
+    def poll_catalog(self):
+        # Picks up product changes made by other terminals or the owner
+        self.catalog.refresh()
+        if self.remote is not None:
+            queued = self.remote.queued()
+            status = "" if self.remote.online is not False else " (offline)"
+            if queued:
+                status += f" - {queued} orders waiting to be sent"
+            self.title("Restaurant Management App" + status)
+        self.after(2000, self.poll_catalog)
+
+    def on_catalog_changed(self, changed_ids):
+        # Patches the shown products in place: changed ones are refilled,
+        # ones that went out of stock or left the view are dropped and new
+        # ones are added at the end, all without scrolling the grid
+        self.show_category_buttons()
+        kind, value = self.current_view
+        if kind == "search":
+            matches = {row[0] for row in self.catalog.search(value, limit=100)}
+            in_view = lambda row: row[0] in matches
         else:
-            cursor.execute('SELECT name, price, image, stock FROM products WHERE category = ?', (category,))
-
-        self.product_images = {}
-        canvas = tk.Canvas(self.product_frame, bg="#ffffff")
-        scrollbar = ttk.Scrollbar(self.product_frame, orient=tk.VERTICAL, command=canvas.yview)
-        scrollable_frame = ttk.Frame(canvas)
-        scrollable_frame.bind(
-            "<Configure>",
-            lambda e: canvas.configure(
-                scrollregion=canvas.bbox("all")
-            )
-        )
-        canvas.create_window((0, 0), window=scrollable_frame, anchor="nw")
-        canvas.configure(yscrollcommand=scrollbar.set)
-
-        row = 0
-        column = 0
-
-        for name, price, image_path, stock in cursor.fetchall():
-            if stock > 0:
-                try:
-                    img = Image.open(image_path)
-                    img = img.resize((150, 150), Image.Resampling.LANCZOS)
-                    img = ImageTk.PhotoImage(img)
-                    self.product_images[name] = img
-                except UnidentifiedImageError as e:
-                    print(f"Error loading image {image_path}: {e}")
-                    img = ImageTk.PhotoImage(Image.new("RGB", (150, 150), "white"))
-                except Exception as e:
-                    print(f"Unexpected error: {e}")
-                    img = ImageTk.PhotoImage(Image.new("RGB", (150, 150), "white"))
-
-                frame = tk.Frame(scrollable_frame, bg="#ffffff", bd=1, relief="solid")
-                frame.grid(row=row, column=column, padx=10, pady=10)
-                
-                button = tk.Button(
-                    frame,
-                    text=f"{name}\n(₹{price})",
-                    image=img,
-                    compound=tk.TOP,
-                    width=150,
-                    height=200,
-                    command=lambda p=name, pr=price: self.add_to_order(p, pr)
-                )
-                button.pack()
-
-                column += 1
-                if column > 2:
-                    column = 0
-                    row += 1
-
-        canvas.pack(side="left", fill="both", expand=True)
-        scrollbar.pack(side="right", fill="y")
+            in_view = lambda row: value == "All Products" or row[2] == value
+        changed = set(changed_ids)
+        shown = []
+        for product in self.product_grid.products:
+            if product[0] in changed:
+                row = self.catalog.get(product[0])
+                if row is not None and row[5] > 0 and in_view(row):
+                    shown.append((row[0], row[1], row[3], row[4]))
+                changed.discard(product[0])
+            else:
+                shown.append(product)
+        for product_id in changed_ids:
+            if product_id not in changed:
+                continue
+            changed.discard(product_id)
+            row = self.catalog.get(product_id)
+            if row is not None and row[5] > 0 and in_view(row):
+                shown.append((row[0], row[1], row[3], row[4]))
+        self.product_grid.update_products(shown)
 
     def create_order_section(self):
         tk.Label(self.order_frame, text="Order", font=("Arial", 16), bg="#f0f0f0").pack(pady=10)
@@ -277,60 +224,172 @@ class RestaurantApp(tk.Tk):
         self.order_listbox.pack(fill=tk.BOTH, expand=True, pady=5, padx=10)
         self.total_label = tk.Label(self.order_frame, text="Total: ₹0", font=("Arial", 14), bg="#f0f0f0")
         self.total_label.pack(pady=10)
-        tk.Button(self.order_frame, text="Place Order", command=self.place_order, bg="#4CAF50", fg="white").pack(pady=5, padx=10)
+        # Latest order and, from a scheduling order server, when it will be ready
+        self.status_label = tk.Label(self.order_frame, text="", font=("Arial", 12), bg="#f0f0f0", wraplength=200)
+        self.status_label.pack(pady=5)
+        self.place_button = tk.Button(self.order_frame, text="Place Order", command=self.place_order, bg="#4CAF50", fg="white")
+        self.place_button.pack(pady=5, padx=10)
         tk.Button(self.order_frame, text="Clear Order", command=self.clear_order, bg="#4CAF50", fg="white").pack(pady=5, padx=10)
         tk.Button(self.order_frame, text="Apply Discount", command=self.apply_discount, bg="#4CAF50", fg="white").pack(pady=5, padx=10)
 
-    def add_to_order(self, product, price):
+    def add_to_order(self, product_id, product, price):
         quantity = 1
         order_entry = f"{product} x{quantity} - ₹{price * quantity}"
-        self.order_items.append((product, price, quantity))
+        self.cart.add(product_id, product, price, quantity)
         self.order_listbox.insert(tk.END, order_entry)
         self.update_total()
 
     def update_total(self):
-        total = sum(price * quantity for product, price, quantity in self.order_items)
-        discounted_total = total - (total * self.discount / 100)
-        self.total_label.config(text=f"Total: ₹{discounted_total:.2f} (Discount: {self.discount}%)")
+        self.total_label.config(text=f"Total: ₹{self.cart.total():.2f} (Discount: {self.cart.discount}%)")
 
     def clear_order(self):
-        self.order_items.clear()
+        self.cart.clear()
         self.order_listbox.delete(0, tk.END)
         self.update_total()
 
     def apply_discount(self):
-        self.discount = 10  # Example: Apply a flat 10% discount
+        self.cart.discount = 10  # Example: Apply a flat 10% discount
         self.update_total()
 
     def place_order(self):
-        if not self.order_items:
+        if not self.cart:
             messagebox.showerror("Error", "No items in the order.")
             return
+        if self.remote is not None:
+            self.place_remote_order()
+            return
+
+        # The order writer reserves stock and writes the rows in a group
+        # commit shared with other submissions, then acknowledges; the
+        # window stays responsive meanwhile
+        self.place_button.config(state=tk.DISABLED)
+        self.when_done(self.service.place_cart(self.cart, customer=self.customer_id), self.order_written)
+
+    def when_done(self, future, callback):
+        future.add_done_callback(lambda future: self.results.put((callback, future)))
+
+    def poll_results(self):
+        # Rescheduled first so results keep arriving while a dialog opened
+        # by one of the callbacks is up
+        self.after(50, self.poll_results)
+        while True:
+            try:
+                callback, future = self.results.get_nowait()
+            except queue.Empty:
+                break
+            callback(future)
+        if self.remote is not None:
+            self.poll_remote_orders()
 
-        conn = sqlite3.connect('canteen.db')
-        cursor = conn.cursor()
+    def order_written(self, future):
+        self.place_button.config(state=tk.NORMAL)
+        try:
+            order, short = future.result()
+        except Exception as e:
+            messagebox.showerror("Error", f"Could not place the order: {e}")
+            return
 
-        for product, price, quantity in self.order_items:
-            total_price = price * quantity
-            cursor.execute('''
-                INSERT INTO orders (product_name, quantity, total_price, status)
-                VALUES (?, ?, ?, ?)
-            ''', (product, quantity, total_price, "Pending"))
+        # Sold-out products drop out of the grid right away
+        self.catalog.refresh()
+        if order is None:
+            messagebox.showerror("Out of Stock", "None of the items in this order are in stock any more.")
+            self.clear_order()
+            return
 
-        conn.commit()
-        conn.close()
+        # Let the order server push the new order to the owner screens; its
+        # reply may carry a ready time, shown when it arrives
+        try:
+            reply = self.order_client.send_order(json.dumps(order))
+        except OSError as e:
+            print(f"Could not notify order server: {e}")
+        else:
+            self.when_done(reply, lambda reply, order_id=order["order_id"]: self.show_ready(order_id, reply))
+        self.clear_order()
+        self.order_placed(order, short)
 
-        messagebox.showinfo("Order Placed", "Your order has been placed successfully.")
+    def place_remote_order(self):
+        # The order is safe in the local outbox as soon as it is queued, so
+        # the cart is cleared at once and the sync thread sends it
+        key = self.remote.place([(product_id, quantity) for product_id, name, price, quantity in self.cart],
+                                customer=self.customer_id)
         self.clear_order()
+        self.remote_orders[key] = False
+        self.status_label.config(text="Sending your order...")
+        self.poll_remote_orders()
+
+    def poll_remote_orders(self):
+        # Outcomes of queued orders, and a note for any order still waiting
+        # while the server is unreachable
+        while True:
+            try:
+                key, result = self.remote.outcomes.get_nowait()
+            except queue.Empty:
+                break
+            if self.remote_orders.pop(key, None) is None:
+                continue  # queued by an earlier run of the kiosk
+            if result["status"] == 409:
+                self.status_label.config(text="")
+                messagebox.showerror("Out of Stock", "None of the items in this order are in stock any more.")
+            elif result["status"] >= 300:
+                self.status_label.config(text="")
+                messagebox.showerror("Error", f"Could not place the order: {result.get('error')}")
+            else:
+                self.order_placed(result, result["short"])
+        if self.remote.online is False:
+            waiting = [key for key, told in self.remote_orders.items() if not told]
+            for key in waiting:
+                self.remote_orders[key] = True
+            if waiting:
+                self.status_label.config(text="Order saved; it will be sent when the server is back.")
+                messagebox.showinfo("Order Saved", "The server cannot be reached right now. Your order has been saved "
+                                                   "and will be sent as soon as it is back.")
+
+    def order_placed(self, order, short):
+        self.placed_orders.append(order["order_id"])
+        self.status_label.config(text=f"Order {order['order_id']} placed.")
+        if self.chat_client is not None:
+            try:
+                self.chat_client.join(f"order:{order['order_id']}")
+            except OSError:
+                pass
+
+        if short:
+            messagebox.showwarning("Order Placed", "Your order has been placed, but these items ran out: " + ", ".join(short) + ".")
+        else:
+            messagebox.showinfo("Order Placed", "Your order has been placed successfully.")
+
+    def show_ready(self, order_id, reply):
+        # An order server running the kitchen scheduler ends its reply with
+        # "Ready in about N min."
+        try:
+            text = reply.result()
+        except OSError as e:
+            print(f"Could not notify order server: {e}")
+            return
+        match = re.search(r"Ready (now|in about \d+ min)\.", text)
+        if match and order_id == self.placed_orders[-1]:
+            self.status_label.config(text=f"Order {order_id} placed. {match.group(0)}")
 
     def open_chat(self):
         chat_window = tk.Toplevel(self)
         chat_window.title("Chat")
-        self.chat_client = ChatClient(chat_window)
+        self.chat_client = ChatClient(chat_window, "Customer", hello=f"/hello customer {self.customer_id}",
+                                      channels=[f"order:{order_id}" for order_id in self.placed_orders])
         self.chat_client.pack()
 
 if __name__ == "__main__":
-    initialize_database()
-    populate_database()
-    app = RestaurantApp()
-    app.mainloop()
+    parser = argparse.ArgumentParser(description="Canteen ordering kiosk")
+    parser.add_argument("--server", metavar="URL",
+                        help="API server to take the menu from and send orders to (e.g. http://canteen:8080), "
+                             "for kiosks without access to canteen.db")
+    parser.add_argument("--cache", default="kiosk_cache.db", help="with --server: local menu cache and order outbox")
+    args = parser.parse_args()
+    if args.server:
+        remote = KioskSync(args.server, args.cache).start()
+        app = RestaurantApp(args.cache, remote)
+        app.mainloop()
+        remote.close()
+    else:
+        initialize_database()
+        app = RestaurantApp()
+        app.mainloop()
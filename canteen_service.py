@@ -0,0 +1,246 @@
+import contextlib
+import queue
+import sqlite3
+import threading
+import time
+
+import analytics
+from catalog import Catalog
+from order_writer import OrderWriter
+
+# GUI-free ordering logic shared by RestaurantApp, OwnerApp and the HTTP API
+# server: catalog lookups, carts, order placement, completion and bills.
+# Everything here is safe to call from several threads.
+
+# UPDATE ... RETURNING arrived in SQLite 3.35; older builds select first
+HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+class UnknownProduct(LookupError):
+    def __init__(self, product_id):
+        super().__init__(f"Unknown product {product_id}")
+        self.product_id = product_id
+
+class Cart:
+    def __init__(self):
+        self.items = []  # (product_id, product_name, price, quantity)
+        self.discount = 0  # percent, shown on the running total
+
+    def add(self, product_id, product_name, price, quantity=1):
+        item = (product_id, product_name, price, quantity)
+        self.items.append(item)
+        return item
+
+    def subtotal(self):
+        return sum(price * quantity for product_id, product_name, price, quantity in self.items)
+
+    def total(self):
+        subtotal = self.subtotal()
+        return subtotal - subtotal * self.discount / 100
+
+    def clear(self):
+        self.items.clear()
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+class ConnectionPool:
+    # A fixed set of autocommit connections handed out one thread at a time,
+    # so request handlers skip the connect cost and never share a connection
+    def __init__(self, path='canteen.db', size=4, timeout=5.0):
+        self.path = path
+        self.timeout = timeout
+        self.idle = queue.LifoQueue()
+        self.slots = threading.Semaphore(size)
+
+    @contextlib.contextmanager
+    def connection(self):
+        if not self.slots.acquire(timeout=self.timeout):
+            raise sqlite3.OperationalError("No database connection available")
+        try:
+            conn = self.idle.get_nowait()
+        except queue.Empty:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+        try:
+            yield conn
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            self.idle.put(conn)
+            self.slots.release()
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+class CanteenService:
+    def __init__(self, path='canteen.db', pool_size=4, catalog=None, writer=None, refresh_interval=1.0):
+        # A Tk app passes its own catalog (refreshed on the Tk thread) and
+        # writer; otherwise the service keeps its own, created on first use
+        self.path = path
+        self.pool = ConnectionPool(path, pool_size)
+        self.owns_catalog = catalog is None
+        self.catalog = catalog
+        self.catalog_lock = threading.Lock()
+        self.catalog_checked = 0.0
+        self.refresh_interval = refresh_interval
+        self.writer = writer
+        self.writer_lock = threading.Lock()
+
+    # Catalog
+
+    def current_catalog(self):
+        # Called with catalog_lock held. Picks up changes at most once per
+        # refresh_interval so busy readers do not query the version each time.
+        if self.catalog is None:
+            self.catalog = Catalog(sqlite3.connect(self.path, check_same_thread=False))
+            self.catalog_checked = time.monotonic()
+        elif self.owns_catalog and time.monotonic() - self.catalog_checked >= self.refresh_interval:
+            self.catalog.refresh()
+            self.catalog_checked = time.monotonic()
+        return self.catalog
+
+    def categories(self):
+        with self.catalog_lock:
+            return self.current_catalog().categories()
+
+    def products(self, category=None):
+        with self.catalog_lock:
+            return self.current_catalog().products(category)
+
+    def search(self, text, limit=20):
+        with self.catalog_lock:
+            return self.current_catalog().search(text, limit)
+
+    def price_lines(self, items):
+        # (product_id, quantity) pairs -> order lines priced from the
+        # catalog, never from what a client claims
+        with self.catalog_lock:
+            catalog = self.current_catalog()
+            lines = []
+            for product_id, quantity in items:
+                row = catalog.get(product_id)
+                if row is None:
+                    raise UnknownProduct(product_id)
+                lines.append((product_id, row[1], row[3], quantity))
+            return lines
+
+    # Orders
+
+    def order_writer(self):
+        with self.writer_lock:
+            if self.writer is None:
+                self.writer = OrderWriter(self.path)
+            return self.writer
+
+    def place_order(self, lines, allow_partial=True, key=None, customer=None):
+        # lines: (product_id, product_name, price, quantity). Returns the
+        # OrderWriter Future resolving to (order, short_product_names); see
+        # OrderWriter.submit for key and customer.
+        return self.order_writer().submit(lines, allow_partial, key, customer)
+
+    def place_cart(self, cart, allow_partial=True, customer=None):
+        return self.place_order(list(cart), allow_partial, customer=customer)
+
+    def pending_orders(self):
+        # (order_id, summary, total_price) for every pending order, oldest first
+        with self.pool.connection() as conn:
+            return conn.execute('''
+                SELECT o.id, group_concat(i.product_name || ' x' || i.quantity, ', '), o.total_price
+                FROM orders o JOIN order_items i ON i.order_id = o.id
+                WHERE o.status = 'Pending'
+                GROUP BY o.id
+                ORDER BY o.id
+            ''').fetchall()
+
+    def get_order(self, order_id):
+        with self.pool.connection() as conn:
+            header = conn.execute('SELECT id, status, total_price, created_at, completed_at FROM orders WHERE id = ?',
+                                  (order_id,)).fetchone()
+            if header is None:
+                return None
+            items = conn.execute('''
+                SELECT product_id, product_name, quantity, unit_price, total_price
+                FROM order_items WHERE order_id = ? ORDER BY id
+            ''', (order_id,)).fetchall()
+        return {
+            "order_id": header[0], "status": header[1], "total_price": header[2],
+            "created_at": header[3], "completed_at": header[4],
+            "items": [{"product_id": item[0], "product_name": item[1], "quantity": item[2],
+                       "unit_price": item[3], "total_price": item[4]} for item in items],
+        }
+
+    def complete_order(self, order_id):
+        # True if the order was pending and is now completed
+        return bool(self.complete_orders([order_id]))
+
+    def complete_orders(self, order_ids, chunk_size=500):
+        # Completes every listed order that is still pending in one
+        # transaction. Returns (order_id, bill_text) for each order this call
+        # completed; ids already completed elsewhere are left out.
+        order_ids = list(order_ids)
+        with self.pool.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            completed = []
+            for start in range(0, len(order_ids), chunk_size):
+                chunk = order_ids[start:start + chunk_size]
+                marks = ','.join('?' * len(chunk))
+                if HAS_RETURNING:
+                    completed += [row[0] for row in conn.execute(f'''
+                        UPDATE orders SET status = 'Completed', completed_at = CURRENT_TIMESTAMP
+                        WHERE id IN ({marks}) AND status = 'Pending'
+                        RETURNING id
+                    ''', chunk).fetchall()]
+                    continue
+                # We hold the write lock, so nobody can complete these in between
+                pending = [row[0] for row in conn.execute(
+                    f"SELECT id FROM orders WHERE id IN ({marks}) AND status = 'Pending'", chunk)]
+                if pending:
+                    conn.execute(f'''
+                        UPDATE orders SET status = 'Completed', completed_at = CURRENT_TIMESTAMP
+                        WHERE id IN ({','.join('?' * len(pending))})
+                    ''', pending)
+                completed += pending
+            bills = self.render_bills(conn, completed, chunk_size)
+            conn.execute('COMMIT')
+        return bills
+
+    # Reporting
+
+    def sales_dashboard(self, top=10):
+        with self.pool.connection() as conn:
+            return analytics.dashboard(conn, top)
+
+    # Billing
+
+    def render_bills(self, conn, order_ids, chunk_size=500):
+        bills = []
+        for start in range(0, len(order_ids), chunk_size):
+            chunk = order_ids[start:start + chunk_size]
+            marks = ','.join('?' * len(chunk))
+            bills += [(order_id, f"Order ID: {order_id}\nOrder ID: {order_id} - {summary} - ₹{total_price}")
+                      for order_id, summary, total_price in conn.execute(f'''
+                          SELECT o.id, group_concat(i.product_name || ' x' || i.quantity, ', '), o.total_price
+                          FROM orders o JOIN order_items i ON i.order_id = o.id
+                          WHERE o.id IN ({marks})
+                          GROUP BY o.id
+                          ORDER BY o.id
+                      ''', chunk)]
+        return bills
+
+    def bill_text(self, order_id):
+        with self.pool.connection() as conn:
+            bills = self.render_bills(conn, [order_id])
+        return bills[0][1] if bills else None
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.pool.close()
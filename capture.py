@@ -0,0 +1,98 @@
+import atexit
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# Optional traffic capture for the order and chat servers. Handler threads
+# only append a tuple to a deque (atomic, no lock); a background thread
+# turns the tuples into JSON lines and writes whatever has piled up every
+# flush_interval, so capturing adds well under a microsecond to a command.
+# replay.py feeds a capture back into a server and compares the replies.
+#
+# Each line is one JSON object. The first is a header; after that:
+#   {"t": 1718000000.123, "c": 7, "open": "127.0.0.1:50122"}
+#   {"t": ..., "c": 7, "in": "NEW_ORDER {...}", "out": "Order 12 received. 3 orders left."}
+#   {"t": ..., "c": 7, "in": "hello everyone"}          (chat lines have no reply)
+#   {"t": ..., "c": 7, "close": true, "received": 42}   (lines the server sent it)
+# t is wall-clock time, so captures from several worker processes can be
+# merged; c is unique within one capture file.
+
+class TrafficCapture:
+    def __init__(self, path, server, flush_interval=0.1, max_pending=200000):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.pending = deque()
+        self.dropped = 0
+        self.connection_ids = itertools.count(1)
+        self.file = open(path, "a", encoding="utf-8")
+        self.write_lines([{"capture": server, "version": 1, "pid": os.getpid(), "started": time.time()}])
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+        print(f"Capturing traffic to {path}")
+
+    def add(self, record):
+        # A capture must never slow the server down or grow without bound,
+        # so records are dropped (and counted) if the writer falls behind
+        if len(self.pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        self.pending.append(record)
+
+    def opened(self, peer):
+        connection_id = next(self.connection_ids)
+        self.add((time.time(), connection_id, "open", peer, None))
+        return connection_id
+
+    def command(self, connection_id, line, reply=None):
+        self.add((time.time(), connection_id, "in", line, reply))
+
+    def closed(self, connection_id, received=None):
+        self.add((time.time(), connection_id, "close", received, None))
+
+    def run(self):
+        while not self.stopped.wait(self.flush_interval):
+            self.flush()
+        self.flush()
+
+    def flush(self):
+        records = []
+        while True:
+            try:
+                timestamp, connection_id, kind, value, reply = self.pending.popleft()
+            except IndexError:
+                break
+            record = {"t": round(timestamp, 6), "c": connection_id}
+            if kind == "open":
+                record["open"] = value
+            elif kind == "close":
+                record["close"] = True
+                if value is not None:
+                    record["received"] = value
+            else:
+                record["in"] = value
+                if reply is not None:
+                    record["out"] = reply
+            records.append(record)
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            records.append({"t": round(time.time(), 6), "dropped": dropped})
+            print(f"Traffic capture fell behind and dropped {dropped} records")
+        if records:
+            self.write_lines(records)
+
+    def write_lines(self, records):
+        self.file.write("".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records))
+        self.file.flush()
+
+    def close(self):
+        if self.stopped.is_set():
+            return
+        self.stopped.set()
+        self.thread.join()
+        self.file.close()
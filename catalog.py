@@ -0,0 +1,256 @@
+import bisect
+import sqlite3
+
+# Schema pieces the catalog relies on. Every change to products bumps
+# catalog_meta.version and stamps the row with it (deletions leave a
+# tombstone), so readers can pull just the rows changed since the version
+# they last saw. Stock changes only count when an item runs out or comes
+# back, so orders do not make every kiosk reload its menu; the stock a
+# catalog row carries is a display hint and reserve_stock has the final say. Where SQLite has the trigram tokenizer, products_fts is a
+# trigram FTS5 index over product names kept in step by FTS_SCHEMA's triggers.
+CATALOG_SCHEMA = '''
+    CREATE INDEX IF NOT EXISTS idx_products_category ON products (category);
+    CREATE INDEX IF NOT EXISTS idx_products_version ON products (version);
+    CREATE TABLE IF NOT EXISTS catalog_meta (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL
+    );
+    INSERT OR IGNORE INTO catalog_meta (id, version) VALUES (1, 0);
+    CREATE TABLE IF NOT EXISTS product_tombstones (
+        id INTEGER PRIMARY KEY,
+        version INTEGER NOT NULL
+    );
+    CREATE TRIGGER IF NOT EXISTS products_after_insert AFTER INSERT ON products BEGIN
+        UPDATE catalog_meta SET version = version + 1;
+        UPDATE products SET version = (SELECT version FROM catalog_meta) WHERE id = NEW.id;
+        DELETE FROM product_tombstones WHERE id = NEW.id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS products_after_delete AFTER DELETE ON products BEGIN
+        UPDATE catalog_meta SET version = version + 1;
+        INSERT OR REPLACE INTO product_tombstones (id, version) SELECT OLD.id, version FROM catalog_meta;
+    END;
+'''
+
+PRODUCTS_UPDATE_TRIGGER = '''
+    CREATE TRIGGER IF NOT EXISTS products_after_update AFTER UPDATE ON products
+    WHEN NEW.version IS OLD.version
+     AND (NEW.name IS NOT OLD.name OR NEW.category IS NOT OLD.category OR NEW.price IS NOT OLD.price
+          OR NEW.image IS NOT OLD.image OR (NEW.stock > 0) IS NOT (OLD.stock > 0)) BEGIN
+        UPDATE catalog_meta SET version = version + 1;
+        UPDATE products SET version = (SELECT version FROM catalog_meta) WHERE id = NEW.id;
+    END;
+'''
+
+FTS_SCHEMA = '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5 (
+        name, content='products', content_rowid='id', tokenize='trigram'
+    );
+    CREATE TRIGGER IF NOT EXISTS products_fts_after_insert AFTER INSERT ON products BEGIN
+        INSERT INTO products_fts (rowid, name) VALUES (NEW.id, NEW.name);
+    END;
+    CREATE TRIGGER IF NOT EXISTS products_after_rename AFTER UPDATE OF name ON products BEGIN
+        INSERT INTO products_fts (products_fts, rowid, name) VALUES ('delete', OLD.id, OLD.name);
+        INSERT INTO products_fts (rowid, name) VALUES (NEW.id, NEW.name);
+    END;
+    CREATE TRIGGER IF NOT EXISTS products_fts_after_delete AFTER DELETE ON products BEGIN
+        INSERT INTO products_fts (products_fts, rowid, name) VALUES ('delete', OLD.id, OLD.name);
+    END;
+'''
+
+def trigram_supported():
+    # The trigram tokenizer arrived in SQLite 3.34 and some builds leave out
+    # FTS5 altogether, so try it rather than trust the version number
+    conn = sqlite3.connect(':memory:')
+    try:
+        conn.execute("CREATE VIRTUAL TABLE probe USING fts5 (name, tokenize='trigram')")
+        return True
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        conn.close()
+
+HAS_TRIGRAM = trigram_supported()
+
+def execute_script(conn, script):
+    # Like executescript, but without its implicit COMMIT, so the statements
+    # join the caller's transaction
+    statement = ''
+    for part in script.split(';'):
+        statement += part + ';'
+        if sqlite3.complete_statement(statement):
+            if statement.strip(' \n;'):
+                conn.execute(statement)
+            statement = ''
+
+def ensure_catalog_schema(conn):
+    # Runs inside the caller's transaction (see schema.migrate)
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(products)')]
+    fresh = 'version' not in columns
+    if fresh:
+        conn.execute('ALTER TABLE products ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+    execute_script(conn, CATALOG_SCHEMA)
+    execute_script(conn, PRODUCTS_UPDATE_TRIGGER)
+    if HAS_TRIGRAM:
+        execute_script(conn, FTS_SCHEMA)
+        if fresh:
+            # Existing rows predate the triggers, so index them once
+            conn.execute("INSERT INTO products_fts (products_fts) VALUES ('rebuild')")
+
+# In-memory product index loaded once from SQLite and kept fresh by
+# applying only the rows changed since the last seen catalog version.
+# Rows are (id, name, category, price, image, stock) tuples.
+class Catalog:
+    def __init__(self, conn, load=True):
+        # With load=False the indexes start empty and are filled by adopt()
+        # or the first refresh(), so a UI can show its window first
+        self.conn = conn
+        self.version = -1
+        self.by_id = {}
+        self.by_category = {}  # category -> {id: row}, in first-seen order
+        self.names = []  # sorted (lowercase name, id) pairs for prefix search
+        self.listeners = []
+        # A database created where trigram FTS was missing has no index
+        self.has_fts = HAS_TRIGRAM and conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'products_fts'").fetchone() is not None
+        if load:
+            self.refresh()
+
+    def subscribe(self, callback):
+        # callback(changed_ids) runs after every refresh that saw changes
+        self.listeners.append(callback)
+
+    def current_version(self):
+        return self.conn.execute('SELECT version FROM catalog_meta WHERE id = 1').fetchone()[0]
+
+    def refresh(self):
+        version = self.current_version()
+        if version == self.version:
+            return False
+        if self.version < 0:
+            rows = self.conn.execute('SELECT id, name, category, price, image, stock FROM products ORDER BY id').fetchall()
+            deleted = []
+        else:
+            rows = self.conn.execute('SELECT id, name, category, price, image, stock FROM products WHERE version > ?',
+                                     (self.version,)).fetchall()
+            deleted = [row[0] for row in self.conn.execute('SELECT id FROM product_tombstones WHERE version > ?',
+                                                           (self.version,))]
+        for product_id in deleted:
+            self.remove(product_id)
+        if self.version < 0:
+            for row in rows:
+                self.by_id[row[0]] = row
+                self.by_category.setdefault(row[2], {})[row[0]] = row
+            self.names = sorted((row[1].lower(), row[0]) for row in rows)
+        else:
+            for row in rows:
+                self.remove(row[0])
+                self.add(row)
+        self.version = version
+        changed = deleted + [row[0] for row in rows]
+        for callback in self.listeners:
+            callback(changed)
+        return True
+
+    def adopt(self, state):
+        # Takes over indexes built by load_catalog_state on another thread,
+        # unless a refresh here has already caught up with them
+        version, by_id, by_category, names = state
+        if version <= self.version:
+            return False
+        self.version, self.by_id, self.by_category, self.names = version, by_id, by_category, names
+        changed = list(by_id)
+        for callback in self.listeners:
+            callback(changed)
+        return True
+
+    def add(self, row):
+        product_id, name, category = row[0], row[1], row[2]
+        self.by_id[product_id] = row
+        self.by_category.setdefault(category, {})[product_id] = row
+        bisect.insort(self.names, (name.lower(), product_id))
+
+    def remove(self, product_id):
+        row = self.by_id.pop(product_id, None)
+        if row is None:
+            return
+        products = self.by_category.get(row[2])
+        if products is not None:
+            products.pop(product_id, None)
+            if not products:
+                del self.by_category[row[2]]
+        key = (row[1].lower(), product_id)
+        index = bisect.bisect_left(self.names, key)
+        if index < len(self.names) and self.names[index] == key:
+            del self.names[index]
+
+    def get(self, product_id):
+        return self.by_id.get(product_id)
+
+    def categories(self):
+        return list(self.by_category)
+
+    def products(self, category=None):
+        if category is None:
+            return list(self.by_id.values())
+        return list(self.by_category.get(category, {}).values())
+
+    def prefix(self, text, limit=20):
+        text = text.lower()
+        start = bisect.bisect_left(self.names, (text,))
+        results = []
+        for name, product_id in self.names[start:start + limit]:
+            if not name.startswith(text):
+                break
+            results.append(self.by_id[product_id])
+        return results
+
+    def match(self, query, limit):
+        try:
+            return self.conn.execute('SELECT rowid FROM products_fts WHERE products_fts MATCH ? ORDER BY rank LIMIT ?',
+                                     (query, limit)).fetchall()
+        except sqlite3.OperationalError:
+            return []
+
+    def like(self, text, limit):
+        # Plain substring scan for SQLite builds without the trigram index
+        pattern = '%' + text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        return self.conn.execute("SELECT id FROM products WHERE name LIKE ? ESCAPE '\\' ORDER BY id LIMIT ?",
+                                 (pattern, limit)).fetchall()
+
+    def search(self, text, limit=20):
+        # Name-prefix matches first, then substring matches from the trigram
+        # index. Only when those come up short do we fall back to matching
+        # any shared trigram ranked by bm25, so "smosa" still finds Samosa.
+        # Without the index, substrings come from a LIKE scan and there is
+        # no fuzzy step.
+        text = text.strip()
+        if not text:
+            return []
+        results = {row[0]: row for row in self.prefix(text, limit)}
+        if not self.has_fts:
+            if len(results) < limit:
+                for (product_id,) in self.like(text, limit):
+                    row = self.by_id.get(product_id)
+                    if row is not None:
+                        results.setdefault(product_id, row)
+            return list(results.values())[:limit]
+        if len(text) >= 3 and len(results) < limit:
+            matches = self.match('"' + text.replace('"', '""') + '"', limit)
+            if len(results) + len(matches) < limit:
+                trigrams = {text[i:i + 3] for i in range(len(text) - 2)}
+                matches += self.match(' OR '.join('"' + t.replace('"', '""') + '"' for t in trigrams), limit)
+            for (product_id,) in matches:
+                row = self.by_id.get(product_id)
+                if row is not None:
+                    results.setdefault(product_id, row)
+        return list(results.values())[:limit]
+
+def load_catalog_state(path):
+    # Reads and indexes the whole catalog on the calling thread with a
+    # private connection; hand the result to Catalog.adopt on the UI thread
+    conn = sqlite3.connect(path)
+    try:
+        catalog = Catalog(conn)
+        return catalog.version, catalog.by_id, catalog.by_category, catalog.names
+    finally:
+        conn.close()
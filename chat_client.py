@@ -0,0 +1,137 @@
+import queue
+import tkinter as tk
+from tkinter import scrolledtext
+
+from framing import ReconnectingClient
+
+# Chat panel shared by RestaurantApp and OwnerApp. Tk widgets may only be
+# touched from the Tk thread, so the socket reader just frames lines and
+# queues them; drain runs on the Tk thread every DRAIN_MS and writes
+# everything that arrived since the last frame in one insert. The
+# scrollback is capped at max_lines so long sessions stay cheap to redraw.
+# The connection is made and remade in the background, so the panel shows
+# up at once and survives chat server restarts.
+DRAIN_MS = 30
+MAX_BATCH = 1000
+
+class ChatClient(tk.Frame):
+    def __init__(self, master, sender_name, host="localhost", port=9999, hello=None, channels=(),
+                 reply_to_last=False, max_lines=2000):
+        super().__init__(master)
+        self.master = master
+        self.sender_name = sender_name
+        self.host = host
+        self.port = port
+        self.hello = hello
+        self.channels = list(channels)
+        # Owners answer on the customer or order channel that last wrote to
+        # them, and on their default channel until anyone has
+        self.reply_to_last = reply_to_last
+        self.reply_channel = None
+        self.max_lines = max_lines
+        self.inbox = queue.Queue()  # (tag, text); 'status' None on connect
+        self.create_widgets()
+        self.connection = ReconnectingClient(host, port, greeting=self.greeting,
+                                             on_line=self.receive_message, on_status=self.connection_status)
+        self.bind("<Destroy>", self.on_destroy)
+        self.drain_job = self.after(DRAIN_MS, self.drain)
+
+    def on_destroy(self, event):
+        # Closing the chat window also stops reconnecting
+        if event.widget is self:
+            self.after_cancel(self.drain_job)
+            self.connection.close()
+
+    def create_widgets(self):
+        self.chat_display = scrolledtext.ScrolledText(self, state='disabled', width=50, height=15)
+        self.chat_display.pack(pady=10)
+        self.chat_display.tag_config('received', foreground='blue')
+        self.chat_display.tag_config('sent', foreground='green')
+        self.chat_display.tag_config('status', foreground='gray')
+        self.message_entry = tk.Entry(self, width=50)
+        self.message_entry.pack(pady=10)
+        self.message_entry.bind("<Return>", lambda event: self.send_message())
+        self.send_button = tk.Button(self, text="Send", command=self.send_message, bg="#4CAF50", fg="white")
+        self.send_button.pack(pady=10)
+
+    def greeting(self):
+        # Sent on every (re)connect; the server replays each channel's
+        # recent history as it is joined
+        return ([self.hello] if self.hello else []) + [f"/join {channel}" for channel in self.channels]
+
+    def receive_message(self, message):
+        # Reader thread: framing is done, no Tk calls here
+        self.inbox.put(('received', message))
+
+    def connection_status(self, connected):
+        self.inbox.put(('status', None if connected else "Disconnected from chat server, reconnecting..."))
+
+    def drain(self):
+        lines = []
+        status = False
+        while len(lines) < MAX_BATCH:
+            try:
+                tag, message = self.inbox.get_nowait()
+            except queue.Empty:
+                break
+            if tag == 'status':
+                status = True
+                break
+            # Lines starting with "/" are server control lines such as the
+            # markers around replayed history
+            if message.startswith("/"):
+                continue
+            if self.reply_to_last and message.startswith("[") and "]" in message:
+                channel = message[1:message.index("]")]
+                if channel.startswith(("customer:", "order:")):
+                    self.reply_channel = channel
+            lines.append(message)
+        if lines:
+            self.append("\n".join(lines) + "\n", 'received')
+        if status:
+            if message is None:
+                # (Re)connected: the replay that follows redraws the history
+                self.clear()
+            else:
+                self.append(message + "\n", 'status')
+        self.drain_job = self.after(DRAIN_MS, self.drain)
+
+    def clear(self):
+        self.chat_display.config(state='normal')
+        self.chat_display.delete('1.0', tk.END)
+        self.chat_display.config(state='disabled')
+
+    def append(self, text, tag):
+        # One insert, one trim and one scroll however many lines arrived
+        at_bottom = self.chat_display.yview()[1] >= 1.0
+        self.chat_display.config(state='normal')
+        self.chat_display.insert(tk.END, text, tag)
+        excess = int(self.chat_display.index('end-1c').split('.')[0]) - 1 - self.max_lines
+        if excess > 0:
+            self.chat_display.delete('1.0', f'{excess + 1}.0')
+        self.chat_display.config(state='disabled')
+        if at_bottom:
+            self.chat_display.yview(tk.END)
+
+    def join(self, channel):
+        self.channels.append(channel)
+        if self.connection.connected:
+            self.connection.send(f"/join {channel}")
+
+    def send_message(self):
+        message = self.message_entry.get()
+        if not message:
+            return
+        if self.reply_channel:
+            line = f"/to {self.reply_channel} {self.sender_name}: {message}"
+            shown = f"Me to {self.reply_channel}: {message}"
+        else:
+            line = f"{self.sender_name}: {message}"
+            shown = f"Me: {message}"
+        try:
+            self.connection.send(line)
+        except OSError as e:
+            self.append(f"Could not send: {e}\n", 'status')
+            return
+        self.append(shown + "\n", 'sent')
+        self.message_entry.delete(0, tk.END)
@@ -0,0 +1,123 @@
+import json
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import deque
+from itertools import islice
+
+LOBBY = "lobby"
+
+class ChannelLog:
+    def __init__(self, recent):
+        self.recent = deque(maxlen=recent)  # (seq, text)
+        self.seqs = array("q")
+        self.offsets = array("q")  # where each message's line starts in the file
+        self.lengths = array("l")
+
+# Append-only chat log shared by all channels. Every message gets the next
+# global sequence number and is appended to a JSONL file; each channel keeps
+# its most recent messages in a ring buffer so replay on join never touches
+# the disk. Older pages are read with one pread per line using an in-memory
+# index of offsets (20 bytes per message), so paging back is cheap however
+# long the log gets.
+class ChatHistory:
+    def __init__(self, path="chat_history.jsonl", recent=200, fsync=False):
+        self.path = path
+        self.recent = recent
+        self.fsync = fsync
+        self.lock = threading.Lock()
+        self.channels = {}  # name -> ChannelLog
+        self.size = 0
+        self.last_seq = 0
+        self.log = None
+        self.fd = None
+        if path:
+            self.recover()
+            self.log = open(path, "ab")
+            self.fd = os.open(path, os.O_RDONLY)
+
+    def recover(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as log:
+            for line in log:
+                # A torn write at the tail from a crash; a last line without
+                # its newline counts as torn even if it parses
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                    text = record["text"]
+                except (ValueError, KeyError):
+                    break
+                self.last_seq += 1
+                self.index(record.get("channel", LOBBY), self.last_seq, text, self.size, len(line))
+                self.size += len(line)
+        if self.size < os.path.getsize(self.path):
+            with open(self.path, "r+b") as log:
+                log.truncate(self.size)
+        print(f"Recovered {self.last_seq} chat messages from {self.path}")
+
+    def index(self, channel, seq, text, offset, length):
+        log = self.channels.get(channel)
+        if log is None:
+            log = self.channels[channel] = ChannelLog(self.recent)
+        log.recent.append((seq, text))
+        log.seqs.append(seq)
+        if length:
+            log.offsets.append(offset)
+            log.lengths.append(length)
+
+    def append(self, text, channel=LOBBY):
+        with self.lock:
+            seq = self.last_seq + 1
+            offset, length = self.size, 0
+            if self.log is not None:
+                line = json.dumps({"seq": seq, "ts": round(time.time(), 3), "channel": channel, "text": text},
+                                  separators=(",", ":")).encode("utf-8") + b"\n"
+                self.log.write(line)
+                self.log.flush()
+                if self.fsync:
+                    os.fsync(self.log.fileno())
+                length = len(line)
+                self.size += length
+            self.last_seq = seq
+            self.index(channel, seq, text, offset, length)
+            return seq
+
+    def latest(self, channel, limit):
+        # The channel's newest messages, oldest first, from its ring buffer
+        with self.lock:
+            log = self.channels.get(channel)
+            if log is None:
+                return []
+            skip = max(0, len(log.recent) - limit)
+            return list(islice(log.recent, skip, None))
+
+    def page(self, channel, before_seq, limit):
+        # Up to limit of the channel's messages with seq < before_seq, oldest first
+        with self.lock:
+            log = self.channels.get(channel)
+            if log is None:
+                return []
+            end = bisect_left(log.seqs, before_seq)
+            start = max(0, end - limit)
+            if end <= start:
+                return []
+            in_memory = len(log.seqs) - len(log.recent)
+            if start >= in_memory or self.fd is None:
+                # Without a file only what is still in the ring buffer remains
+                start = max(start, in_memory)
+                return list(islice(log.recent, start - in_memory, end - in_memory))
+            spans = [(log.seqs[i], log.offsets[i], log.lengths[i]) for i in range(start, end)]
+        return [(seq, json.loads(os.pread(self.fd, length, offset))["text"]) for seq, offset, length in spans]
+
+    def close(self):
+        with self.lock:
+            if self.log is not None:
+                self.log.close()
+                os.close(self.fd)
+                self.log = None
+                self.fd = None
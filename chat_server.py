@@ -1,43 +1,396 @@
+import argparse
+import queue
+import re
 import socket
+import sqlite3
 import threading
+import time
+
+from capture import TrafficCapture
+from chat_history import LOBBY, ChatHistory
+from framing import LineReader, encode_line
+from metrics import Registry, serve_metrics
+
+# Messages are routed to named channels instead of every client:
+#   lobby          clients that have not sent /hello (older apps, benchmarks)
+#   staff          owner consoles
+#   customer:<id>  one customer (kiosk) talking to the owners
+#   order:<n>      everyone following one order
+# Owners watch every customer: and order: channel without joining each one.
+# A customer may only join the order channels of orders it placed, as
+# recorded in the order database's order_customers table.
+STAFF = "staff"
+WATCHED_PREFIXES = ("customer:", "order:")
+CHANNEL_PATTERN = re.compile(r"^(lobby|staff|order:\d+|customer:[A-Za-z0-9_.-]+)$")
+
+def channel_prefix(channel):
+    return channel.split(":", 1)[0] + ":" if ":" in channel else channel
+
+def format_line(channel, text):
+    # Lobby lines go out as sent so older clients see no change
+    return text if channel == LOBBY else f"[{channel}] {text}"
+
+class ChatConnection:
+    def __init__(self, client_socket, addr, max_queue):
+        self.client_socket = client_socket
+        self.addr = addr
+        # Bounded outbound queue drained by this connection's writer thread
+        self.outbox = queue.Queue(maxsize=max_queue)
+        self.closed = False
+        self.role = None
+        self.name = None
+        self.default_channel = LOBBY
+        self.channels = set()
+        self.watching = set()
+        self.lines_sent = 0
+        self.capture_id = None
 
 class ChatServer:
-    def __init__(self, host="localhost", port=9999):
+    capture = None  # TrafficCapture recording every inbound line
+
+    def __init__(self, host="localhost", port=9999, max_queue=256, stats_interval=60,
+                 history_path="chat_history.jsonl", replay=200, db_path="canteen.db"):
         self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.server.bind((host, port))
-        self.server.listen(5)
+        self.server.listen(128)
         print(f"Chat server started on {host}:{port}")
-        self.clients = []
+        self.max_queue = max_queue
+        self.stats_interval = stats_interval
+        # Replaced (never mutated) under clients_lock so broadcast can iterate
+        # a consistent snapshot without holding the lock.
+        self.clients = ()
+        self.clients_lock = threading.Lock()
+        # Channel name -> member connections and channel prefix -> watching
+        # connections, both updated copy-on-write under clients_lock
+        self.channels = {}
+        self.watchers = {}
+        self.history = ChatHistory(history_path, recent=max(replay, 200))
+        self.replay = replay
+        self.db_path = db_path
+        self.publish_lock = threading.Lock()
+        self.metrics = Registry()
+        self.metrics.gauge("chat_clients", "Chat connections currently open", function=lambda: len(self.clients))
+        self.metrics.gauge("chat_channels", "Channels with at least one member", function=lambda: len(self.channels))
+        self.metrics.gauge("chat_outbox_depth_max", "Longest outbound queue of any client",
+                           function=lambda: max((c.outbox.qsize() for c in self.clients), default=0))
+        self.connections_total = self.metrics.counter("chat_connections_total", "Chat connections accepted")
+        self.messages_received = self.metrics.counter("chat_messages_received_total", "Lines received from clients")
+        self.messages_delivered = self.metrics.counter("chat_messages_delivered_total", "Lines written to client sockets")
+        self.messages_dropped = self.metrics.counter("chat_messages_dropped_total", "Lines dropped on a full outbox")
+        self.clients_evicted = self.metrics.counter("chat_clients_evicted_total", "Slow clients disconnected")
+        self.broadcast_latency = self.metrics.histogram("chat_broadcast_seconds", "Time to enqueue a line for a channel")
+        self.fanout_latency = self.metrics.histogram("chat_fanout_seconds", "Time from enqueue to socket write")
 
-    def broadcast(self, message, client_socket):
-        for client in self.clients:
-            if client != client_socket:
-                try:
-                    client.send(message)
-                except:
-                    client.close()
-                    self.clients.remove(client)
+    def add_client(self, connection):
+        with self.clients_lock:
+            self.clients = self.clients + (connection,)
 
-    def handle_client(self, client_socket):
-        while True:
+    def remove_client(self, connection):
+        with self.clients_lock:
+            if connection.closed:
+                return
+            connection.closed = True
+            self.clients = tuple(c for c in self.clients if c is not connection)
+            for channel in connection.channels:
+                self.drop_member(self.channels, channel, connection)
+            for prefix in connection.watching:
+                self.drop_member(self.watchers, prefix, connection)
+        try:
+            # Wakes up both the reader and a writer stuck in sendall
+            connection.client_socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        connection.client_socket.close()
+        try:
+            connection.outbox.put_nowait(None)
+        except queue.Full:
+            pass
+
+    def drop_member(self, index, key, connection):
+        # Called with clients_lock held; empty entries are removed so the
+        # index only holds live channels
+        members = tuple(c for c in index.get(key, ()) if c is not connection)
+        if members:
+            index[key] = members
+        else:
+            index.pop(key, None)
+
+    def evict(self, connection):
+        print(f"Evicting slow client {connection.addr}")
+        self.clients_evicted.inc()
+        self.remove_client(connection)
+
+    def deliver(self, channel, message, sender):
+        # Only enqueues; the per-client writers do the socket I/O, so a
+        # stalled peer can never hold up the sender or the other peers.
+        # Recipients come from two dict lookups, so the cost depends on the
+        # channel's size, not on how many clients are connected.
+        enqueued_at = time.perf_counter()
+        members = self.channels.get(channel, ())
+        # A member who also watches the channel's prefix gets it once
+        watchers = tuple(c for c in self.watchers.get(channel_prefix(channel), ()) if channel not in c.channels)
+        for client in members + watchers:
+            if client is sender or client.closed:
+                continue
+            try:
+                client.outbox.put_nowait((enqueued_at, message))
+            except queue.Full:
+                self.messages_dropped.inc()
+                self.evict(client)
+        self.broadcast_latency.observe(time.perf_counter() - enqueued_at)
+
+    def writer_loop(self, connection):
+        while not connection.closed:
+            item = connection.outbox.get()
+            if item is None:
+                break
+            batch = [item]
+            # Coalesce whatever else is already queued into one send
+            while len(batch) < 64:
+                try:
+                    item = connection.outbox.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    break
+                batch.append(item)
             try:
-                message = client_socket.recv(1024)
-                if message:
-                    print(f"Received: {message.decode()}")
-                    self.broadcast(message, client_socket)
-            except:
-                client_socket.close()
-                self.clients.remove(client_socket)
+                connection.client_socket.sendall(b"".join(message for _, message in batch))
+            except OSError:
+                self.remove_client(connection)
                 break
+            connection.lines_sent += sum(message.count(b"\n") for _, message in batch)
+            self.record_delivery(batch)
+
+    def record_delivery(self, batch):
+        now = time.perf_counter()
+        for enqueued_at, _ in batch:
+            self.fanout_latency.observe(now - enqueued_at)
+        self.messages_delivered.inc(len(batch))
+
+    def stats(self):
+        fanout = self.fanout_latency.snapshot()
+        return {
+            "clients": len(self.clients),
+            "messages_received": self.messages_received.value,
+            "messages_delivered": self.messages_delivered.value,
+            "messages_dropped": self.messages_dropped.value,
+            "clients_evicted": self.clients_evicted.value,
+            "fanout_latency_avg_ms": fanout["avg_ms"],
+            "fanout_latency_p99_ms": fanout["p99_ms"],
+            "fanout_latency_max_ms": fanout["max_ms"],
+        }
+
+    def send_direct(self, connection, data):
+        # Answers only this client, through its own writer
+        try:
+            connection.outbox.put_nowait((time.perf_counter(), data))
+        except queue.Full:
+            self.evict(connection)
+
+    def send_history(self, connection, channel, entries):
+        # A page goes out as a single outbox item, so live lines can never
+        # land inside it and a replay of hundreds of lines is one send
+        oldest = entries[0][0] if entries else 0
+        lines = [encode_line(f"/history_begin {len(entries)} {channel}")]
+        lines += [encode_line(format_line(channel, text)) for _, text in entries]
+        lines.append(encode_line(f"/history_end {oldest} {channel}"))
+        self.send_direct(connection, b"".join(lines))
+
+    def error(self, connection, message):
+        self.send_direct(connection, encode_line(f"/error {message}"))
+
+    def may_join(self, connection, channel):
+        # Customers get their own channel and order channels; owners anything
+        if connection.role == "owner":
+            return True
+        if connection.role == "customer":
+            if channel.startswith("order:"):
+                return self.order_customer(int(channel[len("order:"):])) == connection.name
+            return channel == f"customer:{connection.name}"
+        return channel == LOBBY
+
+    def order_customer(self, order_id):
+        # The customer who placed an order, or None if unknown. Joins are
+        # rare, so each check opens the database read-only.
+        if not self.db_path:
+            return None
+        try:
+            conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, timeout=5)
+        except sqlite3.Error:
+            return None
+        try:
+            row = conn.execute('SELECT customer FROM order_customers WHERE order_id = ?', (order_id,)).fetchone()
+            return row[0] if row else None
+        except sqlite3.Error as e:
+            print(f"Could not check who placed order {order_id}: {e}")
+            return None
+        finally:
+            conn.close()
+
+    def may_use(self, connection, channel):
+        return channel in connection.channels or channel_prefix(channel) in connection.watching
+
+    def join_channel(self, connection, channel):
+        with self.publish_lock:
+            if self.replay:
+                self.send_history(connection, channel, self.history.latest(channel, self.replay))
+            with self.clients_lock:
+                if connection.closed:
+                    return
+                self.channels[channel] = self.channels.get(channel, ()) + (connection,)
+                connection.channels.add(channel)
+
+    def leave_channel(self, connection, channel):
+        with self.clients_lock:
+            if channel in connection.channels:
+                connection.channels.discard(channel)
+                self.drop_member(self.channels, channel, connection)
+
+    def watch(self, connection, prefix):
+        with self.clients_lock:
+            if connection.closed:
+                return
+            self.watchers[prefix] = self.watchers.get(prefix, ()) + (connection,)
+            connection.watching.add(prefix)
+
+    def hello(self, connection, argument):
+        # /hello customer <id> or /hello owner. Until then a client is in
+        # the lobby, which is how older clients keep working unchanged.
+        parts = argument.split()
+        if connection.role:
+            self.error(connection, "Already introduced")
+            return
+        if len(parts) == 2 and parts[0] == "customer" and CHANNEL_PATTERN.match(f"customer:{parts[1]}"):
+            connection.role, connection.name = "customer", parts[1]
+            connection.default_channel = f"customer:{parts[1]}"
+        elif parts == ["owner"]:
+            connection.role = "owner"
+            connection.default_channel = STAFF
+            for prefix in WATCHED_PREFIXES:
+                self.watch(connection, prefix)
+        else:
+            self.error(connection, "Usage: /hello customer <id> | /hello owner")
+            return
+        self.leave_channel(connection, LOBBY)
+        self.send_direct(connection, encode_line(f"/welcome {connection.default_channel}"))
+        self.join_channel(connection, connection.default_channel)
+
+    def handle_command(self, connection, message):
+        command, _, argument = message.partition(" ")
+        if command == "/stats":
+            self.send_direct(connection, encode_line("/stats " + self.metrics.to_json()))
+        elif command == "/hello":
+            self.hello(connection, argument)
+        elif command in ("/join", "/leave"):
+            channel = argument.strip()
+            if not CHANNEL_PATTERN.match(channel) or not self.may_join(connection, channel):
+                self.error(connection, f"Cannot {command[1:]} {channel}")
+            elif command == "/join":
+                if channel not in connection.channels:
+                    self.join_channel(connection, channel)
+            else:
+                self.leave_channel(connection, channel)
+        elif command == "/to":
+            # /to <channel> <text>: a line for a channel other than the default
+            channel, _, text = argument.partition(" ")
+            if not self.may_use(connection, channel):
+                self.error(connection, f"Not in {channel}")
+            elif text:
+                self.receive(connection, channel, text)
+        elif command == "/history":
+            # /history <before_seq> [limit] [channel]: the page of messages
+            # before before_seq, for scrolling back past the replay
+            parts = argument.split()
+            channel = parts.pop() if len(parts) in (2, 3) and not parts[-1].isdigit() else connection.default_channel
+            if not 1 <= len(parts) <= 2 or not all(part.isdigit() for part in parts):
+                self.error(connection, "Usage: /history <before_seq> [limit] [channel]")
+            elif not self.may_use(connection, channel):
+                self.error(connection, f"Not in {channel}")
+            else:
+                limit = min(int(parts[1]) if len(parts) == 2 else 50, 500)
+                self.send_history(connection, channel, self.history.page(channel, int(parts[0]), limit))
+        else:
+            self.error(connection, f"Unknown command: {command}")
+
+    def receive(self, connection, channel, text):
+        print(f"Received on {channel}: {text}")
+        self.messages_received.inc()
+        self.publish(channel, text, connection)
+
+    def publish(self, channel, text, sender):
+        # Logging and fan-out happen under one lock that join_channel also
+        # takes, so a joining client sees each line exactly once: either in
+        # its replay or live.
+        with self.publish_lock:
+            self.history.append(text, channel)
+            self.deliver(channel, encode_line(format_line(channel, text)), sender)
+
+    def report_stats(self):
+        while True:
+            time.sleep(self.stats_interval)
+            print("Chat stats: " + ", ".join(f"{key}={value:.2f}" if isinstance(value, float) else f"{key}={value}"
+                                             for key, value in self.stats().items()))
+
+    def handle_client(self, connection):
+        reader = LineReader(connection.client_socket)
+        try:
+            for message in reader:
+                if self.capture is not None:
+                    self.capture.command(connection.capture_id, message)
+                if message.startswith("/"):
+                    self.handle_command(connection, message)
+                else:
+                    self.receive(connection, connection.default_channel, message)
+        except (OSError, ValueError):
+            pass
+        finally:
+            self.remove_client(connection)
+            if self.capture is not None:
+                self.capture.closed(connection.capture_id, connection.lines_sent)
 
     def run(self):
+        if self.stats_interval > 0:
+            threading.Thread(target=self.report_stats, daemon=True).start()
         while True:
             client_socket, addr = self.server.accept()
-            self.clients.append(client_socket)
+            connection = ChatConnection(client_socket, addr, self.max_queue)
+            if self.capture is not None:
+                connection.capture_id = self.capture.opened(f"{addr[0]}:{addr[1]}")
+            self.add_client(connection)
+            self.join_channel(connection, LOBBY)
+            self.connections_total.inc()
             print(f"Client connected from {addr}")
-            client_handler = threading.Thread(target=self.handle_client, args=(client_socket,))
+            threading.Thread(target=self.writer_loop, args=(connection,), daemon=True).start()
+            client_handler = threading.Thread(target=self.handle_client, args=(connection,), daemon=True)
             client_handler.start()
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Canteen chat server")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=9999)
+    parser.add_argument("--max-queue", type=int, default=256,
+                        help="outbound messages buffered per client before it is evicted")
+    parser.add_argument("--stats-interval", type=float, default=60,
+                        help="seconds between fan-out stats reports (0 disables)")
+    parser.add_argument("--metrics-port", type=int,
+                        help="serve Prometheus metrics on this local port (clients can also send /stats)")
+    parser.add_argument("--history", default="chat_history.jsonl",
+                        help="append-only chat log (empty keeps history in memory only)")
+    parser.add_argument("--replay", type=int, default=200,
+                        help="recent messages of a channel sent to a client when it joins")
+    parser.add_argument("--db", default="canteen.db",
+                        help="order database used to check which customer placed an order")
+    parser.add_argument("--capture", metavar="PATH",
+                        help="append every inbound line to this JSONL file for replay.py (e.g. traffic.jsonl)")
+    return parser.parse_args()
+
 if __name__ == "__main__":
-    chat_server = ChatServer()
+    args = parse_args()
+    chat_server = ChatServer(args.host, args.port, args.max_queue, args.stats_interval, args.history, args.replay, args.db)
+    if args.metrics_port:
+        serve_metrics(chat_server.metrics, args.metrics_port)
+    if args.capture:
+        chat_server.capture = TrafficCapture(args.capture, "chat")
     chat_server.run()
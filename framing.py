@@ -0,0 +1,204 @@
+import itertools
+import json
+import random
+import socket
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+# Newline-framed messages shared by the order and chat protocols.
+# Each frame is one UTF-8 line terminated by "\n", so messages are never
+# split or merged by TCP the way raw recv(1024) chunks are.
+
+ENCODING = "utf-8"
+MAX_LINE = 64 * 1024
+
+
+def encode_line(message):
+    # Embedded newlines would break framing, so fold them into spaces
+    message = message.replace("\r", " ").replace("\n", " ")
+    return (message + "\n").encode(ENCODING)
+
+
+class LineReader:
+    def __init__(self, sock, max_line=MAX_LINE):
+        self.sock = sock
+        self.max_line = max_line
+        self.buffer = b""
+
+    def readline(self):
+        # Returns the next complete line without its terminator, or None
+        # once the peer has closed the connection.
+        while b"\n" not in self.buffer:
+            if len(self.buffer) > self.max_line:
+                raise ValueError("Frame too long")
+            chunk = self.sock.recv(4096)
+            if not chunk:
+                return None
+            self.buffer += chunk
+        line, self.buffer = self.buffer.split(b"\n", 1)
+        return line.decode(ENCODING).rstrip("\r")
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if line is None:
+                return
+            yield line
+
+
+def connect(host, port, timeout=None):
+    sock = socket.create_connection((host, port), timeout=timeout)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+
+class ReconnectingClient:
+    # A connection that is made on a background thread and remade with
+    # jittered exponential backoff whenever it drops, so an app can start
+    # before its server and survive server restarts. greeting() returns the
+    # lines to send on every (re)connect, e.g. SUBSCRIBE or /hello.
+    #
+    # The background thread reads every line. Replies to submit() and
+    # request() carry the "#<id>" the command was sent with and resolve its
+    # Future, so any number of commands can be in flight on one connection;
+    # everything else (pushed events, chat lines) goes to on_line.
+    def __init__(self, host, port, greeting=None, on_line=None, on_status=None,
+                 timeout=5.0, min_delay=0.25, max_delay=10.0):
+        self.host = host
+        self.port = port
+        self.greeting = greeting
+        self.on_line = on_line
+        self.on_status = on_status
+        self.timeout = timeout
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.lock = threading.Lock()  # serialises writes to the socket
+        self.sock = None
+        self.request_ids = itertools.count(1)
+        self.waiting = {}  # "#<id>" -> Future of the reply
+        self.waiting_lock = threading.Lock()
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    @property
+    def connected(self):
+        return self.sock is not None
+
+    def status(self, connected):
+        if self.on_status is not None:
+            self.on_status(connected)
+
+    def run(self):
+        delay = self.min_delay
+        while not self.closed:
+            try:
+                sock = connect(self.host, self.port, timeout=self.timeout)
+                for line in self.greeting() if self.greeting else ():
+                    sock.sendall(encode_line(line))
+            except OSError:
+                time.sleep(random.uniform(delay / 2, delay))
+                delay = min(delay * 2, self.max_delay)
+                continue
+            delay = self.min_delay
+            # Pushed lines may be far apart; replies time out in request()
+            sock.settimeout(None)
+            with self.lock:
+                self.sock = sock
+            self.status(True)
+            try:
+                for line in LineReader(sock):
+                    self.receive(line)
+            except (OSError, ValueError):
+                pass
+            with self.lock:
+                self.sock = None
+            sock.close()
+            self.fail_waiting()
+            self.status(False)
+
+    def receive(self, line):
+        if line.startswith("#"):
+            request_id, _, reply = line.partition(" ")
+            with self.waiting_lock:
+                future = self.waiting.pop(request_id, None)
+            if future is not None:
+                future.set_result(reply)
+                return
+        if self.on_line is not None:
+            self.on_line(line)
+
+    def fail_waiting(self):
+        with self.waiting_lock:
+            waiting, self.waiting = self.waiting, {}
+        for future in waiting.values():
+            future.set_exception(ConnectionError(f"Lost connection to {self.host}:{self.port}"))
+
+    def disconnect(self):
+        # Called with the lock held after a failed send; the reader notices
+        # and reconnects
+        if self.sock is not None:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def send(self, line):
+        with self.lock:
+            if self.sock is None:
+                raise ConnectionError(f"Not connected to {self.host}:{self.port}")
+            try:
+                self.sock.sendall(encode_line(line))
+            except OSError:
+                self.disconnect()
+                raise
+
+    def submit(self, command):
+        # Sends command tagged with a fresh request id without waiting.
+        # Returns a Future for the reply, failed with ConnectionError if the
+        # connection drops first.
+        return self.send_tagged(command)[1]
+
+    def send_tagged(self, command):
+        # submit() that also returns the request id
+        future = Future()
+        request_id = f"#{next(self.request_ids)}"
+        with self.waiting_lock:
+            self.waiting[request_id] = future
+        try:
+            self.send(f"{request_id} {command}")
+        except OSError:
+            with self.waiting_lock:
+                self.waiting.pop(request_id, None)
+            raise ConnectionError(f"Not connected to {self.host}:{self.port}")
+        return request_id, future
+
+    def request(self, command, timeout=None):
+        # One command and its reply; raises ConnectionError while the
+        # server is unreachable and TimeoutError if it does not answer
+        request_id, future = self.send_tagged(command)
+        try:
+            return future.result(timeout or self.timeout)
+        except FutureTimeout:
+            # A late reply is dropped rather than its Future kept forever
+            with self.waiting_lock:
+                self.waiting.pop(request_id, None)
+            raise TimeoutError(f"No reply from {self.host}:{self.port} to {command.split(' ', 1)[0]}")
+
+    def request_batch(self, commands, timeout=None):
+        # Several commands in one BATCH frame and one round trip; returns
+        # their replies in order
+        frame = "BATCH " + json.dumps(list(commands))
+        if len(frame) > MAX_LINE - 32:
+            # The server would drop the connection; split the batch instead
+            raise ValueError(f"Batch of {len(commands)} commands is too large for one frame")
+        reply = self.request(frame, timeout)
+        if not reply.startswith("BATCH "):
+            raise ValueError(reply)
+        return json.loads(reply[len("BATCH "):])
+
+    def close(self):
+        self.closed = True
+        with self.lock:
+            self.disconnect()
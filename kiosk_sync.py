@@ -0,0 +1,293 @@
+import hashlib
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+from schema import migrate
+
+# Menu distribution and offline ordering for kiosks that do not share the
+# server's filesystem. The API server publishes the menu through a
+# MenuPublisher: GET /menu?since=<version> answers with the products changed
+# and deleted since that catalog version (everything when since is -1), and
+# GET /images/<name> serves images by content hash, so a kiosk downloads an
+# image once and again only when it changes. A kiosk keeps a KioskSync: the
+# menu is cached in a local SQLite file with the same schema as canteen.db,
+# so the kiosk's Catalog reads it unchanged, and orders go through a local
+# outbox that is flushed to POST /orders/sync with an idempotency key each.
+
+MENU_COLUMNS = ("id", "name", "category", "price", "stock", "image")
+
+class MenuPublisher:
+    # Server side. The whole menu is held in memory with each row's catalog
+    # version and refreshed from the database at most once per
+    # refresh_interval however many kiosks poll, so database load does not
+    # grow with the number of kiosks. Encoded responses are kept per
+    # starting version until the menu changes; most kiosks poll from the
+    # same few versions.
+    def __init__(self, path='canteen.db', refresh_interval=1.0, max_cached=64):
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self.max_cached = max_cached
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.version = -1
+        self.checked = 0.0
+        self.rows = {}  # product id -> (catalog version, row as in MENU_COLUMNS)
+        self.deleted = {}  # product id -> catalog version it was deleted at
+        self.images = {}  # published image name -> file path
+        self.hashes = {}  # file path -> (mtime_ns, size, published name)
+        self.responses = {}  # since -> encoded response for the current version
+        self.queries = 0
+
+    def image_name(self, path):
+        # Content hash plus the file's extension, or None if it is missing
+        try:
+            stat = os.stat(path)
+        except (OSError, TypeError, ValueError):
+            return None
+        cached = self.hashes.get(path)
+        if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2]
+        digest = hashlib.sha1()
+        with open(path, 'rb') as image:
+            for chunk in iter(lambda: image.read(65536), b''):
+                digest.update(chunk)
+        name = digest.hexdigest()[:20] + os.path.splitext(path)[1].lower()
+        self.hashes[path] = (stat.st_mtime_ns, stat.st_size, name)
+        self.images[name] = path
+        return name
+
+    def refresh(self):
+        # Called with the lock held
+        if self.version >= 0 and time.monotonic() - self.checked < self.refresh_interval:
+            return
+        self.checked = time.monotonic()
+        self.queries += 1
+        version = self.conn.execute('SELECT version FROM catalog_meta WHERE id = 1').fetchone()[0]
+        if version == self.version:
+            return
+        if version < self.version:
+            # The database was replaced; start over
+            self.rows, self.deleted = {}, {}
+            self.version = -1
+        for product_id, name, category, price, stock, image, row_version in self.conn.execute(
+                'SELECT id, name, category, price, stock, image, version FROM products WHERE version > ?',
+                (self.version,)):
+            self.deleted.pop(product_id, None)
+            self.rows[product_id] = (row_version, [product_id, name, category, price, stock, self.image_name(image)])
+        for product_id, row_version in self.conn.execute('SELECT id, version FROM product_tombstones WHERE version > ?',
+                                                         (self.version,)):
+            self.rows.pop(product_id, None)
+            self.deleted[product_id] = row_version
+        self.version = version
+        self.responses = {}
+
+    def menu(self, since=-1):
+        # Encoded JSON: {"version", "full", "columns", "products", "deleted"}.
+        # full means the rows are the whole menu and anything else the
+        # kiosk has cached is gone (first load, or a replaced database).
+        with self.lock:
+            self.refresh()
+            body = self.responses.get(since)
+            if body is None:
+                full = since < 0 or since > self.version
+                products = [row for version, row in self.rows.values() if full or version > since]
+                deleted = [] if full else [product_id for product_id, version in self.deleted.items() if version > since]
+                body = json.dumps({"version": self.version, "full": full, "columns": MENU_COLUMNS,
+                                   "products": products, "deleted": deleted},
+                                  ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+                if len(self.responses) >= self.max_cached:
+                    self.responses.clear()
+                self.responses[since] = body
+            return body
+
+    def image_path(self, name):
+        with self.lock:
+            return self.images.get(name)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+class KioskSync:
+    # Kiosk side. A background thread flushes the outbox and then pulls the
+    # menu changes since the cached version every interval seconds, so when
+    # the server comes back after an outage the queued orders are sent
+    # first. Every order gets its key when it is queued; if a reply is lost
+    # the order is sent again and the server answers with the original
+    # outcome instead of placing it twice. Queued orders are priced by the
+    # server when they arrive. place() only queues and wakes the thread, so
+    # the kiosk never waits on the network; each order's result is put on
+    # outcomes once the server has settled it.
+    def __init__(self, server_url, cache_path='kiosk_cache.db', image_dir='kiosk_images', interval=5.0,
+                 timeout=5.0, batch_size=100):
+        self.server_url = server_url.rstrip('/')
+        self.cache_path = cache_path
+        self.image_dir = image_dir
+        self.interval = interval
+        self.timeout = timeout
+        self.batch_size = batch_size
+        os.makedirs(image_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(cache_path, timeout=5, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        migrate(self.conn)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS kiosk_state (id INTEGER PRIMARY KEY CHECK (id = 1), '
+                          'server_version INTEGER NOT NULL)')
+        self.conn.execute('INSERT OR IGNORE INTO kiosk_state (id, server_version) VALUES (1, -1)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS outbox (key TEXT PRIMARY KEY, body TEXT NOT NULL, '
+                          'queued_at REAL NOT NULL)')
+        self.online = None
+        self.outcomes = queue.Queue()  # (key, result) of every settled order
+        self.stopped = False
+        self.wake = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def request(self, method, path, payload=None, timeout=None):
+        data = json.dumps(payload).encode("utf-8") if payload is not None else None
+        request = urllib.request.Request(self.server_url + path, data=data, method=method,
+                                         headers={"Content-Type": "application/json"} if data else {})
+        with urllib.request.urlopen(request, timeout=timeout or self.timeout) as response:
+            return response.read()
+
+    def server_version(self):
+        with self.lock:
+            return self.conn.execute('SELECT server_version FROM kiosk_state WHERE id = 1').fetchone()[0]
+
+    def pull_menu(self):
+        # Applies the changes since the cached version in one transaction.
+        # Returns whether anything changed.
+        since = self.server_version()
+        menu = json.loads(self.request("GET", f"/menu?since={since}"))
+        if menu["version"] == since and not menu["full"]:
+            return False
+        rows = [dict(zip(menu["columns"], row)) for row in menu["products"]]
+        # Images first, outside the lock; a failed download leaves the
+        # version alone so the whole delta is tried again
+        images = {row["id"]: self.fetch_image(row["image"]) for row in rows}
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                deleted = menu["deleted"]
+                if menu["full"]:
+                    keep = {row["id"] for row in rows}
+                    deleted = [product_id for (product_id,) in self.conn.execute('SELECT id FROM products')
+                               if product_id not in keep]
+                self.conn.executemany('DELETE FROM products WHERE id = ?', [(product_id,) for product_id in deleted])
+                self.conn.executemany('''
+                    INSERT INTO products (id, name, category, price, image, stock) VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (id) DO UPDATE SET name = excluded.name, category = excluded.category,
+                        price = excluded.price, image = excluded.image, stock = excluded.stock
+                ''', [(row["id"], row["name"], row["category"], row["price"], images[row["id"]], row["stock"])
+                      for row in rows])
+                self.conn.execute('UPDATE kiosk_state SET server_version = ? WHERE id = 1', (menu["version"],))
+                self.conn.execute('COMMIT')
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+        return True
+
+    def fetch_image(self, name):
+        # Local path of a published image, downloading it the first time
+        if not name or os.sep in name or '/' in name:
+            return ""
+        path = os.path.join(self.image_dir, name)
+        if os.path.exists(path):
+            return path
+        try:
+            data = self.request("GET", "/images/" + name)
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                return ""
+            raise
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as image:
+            image.write(data)
+        os.replace(tmp_path, path)
+        return path
+
+    def place(self, items, allow_partial=True, customer=None):
+        # items: (product_id, quantity) pairs. Queues the order, wakes the
+        # sync thread to send it and returns its key at once. The server's
+        # result ({"status", "order_id", ..., "short"} or {"status",
+        # "error"}) later arrives on outcomes under that key.
+        key = uuid.uuid4().hex
+        body = json.dumps({"key": key, "items": [{"product_id": product_id, "quantity": quantity}
+                                                 for product_id, quantity in items],
+                           "allow_partial": allow_partial, "customer": customer})
+        with self.lock:
+            self.conn.execute('INSERT INTO outbox (key, body, queued_at) VALUES (?, ?, ?)', (key, body, time.time()))
+        self.wake.set()
+        return key
+
+    def send(self, rows, timeout=None):
+        # Posts queued orders and removes those the server has settled.
+        # Failures on the server's side (5xx) stay queued for the next try.
+        reply = json.loads(self.request("POST", "/orders/sync", {"orders": [json.loads(body) for key, body in rows]},
+                                        timeout))
+        results = {result["key"]: result for result in reply["results"]}
+        settled = [key for key, result in results.items() if result["status"] < 500]
+        with self.lock:
+            self.conn.executemany('DELETE FROM outbox WHERE key = ?', [(key,) for key in settled])
+        for key in settled:
+            self.outcomes.put((key, results[key]))
+        return results
+
+    def flush(self):
+        sent = 0
+        while True:
+            with self.lock:
+                rows = self.conn.execute('SELECT key, body FROM outbox ORDER BY queued_at LIMIT ?',
+                                         (self.batch_size,)).fetchall()
+            if not rows:
+                return sent
+            results = self.send(rows)
+            for key, result in results.items():
+                if result["status"] >= 300:
+                    print(f"Queued order {key} was not placed: {result.get('error')}")
+            sent += len(rows)
+            if len(results) < len(rows) or any(result["status"] >= 500 for result in results.values()):
+                return sent
+
+    def queued(self):
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM outbox').fetchone()[0]
+
+    def set_online(self, online):
+        if online != self.online:
+            print("Menu server reachable" if online else "Menu server unreachable; orders will be queued")
+        self.online = online
+
+    def run(self):
+        while not self.stopped:
+            try:
+                sent = self.flush()
+                if sent:
+                    print(f"Sent {sent} queued orders")
+                self.pull_menu()
+                self.set_online(True)
+            except (OSError, ValueError, KeyError) as e:
+                if self.online is not False:
+                    print(f"Sync failed: {e}")
+                self.set_online(False)
+            self.wake.wait(self.interval)
+            self.wake.clear()
+
+    def close(self):
+        self.stopped = True
+        self.wake.set()
+        if self.thread.is_alive():
+            self.thread.join(self.timeout)
+        if not self.thread.is_alive():
+            with self.lock:
+                self.conn.close()
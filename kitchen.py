@@ -0,0 +1,272 @@
+import json
+import math
+import sqlite3
+import threading
+import time
+from collections import deque
+
+DEFAULT_PREP = (60, 1)  # seconds and units per batch for products missing from the menu
+
+# Kitchen scheduler used by the order server's --scheduler mode. Orders are
+# split into per-product work, and identical items from different orders
+# are cooked together up to the product's batch size (a pot of five teas
+# takes as long as one). Whenever a station (cook, grill, kettle) is free it
+# starts the batch with the most order weight per second of prep time, an
+# order's weight being split evenly over the products it still waits for;
+# that is Smith's shortest-weighted-time-first rule, which minimises mean
+# wait on one station and keeps small orders from queueing behind big ones.
+# Anything waiting longer than max_wait goes first, oldest first, so big
+# orders are delayed but never starved. policy="fifo" cooks orders strictly
+# in arrival order without batching across orders, for comparison.
+#
+# The schedule is a model: it assumes the stations cook what it says when
+# it says so. Ready times come from running a copy of it forward, so they
+# move when orders that jump the queue arrive later. Items with no prep
+# time (packaged snacks) are handed over at once. Callers serialise access
+# with the lock.
+
+class Ticket:
+    def __init__(self, number, arrived):
+        self.number = number
+        self.arrived = arrived
+        self.waiting = {}  # product -> units no station has started yet
+        self.cooking = 0  # units in batches on a station
+        self.ready_at = None
+
+    def copy(self):
+        ticket = Ticket(self.number, self.arrived)
+        ticket.waiting = dict(self.waiting)
+        ticket.cooking = self.cooking
+        ticket.ready_at = self.ready_at
+        return ticket
+
+def load_prep_times(path='canteen.db'):
+    # product name -> (prep seconds, batch size) from the products table
+    conn = sqlite3.connect(path)
+    try:
+        return {name: (prep_seconds, max(batch_size, 1)) for name, prep_seconds, batch_size in
+                conn.execute('SELECT name, prep_seconds, batch_size FROM products')}
+    except sqlite3.Error as e:
+        print(f"Could not load prep times from {path} ({e}); assuming {DEFAULT_PREP[0]}s per item")
+        return {}
+    finally:
+        conn.close()
+
+def order_lines(details):
+    # (product name, quantity) pairs from NEW_ORDER details; orders without
+    # readable items are treated as ready at once
+    try:
+        order = json.loads(details)
+        return [(str(item["product_name"]), int(item.get("quantity", 1))) for item in order["items"]]
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return []
+
+def ready_text(ready_at, now):
+    if ready_at is None:
+        return ""
+    if ready_at <= now:
+        return " Ready now."
+    return f" Ready in about {max(1, math.ceil((ready_at - now) / 60))} min."
+
+class Kitchen:
+    def __init__(self, prep_times=None, stations=2, policy="priority", max_wait=600, clock=time.time,
+                 menu_path=None, menu_refresh=60):
+        self.prep_times = prep_times if prep_times is not None else {}
+        self.policy = policy
+        self.max_wait = max_wait
+        self.clock = clock
+        self.menu_path = menu_path
+        self.menu_refresh = menu_refresh
+        self.menu_loaded = clock()
+        self.lock = threading.Lock()
+        self.now = clock()
+        self.stations = [[self.now, None, ()] for _ in range(stations)]  # [busy until, product, ((number, units), ...)]
+        self.queues = {}  # product -> deque of (number, units) not yet started, oldest first
+        self.tickets = {}  # number -> Ticket, until the order is handed over
+        self.promised = {}  # number -> ready time quoted when the order came in
+
+    def copy(self):
+        # Orders that are already ready are left out; planning cannot move them
+        kitchen = Kitchen(self.prep_times, 0, self.policy, self.max_wait, lambda: self.now)
+        kitchen.stations = [list(station) for station in self.stations]
+        kitchen.queues = {product: deque(queue) for product, queue in self.queues.items()}
+        kitchen.tickets = {number: ticket.copy() for number, ticket in self.tickets.items() if ticket.ready_at is None}
+        return kitchen
+
+    def prep(self, product):
+        return self.prep_times.get(product, DEFAULT_PREP)
+
+    def refresh_menu(self, products):
+        # A product added to the menu since the server started
+        if (self.menu_path and any(product not in self.prep_times for product in products)
+                and self.clock() - self.menu_loaded > self.menu_refresh):
+            self.menu_loaded = self.clock()
+            self.prep_times = load_prep_times(self.menu_path)
+
+    def add(self, number, details, now=None):
+        self.advance(self.clock() if now is None else now)
+        lines = order_lines(details)
+        self.refresh_menu(product for product, quantity in lines)
+        ticket = self.tickets[number] = Ticket(number, self.now)
+        for product, quantity in lines:
+            if quantity > 0 and self.prep(product)[0] > 0:
+                ticket.waiting[product] = ticket.waiting.get(product, 0) + quantity
+        for product, units in ticket.waiting.items():
+            self.queues.setdefault(product, deque()).append((number, units))
+        if not ticket.waiting:
+            ticket.ready_at = self.now
+        self.start_batches()
+
+    def promise(self, numbers):
+        # Quotes a ready time for newly added orders; one planning run
+        # covers a whole batch of them
+        plan = self.plan(numbers)
+        for number in numbers:
+            self.promised[number] = plan.get(number)
+
+    def remove(self, number, now=None):
+        # The order was handed over (or cancelled): drop its remaining work
+        self.advance(self.clock() if now is None else now)
+        ticket = self.tickets.pop(number, None)
+        if ticket is None:
+            return
+        for product in ticket.waiting:
+            queue = deque(entry for entry in self.queues[product] if entry[0] != number)
+            if queue:
+                self.queues[product] = queue
+            else:
+                del self.queues[product]
+
+    def take_next(self, now=None):
+        # The order to hand over next: the one that has been ready longest,
+        # or else the one expected to be ready first
+        self.advance(self.clock() if now is None else now)
+        if not self.tickets:
+            return None
+        ready = [(ticket.ready_at, number) for number, ticket in self.tickets.items() if ticket.ready_at is not None]
+        if ready:
+            number = min(ready)[1]
+        else:
+            kitchen = self.copy()
+            ready = []
+            while ready == []:
+                ready = kitchen.step()
+            number = min(ready) if ready else min(self.tickets)
+        self.remove(number)
+        return number
+
+    def plan(self, numbers=None):
+        # Ready times of the given orders (all of them by default) if the
+        # stations keep to the schedule; planning stops once they are ready
+        numbers = list(self.tickets) if numbers is None else numbers
+        kitchen = self.copy()
+        left = {number for number in numbers if number in kitchen.tickets}
+        while left:
+            ready = kitchen.step()
+            if ready is None:
+                break
+            left.difference_update(ready)
+        return {number: (kitchen.tickets if number in kitchen.tickets else self.tickets)[number].ready_at
+                for number in numbers if number in self.tickets}
+
+    def advance(self, until):
+        # Plays the schedule forward to `until`
+        while self.step(until) is not None:
+            pass
+        if until != math.inf:
+            self.now = max(self.now, until)
+
+    def step(self, until=math.inf):
+        # Free stations start their next batch, then the first batch to end
+        # (by `until`) finishes. Returns the orders that became ready, or
+        # None if no batch ends in time.
+        self.start_batches()
+        busy = [station for station in self.stations if station[1] is not None]
+        if not busy:
+            return None
+        station = min(busy, key=lambda station: station[0])
+        if station[0] > until:
+            return None
+        self.now = station[0]
+        return self.finish(station)
+
+    def start_batches(self):
+        for station in self.stations:
+            if station[1] is not None:
+                continue
+            choice = self.choose()
+            if choice is None:
+                return
+            product, entries = choice
+            queue = self.queues[product]
+            for number, units in entries:
+                left = queue[0][1] - units
+                if left:
+                    queue[0] = (number, left)
+                else:
+                    queue.popleft()
+                ticket = self.tickets[number]
+                ticket.waiting[product] -= units
+                if not ticket.waiting[product]:
+                    del ticket.waiting[product]
+                ticket.cooking += units
+            if not queue:
+                del self.queues[product]
+            station[:] = [self.now + self.prep(product)[0], product, tuple(entries)]
+
+    def choose(self):
+        best = None
+        best_key = None
+        for product, queue in self.queues.items():
+            seconds, batch_size = self.prep(product)
+            oldest = self.tickets[queue[0][0]].arrived
+            if self.policy == "fifo":
+                key = (oldest, queue[0][0])
+                entries = [(queue[0][0], min(queue[0][1], batch_size))]
+            else:
+                entries = []
+                units = 0
+                weight = 0.0
+                for number, count in queue:
+                    take = min(count, batch_size - units)
+                    entries.append((number, take))
+                    weight += 1 / len(self.tickets[number].waiting)
+                    units += take
+                    if units == batch_size:
+                        break
+                if self.now - oldest > self.max_wait:
+                    key = (0, oldest, 0.0)
+                else:
+                    key = (1, -weight / seconds, oldest)
+            if best_key is None or key < best_key:
+                best, best_key = (product, entries), key
+        return best
+
+    def finish(self, station):
+        ends_at, product, entries = station
+        ready = []
+        for number, units in entries:
+            ticket = self.tickets.get(number)
+            if ticket is None:
+                continue  # handed over before it was cooked
+            ticket.cooking -= units
+            if not ticket.cooking and not ticket.waiting:
+                ticket.ready_at = ends_at
+                ready.append(number)
+        station[1:] = [None, ()]
+        return ready
+
+    def status(self):
+        # What each station is cooking, what is waiting and when every open
+        # order should be ready, in seconds from now
+        self.advance(self.clock())
+        plan = self.plan()
+        return {
+            "stations": [{"product": product, "units": sum(units for number, units in entries),
+                          "orders": [number for number, units in entries if number in self.tickets],
+                          "done_in": round(ends_at - self.now)}
+                         if product is not None else None for ends_at, product, entries in self.stations],
+            "waiting": {product: sum(units for number, units in queue) for product, queue in self.queues.items()},
+            "orders": [{"order": number, "ready_in": max(0, round(ready_at - self.now))}
+                       for number, ready_at in sorted(plan.items(), key=lambda item: (item[1], item[0]))],
+        }
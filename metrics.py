@@ -0,0 +1,191 @@
+import bisect
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Small in-process metrics layer for the socket servers. Updates take one
+# uncontended lock and a few arithmetic ops, cheap enough to leave on in
+# production. A Registry renders everything as a JSON snapshot (for the
+# STATS command) or in Prometheus text format (for the HTTP endpoint).
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in sorted(labels.items())) + "}"
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, labels=None):
+        self.name = name
+        self.labels = labels or {}
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self):
+        return [(self.name, self.labels, self.value)]
+
+    def snapshot(self):
+        return self.value
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name, labels=None, function=None):
+        # With a function the gauge is read at scrape time instead of set
+        self.name = name
+        self.labels = labels or {}
+        self.value = 0
+        self.function = function
+        self.lock = threading.Lock()
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def get(self):
+        return self.function() if self.function else self.value
+
+    def samples(self):
+        return [(self.name, self.labels, self.get())]
+
+    def snapshot(self):
+        return self.get()
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, labels=None, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.labels = labels or {}
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    def quantile(self, fraction):
+        # Upper bound of the bucket holding the requested rank
+        with self.lock:
+            target = fraction * self.count
+            running = 0
+            for bound, count in zip(self.buckets, self.counts):
+                running += count
+                if count and running >= target:
+                    return min(bound, self.max)
+            return self.max
+
+    def samples(self):
+        with self.lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        samples = []
+        running = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            running += bucket_count
+            samples.append((self.name + "_bucket", dict(self.labels, le=repr(bound)), running))
+        samples.append((self.name + "_bucket", dict(self.labels, le="+Inf"), count))
+        samples.append((self.name + "_sum", self.labels, total))
+        samples.append((self.name + "_count", self.labels, count))
+        return samples
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "avg_ms": round(self.sum / self.count * 1000, 3) if self.count else 0.0,
+            "p50_ms": round(self.quantile(0.5) * 1000, 3) if self.count else 0.0,
+            "p99_ms": round(self.quantile(0.99) * 1000, 3) if self.count else 0.0,
+            "max_ms": round(self.max * 1000, 3),
+        }
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}  # (name, labels) -> metric
+        self.help = {}
+        self.lock = threading.Lock()
+
+    def get_or_create(self, cls, name, help_text, labels, **kwargs):
+        key = (name, tuple(sorted((labels or {}).items())))
+        metric = self.metrics.get(key)
+        if metric is None:
+            with self.lock:
+                metric = self.metrics.get(key)
+                if metric is None:
+                    metric = cls(name, labels, **kwargs)
+                    self.metrics[key] = metric
+                    self.help.setdefault(name, (help_text, cls.kind))
+        return metric
+
+    def counter(self, name, help_text="", labels=None):
+        return self.get_or_create(Counter, name, help_text, labels)
+
+    def gauge(self, name, help_text="", labels=None, function=None):
+        return self.get_or_create(Gauge, name, help_text, labels, function=function)
+
+    def histogram(self, name, help_text="", labels=None, buckets=LATENCY_BUCKETS):
+        return self.get_or_create(Histogram, name, help_text, labels, buckets=buckets)
+
+    def snapshot(self):
+        result = {}
+        for (name, labels), metric in list(self.metrics.items()):
+            result[name + format_labels(dict(labels))] = metric.snapshot()
+        return result
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), separators=(",", ":"))
+
+    def render_prometheus(self):
+        lines = []
+        seen = set()
+        for (name, labels), metric in sorted(self.metrics.items(), key=lambda item: item[0]):
+            if name not in seen:
+                seen.add(name)
+                help_text, kind = self.help[name]
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+            for sample_name, sample_labels, value in metric.samples():
+                lines.append(f"{sample_name}{format_labels(sample_labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+def serve_metrics(registry, port, host="localhost"):
+    # GET /metrics in Prometheus text format from a daemon thread
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = registry.render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Metrics available on http://{host}:{port}/metrics")
+    return server
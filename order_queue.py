@@ -0,0 +1,338 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+
+from stock import begin_immediate
+
+# Thread-safe FIFO of pending orders backed by an append-only journal.
+# Pending orders live in an OrderedDict keyed by order number, which gives
+# O(1) enqueue, O(1) FIFO completion and O(1) completion of a specific order.
+# Every change is appended to the journal before it is applied, and the
+# journal is replayed on startup so a restart loses nothing.
+class OrderQueue:
+    def __init__(self, journal_path="orders.journal", fsync=False, compact_threshold=100000):
+        self.journal_path = journal_path
+        self.fsync = fsync
+        self.compact_threshold = compact_threshold
+        self.lock = threading.Lock()
+        self.pending = OrderedDict()
+        self.order_counter = 0
+        self.journal_records = 0
+        self.journal = None
+        if journal_path:
+            self.recover()
+            self.journal = open(journal_path, "ab")
+
+    def recover(self):
+        if not os.path.exists(self.journal_path):
+            return
+        good_offset = 0
+        with open(self.journal_path, "rb") as journal:
+            for line in journal:
+                # A torn write at the tail from a crash; everything before
+                # it is intact. A last line without its newline counts as
+                # torn even if it parses, or the next append would join it.
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                self.apply(record)
+                self.journal_records += 1
+                good_offset += len(line)
+        if good_offset < os.path.getsize(self.journal_path):
+            with open(self.journal_path, "r+b") as journal:
+                journal.truncate(good_offset)
+        print(f"Recovered {len(self.pending)} pending orders from {self.journal_path}")
+
+    def apply(self, record):
+        op = record["op"]
+        if op == "new":
+            self.pending[record["n"]] = record.get("details", "")
+            self.order_counter = max(self.order_counter, record["n"])
+        elif op == "done":
+            self.pending.pop(record["n"], None)
+        elif op == "seq":
+            self.order_counter = max(self.order_counter, record["n"])
+
+    def append(self, record, flush=True):
+        if self.journal is None:
+            return
+        self.journal.write(json.dumps(record, separators=(",", ":")).encode("utf-8") + b"\n")
+        self.journal_records += 1
+        if flush:
+            self.flush_journal()
+
+    def flush_journal(self):
+        if self.journal is None:
+            return
+        self.journal.flush()
+        if self.fsync:
+            os.fsync(self.journal.fileno())
+
+    def add(self, details=""):
+        return self.run_batch([("new", details)])[0]
+
+    def complete(self, number=None):
+        # Completes the oldest order, or a specific one when a number is
+        # given. Returns (number, details, orders_left) or None.
+        return self.run_batch([("done", number)])[0]
+
+    def run_batch(self, operations):
+        # Applies ("new", details) and ("done", number or None) operations in
+        # order under one hold of the lock, with one journal flush (and
+        # fsync) for the lot. Returns what add or complete would have
+        # returned for each.
+        with self.lock:
+            results = [self.enqueue(argument) if op == "new" else self.dequeue(argument)
+                       for op, argument in operations]
+            self.flush_journal()
+            if self.journal_records > self.compact_threshold and self.journal_records > 2 * len(self.pending):
+                self.compact()
+            return results
+
+    def enqueue(self, details):
+        # Called with the lock held
+        number = self.order_counter + 1
+        self.append({"op": "new", "n": number, "details": details}, flush=False)
+        self.order_counter = number
+        self.pending[number] = details
+        return number, len(self.pending)
+
+    def dequeue(self, number):
+        # Called with the lock held
+        if number is None:
+            if not self.pending:
+                return None
+            number = next(iter(self.pending))
+        elif number not in self.pending:
+            return None
+        self.append({"op": "done", "n": number}, flush=False)
+        details = self.pending.pop(number)
+        return number, details, len(self.pending)
+
+    def compact(self):
+        # Rewrites the journal with only the live state. Called with the lock
+        # held; os.replace keeps the swap atomic if we crash halfway.
+        if self.journal is None:
+            return
+        tmp_path = self.journal_path + ".tmp"
+        with open(tmp_path, "wb") as tmp:
+            records = [{"op": "seq", "n": self.order_counter}]
+            records += [{"op": "new", "n": n, "details": d} for n, d in self.pending.items()]
+            for record in records:
+                tmp.write(json.dumps(record, separators=(",", ":")).encode("utf-8") + b"\n")
+            tmp.flush()
+            os.fsync(tmp.fileno())
+        self.journal.close()
+        os.replace(tmp_path, self.journal_path)
+        self.journal = open(self.journal_path, "ab")
+        self.journal_records = len(records)
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.pending.items())
+
+    def __len__(self):
+        return len(self.pending)
+
+    def close(self):
+        with self.lock:
+            if self.journal is not None:
+                self.journal.close()
+                self.journal = None
+
+# The same queue kept in SQLite so several server processes can share it.
+# Numbers come from AUTOINCREMENT, so they are unique across processes and
+# never reused, and FIFO completion takes the lowest pending number under
+# the database write lock. Every change is also appended to order_events in
+# the same transaction; each process follows that log to push events to its
+# own subscribers. Writes are group-committed: whichever of the server's
+# threads gets the write lock also applies every batch the others queued in
+# the meantime, in the same transaction, so adding workers adds one
+# contender for the write lock per process rather than one per command.
+class SqliteOrderQueue:
+    def __init__(self, path="orders.db", fsync=False, event_retention=10000, group_size=256):
+        self.path = path
+        self.event_retention = event_retention
+        self.group_size = group_size
+        self.lock = threading.RLock()
+        self.submissions = deque()  # [operations, outcome] waiting for a commit
+        # No busy handler: contention is handled by begin_immediate's polling
+        self.conn = sqlite3.connect(path, timeout=0, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(f'PRAGMA synchronous={"FULL" if fsync else "NORMAL"}')
+        self.transaction(self.create_tables)
+
+    def create_tables(self, conn):
+        conn.execute('CREATE TABLE IF NOT EXISTS pending_orders (n INTEGER PRIMARY KEY AUTOINCREMENT, details TEXT NOT NULL)')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS order_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                n INTEGER NOT NULL,
+                details TEXT NOT NULL
+            )
+        ''')
+        # Kept alongside so the length reported with every reply is O(1)
+        conn.execute('CREATE TABLE IF NOT EXISTS queue_state (id INTEGER PRIMARY KEY CHECK (id = 1), pending INTEGER NOT NULL)')
+        conn.execute('INSERT OR IGNORE INTO queue_state (id, pending) SELECT 1, COUNT(*) FROM pending_orders')
+
+    def transaction(self, work):
+        with self.lock:
+            try:
+                self.conn.execute('BEGIN IMMEDIATE')
+            except sqlite3.OperationalError:
+                # Another worker holds the write lock
+                begin_immediate(self.conn, timeout=30)
+            try:
+                result = work(self.conn)
+                self.conn.execute('COMMIT')
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+            return result
+
+    def record(self, conn, kind, number, details):
+        event_id = conn.execute('INSERT INTO order_events (kind, n, details) VALUES (?, ?, ?)',
+                                (kind, number, details)).lastrowid
+        if event_id % 1000 == 0:
+            conn.execute('DELETE FROM order_events WHERE id <= ?', (event_id - self.event_retention,))
+
+    def count(self, conn, change=0):
+        if change:
+            conn.execute('UPDATE queue_state SET pending = pending + ? WHERE id = 1', (change,))
+        return conn.execute('SELECT pending FROM queue_state WHERE id = 1').fetchone()[0]
+
+    def add(self, details=""):
+        return self.run_batch([("new", details)])[0]
+
+    def complete(self, number=None):
+        return self.run_batch([("done", number)])[0]
+
+    def run_batch(self, operations):
+        # Same contract as OrderQueue.run_batch. The batch is queued, and
+        # unless another thread has applied it by the time we hold the lock,
+        # we apply it along with whatever else is queued. A thread that
+        # finds its batch done just returns: no transaction of its own.
+        submission = [operations, None]
+        self.submissions.append(submission)
+        with self.lock:
+            while submission[1] is None:
+                try:
+                    self.write_group()
+                except BaseException:
+                    if submission[1] is None:
+                        self.submissions.remove(submission)
+                    raise
+        results, error = submission[1]
+        if error is not None:
+            raise error
+        return results
+
+    def write_group(self):
+        # Called with the lock held. Batches are taken once the write lock
+        # is ours, so the longer other workers keep it, the more each commit
+        # carries, and a lone caller never waits for company.
+        group = []
+
+        def work(conn):
+            while self.submissions and len(group) < self.group_size:
+                group.append(self.submissions.popleft())
+            pending = start = self.count(conn)
+            results = []
+            for operations, outcome in group:
+                result, pending = self.apply(conn, operations, pending)
+                results.append(result)
+            self.count(conn, pending - start)
+            return results
+
+        try:
+            results = self.transaction(work)
+        except BaseException as e:
+            # The whole group rolled back; every caller in it gets the error.
+            # With nothing taken yet (no write lock) it is the caller's alone.
+            for submission in group:
+                submission[1] = (None, e)
+            if not group or not isinstance(e, Exception):
+                raise
+            return
+        for submission, result in zip(group, results):
+            submission[1] = (result, None)
+
+    def apply(self, conn, operations, pending):
+        # Called inside the writer's transaction with the number of pending
+        # orders so far; returns the results and the new number
+        results = []
+        for op, argument in operations:
+            if op == "new":
+                number = conn.execute('INSERT INTO pending_orders (details) VALUES (?)', (argument,)).lastrowid
+                self.record(conn, "created", number, argument)
+                pending += 1
+                results.append((number, pending))
+                continue
+            if argument is None:
+                row = conn.execute('SELECT n, details FROM pending_orders ORDER BY n LIMIT 1').fetchone()
+            else:
+                row = conn.execute('SELECT n, details FROM pending_orders WHERE n = ?', (argument,)).fetchone()
+            if row is None:
+                results.append(None)
+                continue
+            conn.execute('DELETE FROM pending_orders WHERE n = ?', (row[0],))
+            self.record(conn, "completed", row[0], row[1])
+            pending -= 1
+            results.append((row[0], row[1], pending))
+        return results, pending
+
+    def import_journal(self, journal_path):
+        # One-off upgrade: a fresh database takes over the pending orders and
+        # numbering of an existing single-process journal
+        if not journal_path or not os.path.exists(journal_path):
+            return 0
+        def work(conn):
+            if conn.execute("SELECT 1 FROM sqlite_sequence WHERE name = 'pending_orders'").fetchone():
+                return 0
+            journal = OrderQueue(journal_path)
+            journal.close()
+            conn.executemany('INSERT INTO pending_orders (n, details) VALUES (?, ?)', journal.pending.items())
+            conn.execute("DELETE FROM sqlite_sequence WHERE name = 'pending_orders'")
+            conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('pending_orders', ?)", (journal.order_counter,))
+            self.count(conn, len(journal.pending))
+            return len(journal.pending)
+        return self.transaction(work)
+
+    def follow(self, callback, interval=0.005):
+        # Calls callback(events) with the (kind, number, details) of every
+        # change committed by any process from now on, a batch at a time.
+        # Blocks forever, so run it in a daemon thread. PRAGMA data_version
+        # makes an idle poll nearly free.
+        conn = sqlite3.connect(self.path, isolation_level=None)
+        last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM order_events').fetchone()[0]
+        data_version = None
+        while True:
+            version = conn.execute('PRAGMA data_version').fetchone()[0]
+            if version == data_version:
+                time.sleep(interval)
+                continue
+            data_version = version
+            rows = conn.execute('SELECT id, kind, n, details FROM order_events WHERE id > ? ORDER BY id',
+                                (last_id,)).fetchall()
+            if rows:
+                last_id = rows[-1][0]
+                callback([row[1:] for row in rows])
+
+    def snapshot(self):
+        with self.lock:
+            return self.conn.execute('SELECT n, details FROM pending_orders ORDER BY n').fetchall()
+
+    def __len__(self):
+        with self.lock:
+            return self.count(self.conn)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -1,38 +1,586 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import queue
+import signal
 import socket
+import sqlite3
+import sys
 import threading
+import time
+
+from capture import TrafficCapture
+from framing import LineReader, MAX_LINE, encode_line
+from kitchen import Kitchen, load_prep_times, ready_text
+from metrics import Registry, serve_metrics
+from order_queue import OrderQueue, SqliteOrderQueue
+
+COMMANDS = ("NEW_ORDER", "COMPLETE_ORDER", "SUBSCRIBE", "STATS", "BATCH", "KITCHEN", "LOOKUP")
+MAX_SUBSCRIBER_BUFFER = 1024 * 1024  # bytes an asyncio subscriber may fall behind before it is dropped
+
+def details_order_id(details):
+    # The canteen.db order id carried by NEW_ORDER details, if any
+    try:
+        order_id = json.loads(details).get("order_id")
+    except (ValueError, AttributeError):
+        return None
+    return order_id if isinstance(order_id, int) else None
+
+def reconcile(orders, db_path, chunk_size=500):
+    # canteen.db is the record of what has been completed; the queue only
+    # tracks what the counter still has to hand over. On startup, recovered
+    # orders that the database shows as no longer pending (completed
+    # through the API or the owner screen while we were down) are dropped,
+    # as are ones since archived: ids at or below the orders sequence that
+    # are gone from the table. Orders without an order id are kept.
+    if not db_path or not os.path.exists(db_path):
+        return 0
+    tracked = {}
+    for number, details in orders.snapshot():
+        order_id = details_order_id(details)
+        if order_id is not None:
+            tracked[order_id] = number
+    if not tracked:
+        return 0
+    try:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=5)
+    except sqlite3.Error as e:
+        print(f"Could not check recovered orders against {db_path}: {e}")
+        return 0
+    try:
+        row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'orders'").fetchone()
+        last_id = row[0] if row else 0
+        statuses = {}
+        order_ids = list(tracked)
+        for start in range(0, len(order_ids), chunk_size):
+            chunk = order_ids[start:start + chunk_size]
+            statuses.update(conn.execute(f"SELECT id, status FROM orders WHERE id IN ({','.join('?' * len(chunk))})",
+                                         chunk))
+    except sqlite3.Error as e:
+        print(f"Could not check recovered orders against {db_path}: {e}")
+        return 0
+    finally:
+        conn.close()
+    done = []
+    for order_id, number in tracked.items():
+        status = statuses.get(order_id)
+        if status is None:
+            # Missing: archived if the database issued the id, else unknown
+            if order_id <= last_id:
+                done.append(number)
+        elif status != "Pending":
+            done.append(number)
+    if done:
+        orders.run_batch([("done", number) for number in done])
+        print(f"Dropped {len(done)} recovered orders that {db_path} shows as completed")
+    return len(done)
+
+def peer_name(sock):
+    try:
+        host, port = sock.getpeername()[:2]
+        return f"{host}:{port}"
+    except (OSError, TypeError):
+        return ""
+
+class Connection:
+    # A threaded-mode terminal. Replies are written by its handler thread
+    # until it sends SUBSCRIBE. After that events arrive from other
+    # connections' handler threads, which must never wait on this socket,
+    # so every line goes through a bounded outbox drained by a writer thread
+    # of its own (replies too, to stay in order with the events). A
+    # subscriber that falls max_queue lines behind is disconnected.
+    def __init__(self, client_socket, max_queue, on_evict):
+        self.client_socket = client_socket
+        self.max_queue = max_queue
+        self.on_evict = on_evict
+        self.handler = threading.get_ident()
+        self.lock = threading.Lock()
+        self.outbox = None
+        self.closed = False
+
+    def __call__(self, line):
+        if self.closed:
+            raise ConnectionResetError("Connection closed")
+        if self.outbox is None:
+            with self.lock:
+                self.client_socket.sendall(encode_line(line))
+        elif threading.get_ident() == self.handler:
+            # Its own replies and SUBSCRIBE snapshot may wait for room
+            data = encode_line(line)
+            while True:
+                try:
+                    self.outbox.put(data, timeout=1.0)
+                    return
+                except queue.Full:
+                    if self.closed:
+                        raise ConnectionResetError("Connection closed")
+        else:
+            try:
+                self.outbox.put_nowait(encode_line(line))
+            except queue.Full:
+                self.close()
+                self.on_evict()
+                raise ConnectionResetError("Subscriber fell behind")
+
+    def follow(self):
+        if self.outbox is None:
+            self.outbox = queue.Queue(maxsize=self.max_queue)
+            threading.Thread(target=self.write_loop, daemon=True).start()
+
+    def write_loop(self):
+        while not self.closed:
+            data = self.outbox.get()
+            if data is None:
+                break
+            chunks = [data]
+            # Coalesce whatever else is already queued into one send
+            while len(chunks) < 64:
+                try:
+                    data = self.outbox.get_nowait()
+                except queue.Empty:
+                    break
+                if data is None:
+                    break
+                chunks.append(data)
+            try:
+                self.client_socket.sendall(b"".join(chunks))
+            except OSError:
+                self.close()
+                break
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            # Wakes up both the reader and a writer stuck in sendall
+            self.client_socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        if self.outbox is not None:
+            try:
+                self.outbox.put_nowait(None)
+            except queue.Full:
+                pass
+
+class AsyncConnection:
+    # An asyncio-mode terminal. Writes only buffer, and the handler drains
+    # after each of its own replies, but events pushed while a subscriber
+    # is not reading would buffer without limit, so past max_buffer bytes
+    # it is disconnected.
+    def __init__(self, writer, max_buffer, on_evict):
+        self.writer = writer
+        self.max_buffer = max_buffer
+        self.on_evict = on_evict
+        self.replying = False
+
+    def __call__(self, line):
+        if self.writer.is_closing():
+            raise ConnectionResetError("Subscriber disconnected")
+        if not self.replying and self.writer.transport.get_write_buffer_size() > self.max_buffer:
+            self.writer.transport.abort()
+            self.on_evict()
+            raise ConnectionResetError("Subscriber fell behind")
+        self.writer.write(encode_line(line))
+
+    def follow(self):
+        pass
 
 class OrderServer:
-    def __init__(self, host="localhost", port=8888):
+    capture = None  # TrafficCapture recording every command and reply
+
+    def __init__(self, host="localhost", port=8888, backlog=128, journal_path="orders.journal", fsync=False,
+                 orders=None, reuse_port=False, kitchen=None, max_queue=1024, orders_db=None):
         self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            # Each worker process binds its own socket and the kernel spreads
+            # incoming connections across them
+            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self.server.bind((host, port))
-        self.server.listen(5)
-        self.orders = []
-        self.order_counter = 0
+        self.server.listen(backlog)
+        print(f"Order server started on {host}:{port} (pid {os.getpid()})")
+        self.orders = orders if orders is not None else OrderQueue(journal_path, fsync=fsync)
+        reconcile(self.orders, orders_db)
+        self.max_queue = max_queue
+        # Optional kitchen scheduler: decides which order "complete the next
+        # order" hands over and quotes a ready time for every new order
+        self.kitchen = kitchen
+        if kitchen is not None:
+            with kitchen.lock:
+                for order_number, details in self.orders.snapshot():
+                    kitchen.add(order_number, details)
+        # Push callables of connections that sent SUBSCRIBE. Swapped rather
+        # than mutated so publish can iterate without holding the lock.
+        self.subscribers = ()
+        self.subscribers_lock = threading.Lock()
+        self.metrics = Registry()
+        self.connections = self.metrics.gauge("order_connections", "Terminal connections currently open")
+        self.connections_total = self.metrics.counter("order_connections_total", "Terminal connections accepted")
+        self.metrics.gauge("order_queue_depth", "Orders waiting to be completed", function=lambda: len(self.orders))
+        self.metrics.gauge("order_subscribers", "Connections following the order feed",
+                           function=lambda: len(self.subscribers))
+        self.events_published = self.metrics.counter("order_events_published_total", "Order events pushed to subscribers")
+        self.subscribers_evicted = self.metrics.counter("order_subscribers_evicted_total",
+                                                        "Subscribers disconnected for falling behind the feed")
+        self.command_errors = self.metrics.counter("order_command_errors_total", "Commands answered with ERROR")
+        # Unknown commands share one label so clients cannot grow the registry
+        self.command_latency = {command: self.metrics.histogram("order_command_seconds", "Time to process a command",
+                                                                {"command": command})
+                                for command in COMMANDS + ("other",)}
 
-    def handle_client(self, client_socket):
-        while True:
+    def subscribe(self, send):
+        with self.subscribers_lock:
+            self.subscribers = self.subscribers + (send,)
+
+    def unsubscribe(self, send):
+        with self.subscribers_lock:
+            self.subscribers = tuple(s for s in self.subscribers if s is not send)
+
+    def evicted(self):
+        print("Disconnecting a subscriber that fell behind the order feed")
+        self.subscribers_evicted.inc()
+
+    def publish(self, event):
+        self.deliver(event)
+
+    def deliver(self, event):
+        for send in self.subscribers:
             try:
-                message = client_socket.recv(1024).decode()
-                if message.startswith("NEW_ORDER"):
-                    self.order_counter += 1
-                    self.orders.append(self.order_counter)
-                    response = f"Order {self.order_counter} received. {len(self.orders)} orders left."
-                    client_socket.send(response.encode())
-                elif message.startswith("COMPLETE_ORDER"):
-                    if self.orders:
-                        completed_order = self.orders.pop(0)
-                        response = f"Order {completed_order} completed. {len(self.orders)} orders left."
-                        client_socket.send(response.encode())
-            except:
-                client_socket.close()
-                break
+                send(event)
+                self.events_published.inc()
+            except OSError:
+                self.unsubscribe(send)
+
+    def process_message(self, message, send=None):
+        # "#<id> COMMAND ..." is answered with "#<id> <response>", so a client
+        # can pipeline requests and tell its replies apart from pushed events
+        request_id = None
+        if message.startswith("#"):
+            request_id, _, message = message.partition(" ")
+        started = time.perf_counter()
+        response = self.execute(message, send)
+        command = message.split(" ", 1)[0]
+        latency = self.command_latency.get(command) or self.command_latency["other"]
+        latency.observe(time.perf_counter() - started)
+        if response.startswith("ERROR"):
+            self.command_errors.inc()
+        return response if request_id is None else f"{request_id} {response}"
+
+    def execute(self, message, send=None):
+        # Protocol handling shared by the threaded and asyncio server modes.
+        # send pushes an unsolicited line to this connection (for SUBSCRIBE);
+        # it is a Connection or AsyncConnection.
+        if message.startswith("NEW_ORDER"):
+            details = message[len("NEW_ORDER"):].strip()
+            return self.order_reply("new", details, self.run_orders([("new", details)])[0])
+        elif message.startswith("COMPLETE_ORDER"):
+            argument = message[len("COMPLETE_ORDER"):].strip()
+            if argument and not argument.isdigit():
+                return f"ERROR Invalid order number: {argument}"
+            number = int(argument) if argument else None
+            return self.order_reply("done", number, self.run_orders([("done", number)])[0])
+        elif message.startswith("BATCH"):
+            return self.execute_batch(message[len("BATCH"):].strip())
+        elif message == "SUBSCRIBE":
+            if send is None:
+                return "ERROR Subscriptions are not supported on this connection"
+            send.follow()
+            self.subscribe(send)
+            # Replay the current queue so a new screen starts in sync; a
+            # duplicate with a concurrent ORDER_CREATED is harmless.
+            pending = self.orders.snapshot()
+            for order_number, details in pending:
+                send(f"ORDER_CREATED {order_number} {details}")
+            return f"SUBSCRIBED {len(pending)} orders left."
+        elif message.startswith("LOOKUP"):
+            return self.lookup(message[len("LOOKUP"):].split())
+        elif message == "STATS":
+            return "STATS " + self.metrics.to_json()
+        elif message == "KITCHEN":
+            if self.kitchen is None:
+                return "ERROR The kitchen scheduler is not enabled"
+            with self.kitchen.lock:
+                return "KITCHEN " + json.dumps(self.kitchen.status())
+        return f"ERROR Unknown command: {message.split(' ', 1)[0]}"
+
+    def lookup(self, order_ids):
+        # LOOKUP <order_id> ... answers "LOOKUP {"<order_id>": number, ...}"
+        # for the pending orders whose details carry those database order
+        # ids, so a screen that loaded its orders from the database can
+        # report completions by number
+        if not order_ids or not all(order_id.isdigit() for order_id in order_ids):
+            return "ERROR Usage: LOOKUP <order_id> ..."
+        wanted = set(map(int, order_ids))
+        numbers = {}
+        for number, details in self.orders.snapshot():
+            order_id = details_order_id(details)
+            if order_id in wanted:
+                numbers[str(order_id)] = number
+        return "LOOKUP " + json.dumps(numbers)
+
+    def execute_batch(self, argument):
+        # BATCH ["NEW_ORDER {...}", "COMPLETE_ORDER 12", ...] applies all the
+        # order commands as one unit (one journal flush, or one transaction
+        # on the shared queue) and answers "BATCH [reply, ...]" in order
+        try:
+            commands = json.loads(argument)
+        except ValueError:
+            commands = None
+        if not isinstance(commands, list) or not all(isinstance(command, str) for command in commands):
+            return "ERROR Invalid batch: expected a JSON array of commands"
+        replies = [None] * len(commands)
+        operations = []
+        slots = []
+        for index, command in enumerate(commands):
+            name, _, argument = command.partition(" ")
+            argument = argument.strip()
+            if name == "NEW_ORDER":
+                operations.append(("new", argument))
+            elif name == "COMPLETE_ORDER" and (not argument or argument.isdigit()):
+                operations.append(("done", int(argument) if argument else None))
+            elif name == "COMPLETE_ORDER":
+                replies[index] = f"ERROR Invalid order number: {argument}"
+                continue
+            else:
+                replies[index] = f"ERROR {name} is not allowed in a batch"
+                continue
+            slots.append(index)
+        results = self.run_orders(operations) if operations else []
+        for index, (op, argument), result in zip(slots, operations, results):
+            replies[index] = self.order_reply(op, argument, result)
+        errors = sum(reply.startswith("ERROR") for reply in replies)
+        if errors:
+            self.command_errors.inc(errors)
+        return "BATCH " + json.dumps(replies)
+
+    def run_orders(self, operations):
+        # Applies ("new", details) and ("done", number or None) operations to
+        # the queue. With the kitchen scheduler both change under its lock,
+        # an unnumbered completion hands over the order the kitchen expects
+        # ready first rather than the oldest, and new orders are quoted a
+        # ready time with one planning run for the lot.
+        if self.kitchen is None:
+            return self.orders.run_batch(operations)
+        with self.kitchen.lock:
+            resolved = []
+            for op, argument in operations:
+                if op == "done":
+                    if argument is None:
+                        argument = self.kitchen.take_next()
+                    else:
+                        self.kitchen.remove(argument)
+                resolved.append((op, argument))
+            results = self.orders.run_batch(resolved)
+            added = []
+            for (op, argument), result in zip(resolved, results):
+                if op == "new":
+                    self.kitchen.add(result[0], argument)
+                    added.append(result[0])
+            if added:
+                self.kitchen.promise(added)
+            return results
+
+    def order_reply(self, op, argument, result):
+        # Publishes the change and words the reply for a NEW_ORDER ("new")
+        # or COMPLETE_ORDER ("done") that the queue has applied
+        if op == "new":
+            order_number, orders_left = result
+            self.publish(f"ORDER_CREATED {order_number} {argument}")
+            reply = f"Order {order_number} received. {orders_left} orders left."
+            if self.kitchen is not None:
+                reply += ready_text(self.kitchen.promised.pop(order_number, None), self.kitchen.clock())
+            return reply
+        if result:
+            completed_order, details, orders_left = result
+            self.publish(f"ORDER_COMPLETED {completed_order} {details}")
+            return f"Order {completed_order} completed. {orders_left} orders left."
+        if argument is not None:
+            return f"Order {argument} is not pending. {len(self.orders)} orders left."
+        return "No pending orders. 0 orders left."
+
+    def handle_client(self, client_socket):
+        reader = LineReader(client_socket)
+        self.connections_total.inc()
+        self.connections.inc()
+        connection_id = self.capture.opened(peer_name(client_socket)) if self.capture else None
+        send = Connection(client_socket, self.max_queue, self.evicted)
+        try:
+            for message in reader:
+                response = self.process_message(message, send)
+                if self.capture is not None:
+                    self.capture.command(connection_id, message, response)
+                send(response)
+        except (OSError, ValueError):
+            pass
+        finally:
+            self.unsubscribe(send)
+            self.connections.dec()
+            if self.capture is not None:
+                self.capture.closed(connection_id)
+            send.close()
+            client_socket.close()
 
     def run(self):
         while True:
             client_socket, addr = self.server.accept()
-            client_handler = threading.Thread(target=self.handle_client, args=(client_socket,))
+            client_handler = threading.Thread(target=self.handle_client, args=(client_socket,), daemon=True)
             client_handler.start()
 
-if __name__ == "__main__":
-    order_server = OrderServer()
+class AsyncOrderServer(OrderServer):
+    # Single-threaded event loop mode: one coroutine per terminal instead of
+    # one OS thread, so thousands of kiosks can stay connected on one core.
+
+    async def handle_connection(self, reader, writer):
+        send = AsyncConnection(writer, MAX_SUBSCRIBER_BUFFER, self.evicted)
+        self.connections_total.inc()
+        self.connections.inc()
+        connection_id = None
+        if self.capture is not None:
+            connection_id = self.capture.opened(peer_name(writer.get_extra_info("socket")))
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                message = line.decode().rstrip("\r\n")
+                send.replying = True
+                try:
+                    response = self.process_message(message, send)
+                    if self.capture is not None:
+                        self.capture.command(connection_id, message, response)
+                    send(response)
+                finally:
+                    send.replying = False
+                await writer.drain()
+        except (ConnectionError, ValueError, asyncio.LimitOverrunError):
+            pass
+        finally:
+            self.unsubscribe(send)
+            self.connections.dec()
+            if self.capture is not None:
+                self.capture.closed(connection_id)
+            writer.close()
+
+    async def serve(self):
+        self.server.setblocking(False)
+        server = await asyncio.start_server(self.handle_connection, sock=self.server, limit=MAX_LINE)
+        async with server:
+            await server.serve_forever()
+
+    def run(self):
+        asyncio.run(self.serve())
+
+class SharedOrderServer(OrderServer):
+    # One of several worker processes sharing a SqliteOrderQueue. Events are
+    # delivered from the shared event log instead of directly, so every
+    # worker's subscribers see orders taken and completed by all workers.
+    def __init__(self, host="localhost", port=8888, backlog=128, queue_path="orders.db", fsync=False, max_queue=1024):
+        super().__init__(host, port, backlog, orders=SqliteOrderQueue(queue_path, fsync=fsync), reuse_port=True,
+                         max_queue=max_queue)
+        threading.Thread(target=self.orders.follow, args=(self.on_events,), daemon=True).start()
+
+    def publish(self, event):
+        pass
+
+    def on_events(self, events):
+        for kind, number, details in events:
+            self.deliver(f"ORDER_{kind.upper()} {number} {details}")
+
+class AsyncSharedOrderServer(SharedOrderServer, AsyncOrderServer):
+    loop = None
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        await super().serve()
+
+    def on_events(self, events):
+        # The log is followed on its own thread; writers belong to the loop
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(SharedOrderServer.on_events, self, events)
+
+def run_worker(args, index):
+    server_class = AsyncSharedOrderServer if args.mode == "asyncio" else SharedOrderServer
+    order_server = server_class(args.host, args.port, queue_path=args.queue_db, fsync=args.fsync,
+                                max_queue=args.max_queue)
+    if args.metrics_port:
+        serve_metrics(order_server.metrics, args.metrics_port + index)
+    if args.capture:
+        root, extension = os.path.splitext(args.capture)
+        order_server.capture = TrafficCapture(f"{root}-{index}{extension}", "order")
     order_server.run()
+
+def run_workers(args):
+    workers = args.workers or os.cpu_count() or 1
+    # Create the shared queue once up front, taking over any pending orders
+    # from a previous single-process journal
+    orders = SqliteOrderQueue(args.queue_db, fsync=args.fsync)
+    imported = orders.import_journal(args.journal)
+    if imported:
+        print(f"Imported {imported} pending orders from {args.journal} into {args.queue_db}")
+    reconcile(orders, args.orders_db)
+    orders.close()
+    processes = [multiprocessing.Process(target=run_worker, args=(args, index), daemon=True) for index in range(workers)]
+    for process in processes:
+        process.start()
+    # Exiting normally on SIGTERM lets multiprocessing stop the workers too
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    for process in processes:
+        process.join()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Canteen order server")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8888)
+    parser.add_argument("--mode", choices=["threaded", "asyncio"], default="threaded",
+                        help="threaded: one thread per terminal; asyncio: single event loop")
+    parser.add_argument("--journal", default="orders.journal",
+                        help="append-only journal the pending queue is recovered from")
+    parser.add_argument("--fsync", action="store_true",
+                        help="fsync the journal after every change (survives power loss)")
+    parser.add_argument("--metrics-port", type=int,
+                        help="serve Prometheus metrics on this local port (the STATS command works regardless); "
+                             "worker i uses port + i")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="worker processes sharing the port and a SQLite order queue (0: one per CPU)")
+    parser.add_argument("--queue-db", default="orders.db",
+                        help="shared order queue used when running more than one worker")
+    parser.add_argument("--orders-db", default="canteen.db",
+                        help="on startup, drop recovered orders this database shows as completed ('' to skip)")
+    parser.add_argument("--max-queue", type=int, default=1024,
+                        help="threaded mode: order events buffered per subscriber before it is disconnected")
+    parser.add_argument("--scheduler", action="store_true",
+                        help="plan the kitchen: batch identical items, cook short work first and quote a ready "
+                             "time with every new order (single worker only)")
+    parser.add_argument("--stations", type=int, default=2,
+                        help="with --scheduler: how many batches the kitchen can cook at once")
+    parser.add_argument("--menu-db", default="canteen.db",
+                        help="with --scheduler: database holding each product's prep time and batch size")
+    parser.add_argument("--capture", metavar="PATH",
+                        help="append every command and its reply to this JSONL file for replay.py "
+                             "(e.g. traffic.jsonl; worker i writes traffic-i.jsonl)")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.scheduler and args.workers != 1:
+        # Each worker would plan the kitchen on its own
+        raise SystemExit("--scheduler needs a single worker")
+    if args.stations < 1:
+        raise SystemExit("--stations must be at least 1")
+    if args.workers != 1:
+        run_workers(args)
+    else:
+        kitchen = None
+        if args.scheduler:
+            kitchen = Kitchen(load_prep_times(args.menu_db), args.stations, menu_path=args.menu_db)
+        server_class = AsyncOrderServer if args.mode == "asyncio" else OrderServer
+        order_server = server_class(args.host, args.port, journal_path=args.journal, fsync=args.fsync, kitchen=kitchen,
+                                    max_queue=args.max_queue, orders_db=args.orders_db)
+        if args.metrics_port:
+            serve_metrics(order_server.metrics, args.metrics_port)
+        if args.capture:
+            order_server.capture = TrafficCapture(args.capture, "order")
+        order_server.run()
@@ -0,0 +1,167 @@
+import json
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+from stock import OutOfStock, begin_immediate, open_database, reserve_stock
+
+# Group-commit writer for orders. Submissions from any number of terminals
+# or threads are queued and written by one thread on one long-lived WAL
+# connection: up to batch_size orders, or whatever arrived within
+# max_latency of the first one, share a single transaction and fsync.
+class OrderWriter:
+    def __init__(self, path='canteen.db', batch_size=64, max_latency=0.005):
+        self.path = path
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.submissions = queue.Queue()
+        self.batches = 0
+        self.orders_written = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, lines, allow_partial=True, key=None, customer=None):
+        # lines: list of (product_id, product_name, price, quantity). The
+        # returned Future resolves to (order, short): order is a dict with
+        # the order id, total and items (None if nothing was in stock) and
+        # short the names of lines that ran out. With an idempotency key the
+        # outcome is stored in the same transaction as the order, and a
+        # later submission with the same key gets that outcome back (the
+        # order marked "replayed") instead of placing another order.
+        # customer is recorded as the order's owner for the chat server.
+        future = Future()
+        self.submissions.put((list(lines), allow_partial, key, customer, future))
+        return future
+
+    def replay(self, outcome):
+        # (result, error) for a submission whose key was already used
+        if "shortages" in outcome:
+            return None, OutOfStock([tuple(shortage) for shortage in outcome["shortages"]])
+        order = outcome["order"]
+        return (dict(order, replayed=True) if order else None, outcome["short"]), None
+
+    def close(self):
+        self.submissions.put(None)
+        self.thread.join()
+
+    def run(self):
+        conn = open_database(self.path)
+        conn.execute('PRAGMA journal_mode=WAL')
+        while True:
+            item = self.submissions.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.max_latency
+            stop = False
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self.submissions.get(timeout=remaining) if remaining > 0 else self.submissions.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self.write_batch(conn, batch)
+            if stop:
+                break
+        conn.close()
+
+    def write_batch(self, conn, batch):
+        results = []
+        try:
+            begin_immediate(conn)
+            # Ids are assigned here rather than by SQLite so each batch is two
+            # executemany calls; we hold the write lock, so nobody else can
+            # take them in the meantime.
+            next_id = conn.execute('''
+                SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'orders'), 0),
+                           COALESCE((SELECT MAX(id) FROM orders), 0)) + 1
+            ''').fetchone()[0]
+            headers = []
+            items = []
+            requests = []
+            customers = []
+            outcomes = {}  # key -> outcome, for keys used earlier in this batch
+            for lines, allow_partial, key, customer, future in batch:
+                if key is not None:
+                    outcome = outcomes.get(key)
+                    if outcome is None:
+                        row = conn.execute('SELECT response FROM order_requests WHERE key = ?', (key,)).fetchone()
+                        outcome = json.loads(row[0]) if row else None
+                    if outcome is not None:
+                        results.append((future,) + self.replay(outcome))
+                        continue
+                # A savepoint per order so one rejected cart does not undo
+                # the stock reserved for the rest of the batch
+                conn.execute('SAVEPOINT submission')
+                try:
+                    filled = reserve_stock(conn, [(product_id, quantity) for product_id, _, _, quantity in lines], allow_partial)
+                except OutOfStock as e:
+                    conn.execute('ROLLBACK TO submission')
+                    conn.execute('RELEASE submission')
+                    results.append((future, None, e))
+                    if key is not None:
+                        outcomes[key] = {"shortages": e.shortages}
+                        requests.append((key, json.dumps(outcomes[key])))
+                    continue
+                conn.execute('RELEASE submission')
+                order_items = []
+                short = []
+                for (product_id, product, price, quantity), got in zip(lines, filled):
+                    if got < quantity:
+                        short.append(product)
+                    if got:
+                        order_items.append((next_id, product_id, product, got, price, price * got))
+                if not order_items:
+                    results.append((future, (None, short), None))
+                    if key is not None:
+                        outcomes[key] = {"order": None, "short": short}
+                        requests.append((key, json.dumps(outcomes[key])))
+                    continue
+                total_price = sum(item[5] for item in order_items)
+                headers.append((next_id, "Pending", total_price))
+                items += order_items
+                if customer is not None:
+                    customers.append((next_id, customer))
+                order = {"order_id": next_id, "total_price": total_price,
+                         "items": [{"product_name": item[2], "quantity": item[3], "total_price": item[5]}
+                                   for item in order_items]}
+                results.append((future, (order, short), None))
+                if key is not None:
+                    outcomes[key] = {"order": order, "short": short}
+                    requests.append((key, json.dumps(outcomes[key])))
+                next_id += 1
+            conn.executemany('INSERT INTO orders (id, status, total_price) VALUES (?, ?, ?)', headers)
+            conn.executemany('''
+                INSERT INTO order_items (order_id, product_id, product_name, quantity, unit_price, total_price)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', items)
+            conn.executemany('INSERT INTO order_customers (order_id, customer) VALUES (?, ?)', customers)
+            conn.executemany('INSERT INTO order_requests (key, response) VALUES (?, ?)', requests)
+            conn.execute('COMMIT')
+        except Exception as e:
+            # Any failure fails the whole batch; the writer thread carries on
+            # and nobody is left waiting on a Future that never resolves
+            if not isinstance(e, sqlite3.Error):
+                print(f"Could not write {len(batch)} orders: {e!r}")
+            try:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+            except sqlite3.Error:
+                pass
+            for lines, allow_partial, key, customer, future in batch:
+                future.set_exception(e)
+            return
+        self.batches += 1
+        self.orders_written += len(headers)
+        # Acknowledge only after the commit is durable
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
@@ -1,125 +1,135 @@
+import time
+
+# Measured from here so the startup figure covers importing tkinter and the
+# local modules below, not just building the window
+STARTED = time.perf_counter()
+
 import tkinter as tk
-from tkinter import messagebox, scrolledtext
+from tkinter import messagebox, ttk
 import sqlite3
-import socket
+import json
+import queue
 import threading
 
-# Database Initialization
-def initialize_database():
-    conn = sqlite3.connect('canteen.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS products (
-            id INTEGER PRIMARY KEY,
-            name TEXT,
-            category TEXT,
-            price REAL,
-            image TEXT,
-            stock INTEGER
-        )
-    ''')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS orders (
-            id INTEGER PRIMARY KEY,
-            product_name TEXT,
-            quantity INTEGER,
-            total_price REAL,
-            status TEXT
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-# Populate Database
-def populate_database():
-    conn = sqlite3.connect('canteen.db')
-    cursor = conn.cursor()
-    
-    # Check if products table is empty before populating
-    cursor.execute('SELECT COUNT(*) FROM products')
-    count = cursor.fetchone()[0]
-    if count == 0:
-        products = [
-            ("Samosa", "Snacks", 10, "images/samosa.jpg", 10),
-            ("Sandwich", "Snacks", 30, "images/sandwich.jpg", 10),
-            ("Burger", "Snacks", 50, "images/burger.jpg", 10),
-            ("Tea", "Beverages", 10, "images/tea.jpg", 10),
-            ("Coffee", "Beverages", 20, "images/coffee.jpg", 10),
-            ("Juice", "Beverages", 15, "images/juice.jpg", 10),
-            ("Lays", "Chips & Chocolates", 20, "images/lays.jpg", 10),
-            ("Dairy Milk", "Chips & Chocolates", 30, "images/dairymilk.jpg", 10),
-            ("KitKat", "Chips & Chocolates", 25, "images/kitkat.png", 10)
-        ]
-        
-        cursor.executemany('INSERT INTO products (name, category, price, image, stock) VALUES (?, ?, ?, ?, ?)', products)
-        conn.commit()
-
-    conn.close()
-
-# Chat Client
-class ChatClient(tk.Frame):
-    def __init__(self, master, host="localhost", port=9999):
-        super().__init__(master)
-        self.master = master
-        self.host = host
-        self.port = port
-        self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.create_widgets()
-        self.connect_to_server()
-
-    def create_widgets(self):
-        self.chat_display = scrolledtext.ScrolledText(self, state='disabled', width=50, height=15)
-        self.chat_display.pack(pady=10)
-        self.chat_display.tag_config('received', foreground='blue')
-        self.chat_display.tag_config('sent', foreground='green')
-        self.message_entry = tk.Entry(self, width=50)
-        self.message_entry.pack(pady=10)
-        self.send_button = tk.Button(self, text="Send", command=self.send_message)
-        self.send_button.pack(pady=10)
-
-    def connect_to_server(self):
-        try:
-            self.client_socket.connect((self.host, self.port))
-            self.receive_thread = threading.Thread(target=self.receive_messages)
-            self.receive_thread.start()
-        except Exception as e:
-            messagebox.showerror("Connection Error", str(e))
-
-    def receive_messages(self):
-        while True:
-            try:
-                message = self.client_socket.recv(1024).decode()
-                if message:
-                    self.chat_display.config(state='normal')
-                    self.chat_display.insert(tk.END, message + "\n", 'received')
-                    self.chat_display.config(state='disabled')
-                    self.chat_display.yview(tk.END)
-            except:
-                break
+from bill_writer import BillWriter
+from canteen_service import CanteenService
+from chat_client import ChatClient
+from framing import ReconnectingClient
+from schema import archive_completed_orders, initialize_database, prune_order_requests
 
-    def send_message(self):
-        message = self.message_entry.get()
-        if message:
-            self.client_socket.send(f"Owner: {message}".encode())
-            self.chat_display.config(state='normal')
-            self.chat_display.insert(tk.END, f"Me: {message}\n", 'sent')
-            self.chat_display.config(state='disabled')
-            self.chat_display.yview(tk.END)
-            self.message_entry.delete(0, tk.END)
+ARCHIVE_INTERVAL_MS = 30 * 60 * 1000
+DASHBOARD_REFRESH_MS = 5000
 
 # Order Management Client
 class OrderClient:
+    # Connects in the background and reconnects on its own; requests raise
+    # ConnectionError while the order server is unreachable
     def __init__(self, host="localhost", port=8888):
-        self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.client_socket.connect((host, port))
+        self.connection = ReconnectingClient(host, port)
+
+    def request(self, command):
+        return self.connection.request(command)
 
     def send_order(self):
-        self.client_socket.send("NEW_ORDER".encode())
-        return self.client_socket.recv(1024).decode()
+        return self.request("NEW_ORDER")
 
-    def complete_order(self):
-        self.client_socket.send("COMPLETE_ORDER".encode())
-        return self.client_socket.recv(1024).decode()
+    def complete_order(self, order_number=None):
+        if order_number is None:
+            return self.request("COMPLETE_ORDER")
+        return self.request(f"COMPLETE_ORDER {order_number}")
+
+    def lookup(self, order_ids, batch_size=500):
+        # Order server numbers of pending orders by database order id
+        numbers = {}
+        for start in range(0, len(order_ids), batch_size):
+            reply = self.request("LOOKUP " + " ".join(map(str, order_ids[start:start + batch_size])))
+            if not reply.startswith("LOOKUP "):
+                raise ValueError(reply)
+            numbers.update({int(order_id): number for order_id, number in json.loads(reply[len("LOOKUP "):]).items()})
+        return numbers
+
+    def complete_orders(self, order_numbers, batch_size=500):
+        # One BATCH frame and round trip per batch_size orders
+        replies = []
+        for start in range(0, len(order_numbers), batch_size):
+            batch = order_numbers[start:start + batch_size]
+            replies += self.connection.request_batch([f"COMPLETE_ORDER {number}" for number in batch])
+        return replies
+
+# Live Order Feed
+class OrderFeed:
+    # Dedicated SUBSCRIBE connection. Events are read on a background thread
+    # and handed to the Tk thread through a queue. Every (re)connect queues
+    # a RESYNC first, since completions may have been missed while down.
+    def __init__(self, host="localhost", port=8888):
+        self.events = queue.Queue()
+        self.connection = ReconnectingClient(host, port, greeting=lambda: ["SUBSCRIBE"],
+                                             on_line=self.receive_event, on_status=self.connection_status)
+
+    def connection_status(self, connected):
+        if connected:
+            self.events.put(("RESYNC", None, {}))
+
+    def receive_event(self, line):
+        event, _, rest = line.partition(" ")
+        if event not in ("ORDER_CREATED", "ORDER_COMPLETED"):
+            return
+        order_number, _, details = rest.partition(" ")
+        try:
+            details = json.loads(details)
+        except ValueError:
+            return
+        if isinstance(details, dict) and order_number.isdigit():
+            self.events.put((event, int(order_number), details))
+
+# Sales Dashboard
+class SalesDashboard(tk.Toplevel):
+    # Reads only the analytics rollups, so a refresh costs the same on day
+    # one as after a million orders
+    def __init__(self, master, service):
+        super().__init__(master)
+        self.title("Sales Dashboard")
+        self.geometry("700x600")
+        self.service = service
+        self.summary = tk.Label(self, font=("Arial", 12), justify=tk.LEFT)
+        self.summary.pack(anchor=tk.W, padx=10, pady=10)
+        self.tables = {}
+        for key, title, columns in (("hours", "Today by hour", ("Hour", "Orders", "Revenue")),
+                                    ("days", "Last 14 days", ("Day", "Orders", "Revenue")),
+                                    ("top_products", "Top products", ("Product", "Category", "Units", "Revenue")),
+                                    ("categories", "Categories", ("Category", "Units", "Revenue"))):
+            tk.Label(self, text=title, font=("Arial", 12, "bold")).pack(anchor=tk.W, padx=10)
+            table = ttk.Treeview(self, columns=columns, show="headings", height=5)
+            for column in columns:
+                table.heading(column, text=column)
+                table.column(column, width=120)
+            table.pack(fill=tk.X, padx=10, pady=(0, 10))
+            self.tables[key] = table
+        self.bind("<Destroy>", self.on_destroy)
+        self.refresh()
+
+    def on_destroy(self, event):
+        if event.widget is self:
+            self.after_cancel(self.refresh_job)
+
+    def refresh(self):
+        try:
+            report = self.service.sales_dashboard()
+        except sqlite3.Error as e:
+            self.summary.config(text=f"Could not read sales figures: {e}")
+        else:
+            today = report["today"]
+            lines = [f"Today: {today['orders']} orders, ₹{today['revenue']:.2f}, average ticket ₹{today['average_ticket']:.2f}",
+                     f"All time: {report['orders']} orders ({report['completed']} completed), {report['units']} items, "
+                     f"₹{report['revenue']:.2f}, average ticket ₹{report['average_ticket']:.2f}"]
+            if report["needs_backfill"]:
+                lines.append("Orders from before the upgrade are not counted yet; run analytics.py to include them.")
+            self.summary.config(text="\n".join(lines))
+            for key, table in self.tables.items():
+                table.delete(*table.get_children())
+                for row in report[key]:
+                    table.insert("", tk.END, values=[f"₹{value:.2f}" if isinstance(value, float) else value for value in row])
+        self.refresh_job = self.after(DASHBOARD_REFRESH_MS, self.refresh)
 
 # Main Application for Owner
 class OwnerApp(tk.Tk):
@@ -127,10 +137,22 @@ class OwnerApp(tk.Tk):
         super().__init__()
         self.title("Canteen Owner Management App")
         self.geometry("800x600")
-        self.conn = sqlite3.connect('canteen.db')
+        self.service = CanteenService(pool_size=2)
+        self.bill_writer = BillWriter()
         self.order_client = OrderClient()  # Initialize the order client
+        self.order_feed = OrderFeed()  # Subscribes before each full scan so no event is missed
+        self.order_numbers = {}  # order id -> order server number
         self.chat_client = None
+        self.dashboard = None
         self.create_widgets()
+        self.after(ARCHIVE_INTERVAL_MS, self.archive_orders)
+        self.bind("<Map>", self.report_first_frame)
+
+    def report_first_frame(self, event):
+        if event.widget is self:
+            self.unbind("<Map>")
+            # Idle callbacks run once the mapped window has been drawn
+            self.after_idle(lambda: print(f"Time to first frame: {(time.perf_counter() - STARTED) * 1000:.0f} ms"))
 
     def create_widgets(self):
         self.order_frame = tk.Frame(self)
@@ -144,46 +166,155 @@ class OwnerApp(tk.Tk):
 
     def create_order_section(self):
         tk.Label(self.order_frame, text="Orders", font=("Arial", 16)).pack(pady=10)
-        self.order_listbox = tk.Listbox(self.order_frame)
+        # Rows are keyed by order id so feed events insert and remove in O(1).
+        # Shift/Ctrl-click selects several orders to complete at once.
+        self.order_listbox = ttk.Treeview(self.order_frame, show="tree", selectmode="extended")
         self.order_listbox.pack(fill=tk.BOTH, expand=True, pady=5)
         self.refresh_orders_button = tk.Button(self.order_frame, text="Refresh Orders", command=self.refresh_orders)
         self.refresh_orders_button.pack(pady=5)
-        self.complete_order_button = tk.Button(self.order_frame, text="Complete Order", command=self.complete_order)
+        self.complete_order_button = tk.Button(self.order_frame, text="Complete Selected", command=self.complete_order)
         self.complete_order_button.pack(pady=5)
-        self.refresh_orders()
+        tk.Button(self.order_frame, text="Sales Dashboard", command=self.open_dashboard).pack(pady=5)
+        # The first scan runs once the window is up; the feed asks for
+        # another whenever it (re)connects
+        self.after_idle(self.refresh_orders)
+        self.poll_order_events()
+
+    def insert_order_row(self, order_id, summary, total_price):
+        if not self.order_listbox.exists(order_id):
+            order_text = f"Order ID: {order_id} - {summary} - ₹{total_price}"
+            self.order_listbox.insert("", tk.END, iid=order_id, text=order_text)
+
+    def remove_order_row(self, order_id):
+        if self.order_listbox.exists(order_id):
+            self.order_listbox.delete(order_id)
+        self.order_numbers.pop(order_id, None)
+
+    def remove_order_rows(self, order_ids):
+        present = [order_id for order_id in order_ids if self.order_listbox.exists(order_id)]
+        if present:
+            self.order_listbox.delete(*present)
+        for order_id in order_ids:
+            self.order_numbers.pop(order_id, None)
 
     def refresh_orders(self):
-        self.order_listbox.delete(0, tk.END)
-        cursor = self.conn.cursor()
-        cursor.execute('SELECT id, product_name, quantity, total_price FROM orders WHERE status = "Pending"')
-        orders = cursor.fetchall()
-        for order in orders:
-            order_text = f"Order ID: {order[0]} - {order[1]} x{order[2]} - ₹{order[3]}"
-            self.order_listbox.insert(tk.END, order_text)
+        # Full resync from the database; the live feed keeps it current after this
+        self.order_listbox.delete(*self.order_listbox.get_children())
+        for order in self.service.pending_orders():
+            self.insert_order_row(*order)
+        # Orders that came from the database rather than the feed still need
+        # their order server number so completing them reaches the server
+        unknown = [int(iid) for iid in self.order_listbox.get_children() if int(iid) not in self.order_numbers]
+        if unknown:
+            threading.Thread(target=self.lookup_numbers, args=(unknown,), daemon=True).start()
+
+    def lookup_numbers(self, order_ids):
+        try:
+            numbers = self.order_client.lookup(order_ids)
+        except (OSError, ValueError) as e:
+            print(f"Could not look up order numbers: {e}")
+            return
+        self.order_feed.events.put(("NUMBERS", None, numbers))
+
+    def poll_order_events(self):
+        while True:
+            try:
+                event, order_number, details = self.order_feed.events.get_nowait()
+            except queue.Empty:
+                break
+            if event == "RESYNC":
+                self.refresh_orders()
+                continue
+            if event == "NUMBERS":
+                for order_id, order_number in details.items():
+                    if self.order_listbox.exists(order_id):
+                        self.order_numbers.setdefault(order_id, order_number)
+                continue
+            order_id = details.get("order_id")
+            if order_id is None:
+                continue
+            if event == "ORDER_CREATED":
+                self.order_numbers[order_id] = order_number
+                summary = ", ".join(f"{item['product_name']} x{item['quantity']}" for item in details.get("items", []))
+                self.insert_order_row(order_id, summary, details.get("total_price"))
+            else:
+                self.remove_order_row(order_id)
+        self.after(100, self.poll_order_events)
 
     def complete_order(self):
-        selected_order = self.order_listbox.get(tk.ACTIVE)
-        if selected_order:
-            order_id = int(selected_order.split()[2])
-            cursor = self.conn.cursor()
-            cursor.execute('UPDATE orders SET status = "Completed" WHERE id = ?', (order_id,))
-            self.conn.commit()
+        # Completes every selected order in one transaction; bills are
+        # rendered in the same pass and archived by the bill writer thread
+        selected = self.order_listbox.selection()
+        if not selected:
+            return
+        order_ids = [int(iid) for iid in selected]
+        try:
+            bills = self.service.complete_orders(order_ids)
+        except sqlite3.Error as e:
+            messagebox.showerror("Order Status", f"Could not complete the orders: {e}")
+            return
+        self.bill_writer.submit(bills)
+
+        # Tell the order server so every other owner screen drops them too,
+        # off the Tk thread
+        order_numbers = [self.order_numbers[order_id] for order_id in order_ids if order_id in self.order_numbers]
+        unknown = [order_id for order_id in order_ids if order_id not in self.order_numbers]
+        self.remove_order_rows(order_ids)
+        threading.Thread(target=self.notify_completed, args=(order_numbers, unknown), daemon=True).start()
 
-            # Save the bill as a text file with UTF-8 encoding
-            with open(f"bill_{order_id}.txt", "w", encoding="utf-8") as bill_file:
-                bill_file.write(f"Order ID: {order_id}\n")
-                bill_file.write(selected_order)
+        skipped = len(order_ids) - len(bills)
+        if len(order_ids) == 1 and skipped:
+            messagebox.showinfo("Order Status", "This order was already completed")
+        elif len(order_ids) == 1:
+            messagebox.showinfo("Order Status", f"Order completed successfully and bill saved to {self.bill_writer.path}")
+        else:
+            message = f"Completed {len(bills)} orders; bills saved to {self.bill_writer.path}"
+            if skipped:
+                message += f" ({skipped} were already completed)"
+            messagebox.showinfo("Order Status", message)
+
+    def notify_completed(self, order_numbers, unknown_ids=()):
+        try:
+            if unknown_ids:
+                # Not matched yet, e.g. completed before the lookup answered
+                order_numbers = order_numbers + list(self.order_client.lookup(list(unknown_ids)).values())
+            if order_numbers:
+                self.order_client.complete_orders(order_numbers)
+        except (OSError, ValueError) as e:
+            print(f"Could not notify order server: {e}")
+
+    def open_dashboard(self):
+        if self.dashboard is not None and self.dashboard.winfo_exists():
+            self.dashboard.lift()
+            return
+        self.dashboard = SalesDashboard(self, self.service)
+
+    def archive_orders(self):
+        # Keeps the hot orders table small by moving old completed orders to
+        # the archive database, off the Tk thread
+        def run():
+            conn = sqlite3.connect('canteen.db', timeout=5, isolation_level=None)
+            try:
+                moved = archive_completed_orders(conn)
+                if moved:
+                    print(f"Archived {moved} completed orders")
+                prune_order_requests(conn)
+            except sqlite3.Error as e:
+                print(f"Could not archive orders: {e}")
+            finally:
+                conn.close()
 
-            messagebox.showinfo("Order Status", "Order completed successfully and bill saved")
-            self.refresh_orders()
+        threading.Thread(target=run, daemon=True).start()
+        self.after(ARCHIVE_INTERVAL_MS, self.archive_orders)
 
     def create_chat_section(self):
         tk.Label(self.chat_frame, text="Chat", font=("Arial", 16)).pack(pady=10)
-        self.chat_client = ChatClient(self.chat_frame)
+        self.chat_client = ChatClient(self.chat_frame, "Owner", hello="/hello owner", reply_to_last=True)
         self.chat_client.pack()
 
 if __name__ == "__main__":
     initialize_database()
-    populate_database()
     owner_app = OwnerApp()
     owner_app.mainloop()
+    # Bills still queued are written before exit
+    owner_app.bill_writer.close()
@@ -0,0 +1,97 @@
+import tkinter as tk
+from tkinter import ttk
+
+TILE_WIDTH = 176
+TILE_HEIGHT = 236
+
+class ProductTile:
+    def __init__(self, canvas):
+        self.frame = tk.Frame(canvas, bg="#ffffff", bd=1, relief="solid")
+        self.button = tk.Button(self.frame, compound=tk.TOP, width=150, height=200)
+        self.button.pack()
+        self.window = canvas.create_window(0, 0, window=self.frame, anchor="nw", state="hidden")
+        self.product = None
+        self.image = None  # keeps the PhotoImage alive while it is shown
+
+# Virtualized product grid: only the rows in the viewport (plus a small
+# margin) have widgets, and those tiles are recycled on scroll and on every
+# set_products call, so a redraw costs the same for 9 products or 50k.
+class ProductGrid(tk.Frame):
+    def __init__(self, master, thumbnails, on_select, columns=3, margin_rows=1):
+        super().__init__(master, bg="#ffffff")
+        self.thumbnails = thumbnails
+        self.on_select = on_select
+        self.columns = columns
+        self.margin_rows = margin_rows
+        self.products = []
+        self.visible = {}  # product index -> tile
+        self.free_tiles = []
+
+        self.canvas = tk.Canvas(self, bg="#ffffff", highlightthickness=0)
+        self.scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self.on_scroll)
+        self.canvas.configure(yscrollcommand=self.scrollbar.set)
+        self.canvas.bind("<Configure>", lambda e: self.redraw())
+        self.canvas.pack(side="left", fill="both", expand=True)
+        self.scrollbar.pack(side="right", fill="y")
+
+    def on_scroll(self, *args):
+        self.canvas.yview(*args)
+        self.redraw()
+
+    def set_products(self, products):
+        # products: list of (product_id, name, price, image_path) tuples
+        self.products = products
+        for tile in self.visible.values():
+            self.release(tile)
+        self.visible.clear()
+        rows = -(-len(products) // self.columns)
+        self.canvas.configure(scrollregion=(0, 0, self.columns * TILE_WIDTH, rows * TILE_HEIGHT))
+        self.canvas.yview_moveto(0)
+        self.redraw()
+
+    def update_products(self, products):
+        # Like set_products, but keeps the scroll position and only refills
+        # the tiles whose product changed
+        self.products = products
+        for index in [i for i, tile in self.visible.items() if i >= len(products) or tile.product != products[i]]:
+            self.release(self.visible.pop(index))
+        rows = -(-len(products) // self.columns)
+        self.canvas.configure(scrollregion=(0, 0, self.columns * TILE_WIDTH, rows * TILE_HEIGHT))
+        self.redraw()
+
+    def release(self, tile):
+        self.canvas.itemconfigure(tile.window, state="hidden")
+        tile.product = None
+        tile.image = None
+        self.free_tiles.append(tile)
+
+    def acquire(self):
+        if self.free_tiles:
+            return self.free_tiles.pop()
+        tile = ProductTile(self.canvas)
+        tile.button.configure(command=lambda t=tile: self.on_select(*t.product[:3]))
+        return tile
+
+    def redraw(self):
+        top = self.canvas.canvasy(0)
+        height = max(self.canvas.winfo_height(), TILE_HEIGHT)
+        first_row = max(0, int(top // TILE_HEIGHT) - self.margin_rows)
+        last_row = int((top + height) // TILE_HEIGHT) + self.margin_rows
+        first = first_row * self.columns
+        last = min(len(self.products), (last_row + 1) * self.columns)
+
+        for index in [i for i in self.visible if i < first or i >= last]:
+            self.release(self.visible.pop(index))
+
+        for index in range(first, last):
+            if index in self.visible:
+                continue
+            tile = self.acquire()
+            product_id, name, price, image_path = self.products[index][:4]
+            tile.product = self.products[index]
+            tile.image = self.thumbnails.get(image_path)
+            tile.button.configure(text=f"{name}\n(₹{price})", image=tile.image)
+            row, column = divmod(index, self.columns)
+            self.canvas.coords(tile.window, column * TILE_WIDTH + 10, row * TILE_HEIGHT + 10)
+            self.canvas.itemconfigure(tile.window, state="normal")
+            self.visible[index] = tile
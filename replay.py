@@ -0,0 +1,305 @@
+import argparse
+import asyncio
+import json
+import re
+import sys
+import time
+
+from framing import MAX_LINE, encode_line
+
+# Feeds traffic recorded with --capture back into an order or chat server
+# and compares what it answers with what was captured. Each captured
+# connection gets its own connection, opened and fed on the captured
+# schedule scaled by --speed, or as fast as the server answers with
+# --speed max. Start the server fresh (e.g. order_server.py --journal "")
+# so order numbers line up with the capture.
+#
+# Replies are compared per command: "same", "renumbered" (equal once the
+# numbers are masked, as happens when concurrent connections interleave
+# differently than at capture time), "different" or "missing". --ordered
+# sends every command in its captured global order and waits for each
+# reply, so a fresh server should reproduce the capture; only commands
+# that reached the server within microseconds of each other on different
+# connections may swap, which shows up as renumbered.
+
+DEFAULT_PORTS = {"order": 8888, "chat": 9999}
+NUMBER = re.compile(r"\d+(\.\d+)?")
+
+class Connection:
+    def __init__(self, key):
+        self.key = key
+        self.opened_at = None
+        self.closed_at = None
+        self.commands = []  # (t, line, captured reply or None, global index)
+        self.captured_received = None
+        self.received = 0
+        self.results = []  # (line, captured reply, replayed reply, latency)
+        self.turns_done = 0  # with --ordered, commands sent and through their turn
+
+def load_captures(paths):
+    kind = None
+    connections = {}
+    commands = 0
+    dropped = 0
+    for file_index, path in enumerate(paths):
+        session = 0
+        with open(path, encoding="utf-8") as capture:
+            for line in capture:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A torn last line from a server that was killed
+                    continue
+                if "capture" in record:
+                    if kind not in (None, record["capture"]):
+                        raise SystemExit(f"{path} is a {record['capture']} capture; cannot mix it with {kind}")
+                    kind = record["capture"]
+                    # Connection ids restart with every server run
+                    session += 1
+                    continue
+                if "dropped" in record:
+                    dropped += record["dropped"]
+                    continue
+                key = (file_index, session, record["c"])
+                connection = connections.get(key)
+                if connection is None:
+                    connection = connections[key] = Connection(key)
+                if "open" in record:
+                    connection.opened_at = record["t"]
+                elif "close" in record:
+                    connection.closed_at = record["t"]
+                    connection.captured_received = record.get("received")
+                else:
+                    connection.commands.append((record["t"], record["in"], record.get("out")))
+                    commands += 1
+    if kind is None:
+        raise SystemExit("No capture header found")
+    if dropped:
+        print(f"Warning: the capture dropped {dropped} records; replies may not match")
+    # Give every command its place in the captured global order
+    ordered = sorted((t, connection.key, position) for connection in connections.values()
+                     for position, (t, line, reply) in enumerate(connection.commands))
+    for index, (t, key, position) in enumerate(ordered):
+        t, line, reply = connections[key].commands[position]
+        connections[key].commands[position] = (t, line, reply, index)
+    for connection in connections.values():
+        if connection.opened_at is None:
+            connection.opened_at = connection.commands[0][0] if connection.commands else 0
+    start = min((connection.opened_at for connection in connections.values()), default=0)
+    return kind, start, list(connections.values()), commands
+
+def strip_id(reply):
+    if reply is not None and reply.startswith("#"):
+        return reply.partition(" ")[2]
+    return reply
+
+def compare(captured, replayed):
+    captured, replayed = strip_id(captured), strip_id(replayed)
+    if replayed is None:
+        return "missing"
+    if captured == replayed:
+        return "same"
+    if NUMBER.sub("#", captured) == NUMBER.sub("#", replayed):
+        return "renumbered"
+    return "different"
+
+class Replay:
+    def __init__(self, kind, start, connections, host, port, speed, ordered, timeout):
+        self.kind = kind
+        self.start = start
+        self.connections = connections
+        self.host = host
+        self.port = port
+        self.speed = speed  # None: as fast as possible
+        self.ordered = ordered
+        self.timeout = timeout
+        self.turn = 0
+        self.turn_changed = None
+        self.skipped = set()  # global indices of commands a failed connection will never send
+        # Captured time of every command by global index, for --ordered
+        self.times = {index: t for connection in connections for t, line, reply, index in connection.commands}
+        self.began = None
+
+    async def wait_until(self, t):
+        if self.speed is None:
+            return
+        delay = self.began + (t - self.start) / self.speed - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def take_turn(self, index):
+        # Fails if the turn stops moving for longer than its command can
+        # take (its scheduled time plus two reply timeouts), so a replay
+        # against a server that stopped answering ends instead of hanging
+        async with self.turn_changed:
+            while self.turn < index:
+                turn = self.turn
+                delay = 2 * self.timeout
+                if self.speed is not None:
+                    delay += max(0.0, self.began + (self.times[turn] - self.start) / self.speed - time.perf_counter())
+                try:
+                    await asyncio.wait_for(self.turn_changed.wait(), delay)
+                except asyncio.TimeoutError:
+                    if self.turn == turn:
+                        raise TimeoutError(f"Replay stalled waiting for command {turn}")
+
+    async def next_turn(self):
+        async with self.turn_changed:
+            self.turn += 1
+            self.advance_past_skipped()
+
+    async def skip(self, indices):
+        # A connection that failed gives up the turns it has not taken, so
+        # the others carry on without it
+        async with self.turn_changed:
+            self.skipped.update(indices)
+            self.advance_past_skipped()
+
+    def advance_past_skipped(self):
+        # Called with turn_changed held
+        while self.turn in self.skipped:
+            self.turn += 1
+        self.turn_changed.notify_all()
+
+    async def run_connection(self, connection):
+        try:
+            await self.play_connection(connection)
+        finally:
+            if self.ordered and connection.turns_done < len(connection.commands):
+                await self.skip([index for t, line, reply, index in connection.commands[connection.turns_done:]])
+
+    async def play_connection(self, connection):
+        await self.wait_until(connection.opened_at)
+        if self.ordered and connection.commands:
+            # Connect just before the first command's turn so accept order
+            # follows the capture too
+            await self.take_turn(connection.commands[0][3])
+        reader, writer = await asyncio.open_connection(self.host, self.port, limit=MAX_LINE)
+        waiting = {}  # request id -> (future, sent_at)
+        receiver = asyncio.create_task(self.receive(connection, reader, waiting))
+        pending = []
+        try:
+            for sequence, (t, line, captured, index) in enumerate(connection.commands):
+                await self.wait_until(t)
+                if self.ordered:
+                    await self.take_turn(index)
+                if self.kind == "order":
+                    # Tag untagged commands so replies and pushes never mix
+                    request_id = line.partition(" ")[0] if line.startswith("#") else f"#r{sequence}"
+                    sent = line if line.startswith("#") else f"{request_id} {line}"
+                    future = asyncio.get_running_loop().create_future()
+                    waiting[request_id] = (future, time.perf_counter())
+                    writer.write(encode_line(sent))
+                    await writer.drain()
+                    if self.ordered or self.speed is None:
+                        # Closed loop: the next command waits for this reply
+                        await self.collect(connection, line, captured, future)
+                    else:
+                        pending.append((line, captured, future))
+                else:
+                    writer.write(encode_line(line))
+                    await writer.drain()
+                if self.ordered:
+                    await self.next_turn()
+                    connection.turns_done += 1
+            for line, captured, future in pending:
+                await self.collect(connection, line, captured, future)
+            if self.kind == "chat":
+                await self.linger(connection)
+        finally:
+            receiver.cancel()
+            writer.close()
+
+    async def collect(self, connection, line, captured, future):
+        try:
+            reply, latency = await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            reply, latency = None, None
+        connection.results.append((line, captured, reply, latency))
+
+    async def linger(self, connection):
+        # Chat lines have no replies; stay until the captured number of
+        # lines has arrived (or the capture's close time), then a bit more
+        if self.speed is not None and connection.closed_at is not None:
+            await self.wait_until(connection.closed_at)
+        deadline = time.perf_counter() + self.timeout
+        while (connection.captured_received is not None and connection.received < connection.captured_received
+               and time.perf_counter() < deadline):
+            await asyncio.sleep(0.05)
+
+    async def receive(self, connection, reader, waiting):
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            line = line.decode("utf-8").rstrip("\r\n")
+            connection.received += 1
+            if line.startswith("#"):
+                request_id = line.partition(" ")[0]
+                entry = waiting.pop(request_id, None)
+                if entry is not None:
+                    future, sent_at = entry
+                    if not future.done():
+                        future.set_result((line, time.perf_counter() - sent_at))
+
+    async def run(self):
+        self.turn_changed = asyncio.Condition()
+        self.began = time.perf_counter()
+        results = await asyncio.gather(*(self.run_connection(connection) for connection in self.connections),
+                                       return_exceptions=True)
+        failures = [result for result in results if isinstance(result, Exception)]
+        return time.perf_counter() - self.began, failures
+
+def report(kind, connections, commands, elapsed, failures, show):
+    print(f"Replayed {commands} commands on {len(connections)} connections in {elapsed:.2f}s "
+          f"({commands / elapsed if elapsed else 0:.0f} commands/s)")
+    for failure in failures[:show]:
+        print(f"  connection failed: {failure!r}")
+    if kind == "chat":
+        matched = sum(connection.received == connection.captured_received for connection in connections)
+        known = sum(connection.captured_received is not None for connection in connections)
+        print(f"Lines received matched the capture on {matched} of {known} connections (depends on timing)")
+        return bool(failures)
+    latencies = sorted(latency for connection in connections for _, _, _, latency in connection.results
+                       if latency is not None)
+    if latencies:
+        print(f"Reply latency: p50 {latencies[len(latencies) // 2] * 1000:.2f} ms, "
+              f"p99 {latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000:.2f} ms, "
+              f"max {latencies[-1] * 1000:.2f} ms")
+    outcomes = {"same": 0, "renumbered": 0, "different": 0, "missing": 0}
+    examples = []
+    for connection in connections:
+        for line, captured, replayed, latency in connection.results:
+            if captured is None:
+                continue
+            outcome = compare(captured, replayed)
+            outcomes[outcome] += 1
+            if outcome in ("different", "missing") and len(examples) < show:
+                examples.append((connection.key[2], line, captured, replayed))
+    print("Replies: " + ", ".join(f"{count} {outcome}" for outcome, count in outcomes.items()))
+    for connection_id, line, captured, replayed in examples:
+        print(f"  connection {connection_id}: {line[:80]}\n    captured: {captured}\n    replayed: {replayed}")
+    return bool(failures or outcomes["different"] or outcomes["missing"])
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Replay captured order or chat traffic against a server")
+    parser.add_argument("captures", nargs="+", help="capture files written by --capture (one per worker)")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, help="defaults to 8888 for order captures and 9999 for chat")
+    parser.add_argument("--speed", default="1",
+                        help="1 replays in real time, 10 ten times faster, max as fast as the server answers")
+    parser.add_argument("--ordered", action="store_true",
+                        help="keep the captured order of commands across connections (deterministic)")
+    parser.add_argument("--timeout", type=float, default=5.0, help="seconds to wait for a reply")
+    parser.add_argument("--show", type=int, default=5, help="mismatched replies to print")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    speed = None if args.speed == "max" else float(args.speed)
+    if speed is not None and speed <= 0:
+        raise SystemExit("--speed must be positive or max")
+    kind, start, connections, commands = load_captures(args.captures)
+    replay = Replay(kind, start, connections, args.host, args.port or DEFAULT_PORTS[kind], speed, args.ordered, args.timeout)
+    elapsed, failures = asyncio.run(replay.run())
+    sys.exit(1 if report(kind, connections, commands, elapsed, failures, args.show) else 0)
@@ -0,0 +1,241 @@
+import argparse
+import sqlite3
+
+from analytics import create_rollups
+from catalog import PRODUCTS_UPDATE_TRIGGER, ensure_catalog_schema, execute_script
+
+# Schema versions are tracked in PRAGMA user_version. Each migration brings
+# a database from the previous version to its own, so an existing
+# canteen.db of any age is upgraded in place by running the missing steps.
+# Order ids are AUTOINCREMENT so ids of archived orders are never reused.
+
+ARCHIVE_PATH = 'canteen_archive.db'
+
+ORDER_TABLES = '''
+    CREATE TABLE IF NOT EXISTS {prefix}orders (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        status TEXT NOT NULL DEFAULT 'Pending',
+        total_price REAL NOT NULL,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        completed_at TEXT
+    );
+    CREATE TABLE IF NOT EXISTS {prefix}order_items (
+        id INTEGER PRIMARY KEY,
+        order_id INTEGER NOT NULL {order_fk},
+        product_id INTEGER {product_fk},
+        product_name TEXT NOT NULL,
+        quantity INTEGER NOT NULL,
+        unit_price REAL NOT NULL,
+        total_price REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS {prefix}idx_orders_status ON orders (status, completed_at);
+    CREATE INDEX IF NOT EXISTS {prefix}idx_order_items_order ON order_items (order_id);
+'''
+
+def migrate_v1(conn):
+    # The original single-table layout
+    execute_script(conn, '''
+        CREATE TABLE IF NOT EXISTS products (
+            id INTEGER PRIMARY KEY,
+            name TEXT,
+            category TEXT,
+            price REAL,
+            image TEXT,
+            stock INTEGER
+        );
+        CREATE TABLE IF NOT EXISTS orders (
+            id INTEGER PRIMARY KEY,
+            product_name TEXT,
+            quantity INTEGER,
+            total_price REAL,
+            status TEXT
+        );
+    ''')
+    ensure_catalog_schema(conn)
+
+def migrate_v2(conn):
+    # Split orders into headers and line items. Old rows were one line each,
+    # so each becomes an order with one item and keeps its id (and bill).
+    # The old table kept no timestamps, so created_at stays NULL rather than
+    # pretending every old order was placed during the migration.
+    conn.execute('ALTER TABLE orders RENAME TO orders_v1')
+    execute_script(conn, ORDER_TABLES.format(prefix='',
+                                         order_fk='REFERENCES orders (id)',
+                                         product_fk='REFERENCES products (id)'))
+    conn.execute('''
+        INSERT INTO orders (id, status, total_price, created_at)
+        SELECT id, COALESCE(status, 'Pending'), COALESCE(total_price, 0), NULL FROM orders_v1
+    ''')
+    conn.execute('''
+        INSERT INTO order_items (order_id, product_id, product_name, quantity, unit_price, total_price)
+        SELECT o.id, (SELECT MIN(p.id) FROM products p WHERE p.name = o.product_name),
+               COALESCE(o.product_name, ''), COALESCE(o.quantity, 1),
+               COALESCE(o.total_price, 0) / MAX(COALESCE(o.quantity, 1), 1), COALESCE(o.total_price, 0)
+        FROM orders_v1 o
+    ''')
+    conn.execute('DROP TABLE orders_v1')
+
+def migrate_v3(conn):
+    # Sales rollups maintained by triggers; existing orders are counted by
+    # running analytics.py once
+    create_rollups(conn)
+
+# Prep seconds and units cooked per batch for the sample menu; packaged
+# items take no prep
+SAMPLE_PREP_TIMES = {
+    "Samosa": (60, 6),
+    "Sandwich": (180, 2),
+    "Burger": (300, 4),
+    "Tea": (120, 5),
+    "Coffee": (90, 1),
+    "Juice": (60, 1),
+    "Lays": (0, 1),
+    "Dairy Milk": (0, 1),
+    "KitKat": (0, 1),
+}
+
+def migrate_v4(conn):
+    # Per-product prep time and batch size for the kitchen scheduler
+    conn.execute('ALTER TABLE products ADD COLUMN prep_seconds INTEGER NOT NULL DEFAULT 60')
+    conn.execute('ALTER TABLE products ADD COLUMN batch_size INTEGER NOT NULL DEFAULT 1')
+    conn.executemany('UPDATE products SET prep_seconds = ?, batch_size = ? WHERE name = ?',
+                     [(seconds, batch_size, name) for name, (seconds, batch_size) in SAMPLE_PREP_TIMES.items()])
+
+def migrate_v5(conn):
+    # The outcome of every order submitted with an idempotency key, so a
+    # kiosk retrying an order it queued offline never places it twice
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS order_requests (
+            key TEXT PRIMARY KEY,
+            response TEXT NOT NULL,
+            created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID
+    ''')
+
+def migrate_v6(conn):
+    # Which customer placed an order, so the chat server only lets that
+    # customer into the order's channel. A table of its own rather than a
+    # column so archived orders keep the layout the archive already has.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS order_customers (
+            order_id INTEGER PRIMARY KEY,
+            customer TEXT NOT NULL
+        )
+    ''')
+
+def migrate_v7(conn):
+    # Stop bumping the catalog version on stock changes that leave an item
+    # in stock (or out of it), which every order makes
+    conn.execute('DROP TRIGGER IF EXISTS products_after_update')
+    execute_script(conn, PRODUCTS_UPDATE_TRIGGER)
+
+MIGRATIONS = [migrate_v1, migrate_v2, migrate_v3, migrate_v4, migrate_v5, migrate_v6, migrate_v7]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def migrate(conn):
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        return version
+    for number, step in enumerate(MIGRATIONS[version:], start=version + 1):
+        print(f"Migrating database to schema version {number}")
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            step(conn)
+            conn.execute(f'PRAGMA user_version = {number}')
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+    return SCHEMA_VERSION
+
+def initialize_database(path='canteen.db', populate=True):
+    # Cheap when the schema is current: one PRAGMA read and no DDL. A new
+    # database is seeded with the sample menu straight after it is created.
+    conn = sqlite3.connect(path, isolation_level=None)
+    created = conn.execute('PRAGMA user_version').fetchone()[0] == 0
+    migrate(conn)
+    conn.close()
+    if created and populate:
+        populate_database(path)
+
+def populate_database(path='canteen.db'):
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+
+    # Check if products table is empty before populating
+    cursor.execute('SELECT COUNT(*) FROM products')
+    count = cursor.fetchone()[0]
+    if count == 0:
+        products = [
+            ("Samosa", "Snacks", 10, "images/samosa.jpg", 10),
+            ("Sandwich", "Snacks", 30, "images/sandwich.jpg", 10),
+            ("Burger", "Snacks", 50, "images/burger.jpg", 10),
+            ("Tea", "Beverages", 10, "images/tea.jpg", 10),
+            ("Coffee", "Beverages", 20, "images/coffee.jpg", 10),
+            ("Juice", "Beverages", 15, "images/juice.jpg", 10),
+            ("Lays", "Chips & Chocolates", 20, "images/lays.jpg", 10),
+            ("Dairy Milk", "Chips & Chocolates", 30, "images/dairymilk.jpg", 10),
+            ("KitKat", "Chips & Chocolates", 25, "images/kitkat.png", 10)
+        ]
+
+        cursor.executemany('INSERT INTO products (name, category, price, image, stock, prep_seconds, batch_size) '
+                           'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                           [product + SAMPLE_PREP_TIMES[product[0]] for product in products])
+        conn.commit()
+
+    conn.close()
+
+def archive_completed_orders(conn, archive_path=ARCHIVE_PATH, older_than_days=1, batch_size=5000):
+    # Moves completed orders older than the cutoff into the archive database
+    # so the hot tables only hold recent work. Rows are copied with INSERT OR
+    # IGNORE before they are deleted, so an interrupted run is safe to repeat.
+    # Only duplicates are skipped: a row the archive rejects for any other
+    # reason (an archive from before created_at could be NULL, say) stops the
+    # run instead of being deleted uncopied.
+    conn.execute('ATTACH DATABASE ? AS archive', (archive_path,))
+    try:
+        execute_script(conn, ORDER_TABLES.format(prefix='archive.', order_fk='', product_fk=''))
+        cutoff = f'-{int(older_than_days)} days'
+        moved = 0
+        while True:
+            conn.execute('BEGIN IMMEDIATE')
+            ids = [row[0] for row in conn.execute('''
+                SELECT id FROM main.orders
+                WHERE status = 'Completed' AND (completed_at IS NULL OR completed_at < datetime('now', ?))
+                LIMIT ?
+            ''', (cutoff, batch_size))]
+            if not ids:
+                conn.execute('COMMIT')
+                break
+            marks = ','.join('?' * len(ids))
+            conn.execute(f'INSERT INTO archive.orders SELECT * FROM main.orders WHERE id IN ({marks}) '
+                         'ON CONFLICT DO NOTHING', ids)
+            conn.execute(f'INSERT INTO archive.order_items SELECT * FROM main.order_items WHERE order_id IN ({marks}) '
+                         'ON CONFLICT DO NOTHING', ids)
+            conn.execute(f'DELETE FROM main.order_items WHERE order_id IN ({marks})', ids)
+            conn.execute(f'DELETE FROM main.order_customers WHERE order_id IN ({marks})', ids)
+            conn.execute(f'DELETE FROM main.orders WHERE id IN ({marks})', ids)
+            conn.execute('COMMIT')
+            moved += len(ids)
+        return moved
+    finally:
+        conn.execute('DETACH DATABASE archive')
+
+def prune_order_requests(conn, older_than_days=30):
+    # Keys only need to outlive the longest a kiosk could keep retrying
+    return conn.execute("DELETE FROM order_requests WHERE created_at < datetime('now', ?)",
+                        (f'-{int(older_than_days)} days',)).rowcount
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Upgrade canteen.db in place and archive old orders")
+    parser.add_argument("database", nargs="?", default="canteen.db")
+    parser.add_argument("--archive", action="store_true", help="move old completed orders to the archive database")
+    parser.add_argument("--archive-path", default=ARCHIVE_PATH)
+    parser.add_argument("--older-than-days", type=int, default=1)
+    args = parser.parse_args()
+    conn = sqlite3.connect(args.database, isolation_level=None)
+    print(f"Schema version {migrate(conn)}")
+    if args.archive:
+        moved = archive_completed_orders(conn, args.archive_path, args.older_than_days)
+        print(f"Archived {moved} completed orders to {args.archive_path}")
+    conn.close()
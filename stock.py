@@ -0,0 +1,75 @@
+import random
+import sqlite3
+import time
+
+class OutOfStock(Exception):
+    def __init__(self, shortages):
+        # shortages: list of (product_id, requested, available)
+        super().__init__(", ".join(f"product {p}: wanted {r}, {a} left" for p, r, a in shortages))
+        self.shortages = shortages
+
+def open_database(path='canteen.db', timeout=5.0):
+    # Autocommit mode so callers control BEGIN IMMEDIATE themselves
+    return sqlite3.connect(path, timeout=timeout, isolation_level=None)
+
+def begin_immediate(conn, timeout=5.0):
+    # Take the write lock up front so two terminals never both read stock
+    # and then deadlock upgrading. SQLite's own busy handler sleeps in
+    # coarse steps and lets waiters starve, so poll with short jittered
+    # backoff instead and keep lock waits in the low milliseconds.
+    busy_timeout = conn.execute('PRAGMA busy_timeout').fetchone()[0]
+    conn.execute('PRAGMA busy_timeout = 0')
+    try:
+        deadline = time.monotonic() + timeout
+        delay = 0.0005
+        while True:
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                return
+            except sqlite3.OperationalError as e:
+                if 'locked' not in str(e) or time.monotonic() > deadline:
+                    raise
+            time.sleep(random.uniform(0, delay))
+            delay = min(delay * 2, 0.004)
+    finally:
+        conn.execute(f'PRAGMA busy_timeout = {busy_timeout}')
+
+def reserve_stock(conn, lines, allow_partial=False):
+    # Decrements stock for every (product_id, quantity) line and returns the
+    # quantity filled per line. Must run inside a write transaction: each
+    # decrement is a conditional UPDATE, so stock can never go negative,
+    # and the caller's commit or rollback covers all lines at once. Without
+    # allow_partial any shortage raises OutOfStock and nothing should be
+    # committed; with it, short lines are filled with what is left.
+    requested = {}
+    for product_id, quantity in lines:
+        requested[product_id] = requested.get(product_id, 0) + quantity
+
+    granted = {}
+    shortages = []
+    for product_id, quantity in requested.items():
+        cursor = conn.execute('UPDATE products SET stock = stock - ? WHERE id = ? AND stock >= ?',
+                              (quantity, product_id, quantity))
+        if cursor.rowcount:
+            granted[product_id] = quantity
+            continue
+        row = conn.execute('SELECT stock FROM products WHERE id = ?', (product_id,)).fetchone()
+        available = max(row[0], 0) if row else 0
+        shortages.append((product_id, quantity, available))
+        granted[product_id] = 0
+        if allow_partial and available:
+            cursor = conn.execute('UPDATE products SET stock = stock - ? WHERE id = ? AND stock >= ?',
+                                  (available, product_id, available))
+            if cursor.rowcount:
+                granted[product_id] = available
+
+    if shortages and not allow_partial:
+        raise OutOfStock(shortages)
+
+    # Hand the granted units back to the cart lines in order
+    filled = []
+    for product_id, quantity in lines:
+        take = min(quantity, granted[product_id])
+        granted[product_id] -= take
+        filled.append(take)
+    return filled
@@ -0,0 +1,56 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+
+from api_server import ApiServer
+from order_server import OrderServer
+from schema import initialize_database
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+@pytest.fixture
+def servers(tmp_path):
+    db_path = str(tmp_path / "canteen.db")
+    initialize_database(db_path)
+    order_server = OrderServer("localhost", 0, journal_path=str(tmp_path / "orders.journal"))
+    threading.Thread(target=order_server.run, daemon=True).start()
+    api = ApiServer(db_path=db_path, pool_size=2, order_server=("localhost", order_server.server.getsockname()[1]))
+    assert wait_for(lambda: api.order_client.sock is not None)
+    yield order_server, api
+    api.order_client.close()
+    api.notifier.shutdown()
+    api.service.close()
+    api.menu.close()
+    order_server.server.close()
+
+def call(api, method, target, body=None):
+    route, status, content_type, payload = asyncio.run(
+        api.dispatch(method, target, {}, json.dumps(body).encode("utf-8") if body is not None else b""))
+    return status, json.loads(payload)
+
+def test_complete_through_api_drops_order_from_order_server(servers):
+    order_server, api = servers
+    status, order = call(api, "POST", "/orders", {"items": [{"product_id": 1, "quantity": 2}]})
+    assert status == 201
+    pending_ids = lambda: [json.loads(details)["order_id"] for number, details in order_server.orders.snapshot()]
+    assert wait_for(lambda: pending_ids() == [order["order_id"]])
+
+    status, result = call(api, "POST", f"/orders/{order['order_id']}/complete")
+    assert status == 200 and result["status"] == "Completed"
+    assert wait_for(lambda: not pending_ids())
+
+def test_completing_twice_conflicts(servers):
+    order_server, api = servers
+    status, order = call(api, "POST", "/orders", {"items": [{"product_id": 1}]})
+    assert call(api, "POST", f"/orders/{order['order_id']}/complete")[0] == 200
+    assert call(api, "POST", f"/orders/{order['order_id']}/complete")[0] == 409
+    assert call(api, "POST", "/orders/999999/complete")[0] == 404
@@ -0,0 +1,72 @@
+import json
+import threading
+
+from order_queue import OrderQueue, SqliteOrderQueue
+
+def test_recover_drops_torn_tail(tmp_path):
+    path = str(tmp_path / "orders.journal")
+    orders = OrderQueue(path)
+    orders.add("first")
+    orders.add("second")
+    orders.complete(1)
+    orders.close()
+    intact = open(path, "rb").read()
+    # A crash halfway through writing a record
+    with open(path, "ab") as journal:
+        journal.write(b'{"op":"new","n":3,"deta')
+
+    orders = OrderQueue(path)
+    assert orders.snapshot() == [(2, "second")]
+    assert open(path, "rb").read() == intact
+    assert orders.add("third") == (3, 2)
+    orders.close()
+    assert OrderQueue(path).snapshot() == [(2, "second"), (3, "third")]
+
+def test_recover_treats_record_without_newline_as_torn(tmp_path):
+    path = str(tmp_path / "orders.journal")
+    orders = OrderQueue(path)
+    orders.add("first")
+    orders.close()
+    # Complete JSON, but the newline never made it to disk
+    with open(path, "ab") as journal:
+        journal.write(json.dumps({"op": "new", "n": 2, "details": "second"}).encode("utf-8"))
+
+    orders = OrderQueue(path)
+    assert orders.snapshot() == [(1, "first")]
+    orders.add("again")
+    orders.close()
+    assert OrderQueue(path).snapshot() == [(1, "first"), (2, "again")]
+
+def test_compaction_keeps_numbering(tmp_path):
+    path = str(tmp_path / "orders.journal")
+    orders = OrderQueue(path, compact_threshold=10)
+    for _ in range(20):
+        number, _ = orders.add("x")
+        orders.complete(number)
+    orders.add("kept")
+    orders.close()
+    recovered = OrderQueue(path)
+    assert recovered.snapshot() == [(21, "kept")]
+    assert recovered.add("next") == (22, 2)
+
+def test_sqlite_queue_concurrent_batches(tmp_path):
+    orders = SqliteOrderQueue(str(tmp_path / "orders.db"))
+    numbers = []
+    lock = threading.Lock()
+
+    def worker():
+        for _ in range(200):
+            (number, _), = orders.run_batch([("new", "x")])
+            with lock:
+                numbers.append(number)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(numbers) == list(range(1, 1601))
+    assert len(orders) == 1600
+    assert orders.complete() == (1, "x", 1599)
+    assert orders.complete(1) is None
+    orders.close()
@@ -0,0 +1,59 @@
+import json
+
+import pytest
+
+from order_server import OrderServer
+
+@pytest.fixture
+def server(tmp_path):
+    server = OrderServer("localhost", 0, journal_path=str(tmp_path / "orders.journal"))
+    yield server
+    server.server.close()
+    server.orders.close()
+
+def batch(server, *commands, request_id=None):
+    message = "BATCH " + json.dumps(list(commands))
+    reply = server.process_message(message if request_id is None else f"{request_id} {message}")
+    if request_id is not None:
+        tag, _, reply = reply.partition(" ")
+        assert tag == request_id
+    assert reply.startswith("BATCH ")
+    return json.loads(reply[len("BATCH "):])
+
+def test_batch_replies_in_order(server):
+    replies = batch(server, 'NEW_ORDER {"order_id": 7}', "NEW_ORDER", "COMPLETE_ORDER 1", "COMPLETE_ORDER 1",
+                    "COMPLETE_ORDER")
+    assert replies[:3] == [
+        "Order 1 received. 1 orders left.",
+        "Order 2 received. 2 orders left.",
+        "Order 1 completed. 1 orders left.",
+    ]
+    # Counted when the reply is worded, after the whole batch
+    assert replies[3].startswith("Order 1 is not pending.")
+    assert replies[4] == "Order 2 completed. 0 orders left."
+
+def test_batch_rejects_bad_commands_but_runs_the_rest(server):
+    replies = batch(server, "NEW_ORDER", "COMPLETE_ORDER abc", "STATS", "SUBSCRIBE")
+    assert replies[0] == "Order 1 received. 1 orders left."
+    assert replies[1] == "ERROR Invalid order number: abc"
+    assert replies[2] == "ERROR STATS is not allowed in a batch"
+    assert replies[3] == "ERROR SUBSCRIBE is not allowed in a batch"
+    assert server.orders.snapshot() == [(1, "")]
+
+def test_batch_needs_a_json_array_of_strings(server):
+    assert server.process_message("BATCH nope").startswith("ERROR Invalid batch")
+    assert server.process_message('BATCH ["NEW_ORDER", 3]').startswith("ERROR Invalid batch")
+    assert server.orders.snapshot() == []
+
+def test_request_ids_are_echoed(server):
+    assert server.process_message("#1 NEW_ORDER") == "#1 Order 1 received. 1 orders left."
+    assert server.process_message("#x2 COMPLETE_ORDER 5") == "#x2 Order 5 is not pending. 1 orders left."
+    assert server.process_message("#3 BOGUS") == "#3 ERROR Unknown command: BOGUS"
+    assert batch(server, "COMPLETE_ORDER", request_id="#4") == ["Order 1 completed. 0 orders left."]
+    # Untagged commands are answered untagged
+    assert server.process_message("NEW_ORDER") == "Order 2 received. 1 orders left."
+
+def test_lookup_finds_numbers_by_order_id(server):
+    batch(server, 'NEW_ORDER {"order_id": 40}', "NEW_ORDER", 'NEW_ORDER {"order_id": 41}')
+    assert server.process_message("#9 LOOKUP 41 40 99") == '#9 LOOKUP {"40": 1, "41": 3}'
+    assert server.process_message("LOOKUP x").startswith("ERROR")
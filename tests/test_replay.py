@@ -0,0 +1,21 @@
+import pytest
+
+from replay import compare, strip_id
+
+@pytest.mark.parametrize("captured, replayed, outcome", [
+    ("Order 3 received. 2 orders left.", "Order 3 received. 2 orders left.", "same"),
+    ("#12 Order 3 received. 2 orders left.", "#7 Order 3 received. 2 orders left.", "same"),
+    ("Order 3 received. 2 orders left.", "Order 41 received. 0 orders left.", "renumbered"),
+    ("Order 3 received. Ready in about 2.5 minutes.", "Order 3 received. Ready in about 10 minutes.", "renumbered"),
+    ("Order 3 received. 2 orders left.", "Order 3 completed. 2 orders left.", "different"),
+    ("Order 3 received. 2 orders left.", "ERROR Unknown command: NEW_ORDER", "different"),
+    ("Order 3 received. 2 orders left.", None, "missing"),
+    ("#5 SUBSCRIBED 0 orders left.", "#5", "different"),
+])
+def test_compare(captured, replayed, outcome):
+    assert compare(captured, replayed) == outcome
+
+def test_strip_id():
+    assert strip_id("#12 Order 1 received.") == "Order 1 received."
+    assert strip_id("Order 1 received.") == "Order 1 received."
+    assert strip_id(None) is None
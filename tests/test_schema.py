@@ -0,0 +1,77 @@
+import hashlib
+import os
+import shutil
+import sqlite3
+
+import pytest
+
+from analytics import backfill
+from catalog import HAS_TRIGRAM, Catalog
+from schema import SCHEMA_VERSION, migrate
+
+SHIPPED_DB = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "canteen.db")
+
+def digest(path):
+    with open(path, "rb") as db_file:
+        return hashlib.sha256(db_file.read()).hexdigest()
+
+@pytest.fixture
+def shipped_copy(tmp_path):
+    # Always work on a copy: the tracked database must stay as shipped
+    before = digest(SHIPPED_DB)
+    path = str(tmp_path / "canteen.db")
+    shutil.copyfile(SHIPPED_DB, path)
+    yield path
+    assert digest(SHIPPED_DB) == before
+
+def test_shipped_database_migrates_to_current_schema(shipped_copy):
+    conn = sqlite3.connect(shipped_copy, isolation_level=None)
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == 0
+    legacy = conn.execute('SELECT id, product_name, quantity, total_price, status FROM orders ORDER BY id').fetchall()
+    products = conn.execute('SELECT id, name, stock FROM products ORDER BY id').fetchall()
+
+    assert migrate(conn) == SCHEMA_VERSION
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == SCHEMA_VERSION
+    # Every old single-line order keeps its id, total and status, and has
+    # no invented creation time
+    orders = conn.execute('SELECT id, total_price, status, created_at FROM orders ORDER BY id').fetchall()
+    assert [(order_id, total, status or 'Pending', None) for order_id, name, quantity, total, status in legacy] == orders
+    items = conn.execute('SELECT order_id, product_name, quantity, total_price FROM order_items ORDER BY order_id').fetchall()
+    assert items == [(order_id, name, quantity, total) for order_id, name, quantity, total, status in legacy]
+    assert conn.execute('SELECT id, name, stock FROM products ORDER BY id').fetchall() == products
+    assert conn.execute('SELECT COUNT(*) FROM products WHERE prep_seconds IS NULL').fetchone()[0] == 0
+    for table in ("order_requests", "order_customers", "sales_totals", "catalog_meta"):
+        assert conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (table,)).fetchone(), table
+    # Running it again is a no-op
+    assert migrate(conn) == SCHEMA_VERSION
+
+def test_legacy_orders_stay_out_of_time_rollups(shipped_copy):
+    conn = sqlite3.connect(shipped_copy, isolation_level=None)
+    migrate(conn)
+    legacy = conn.execute('SELECT COUNT(*), SUM(total_price) FROM orders').fetchone()
+    backfill(conn, progress_every=0)
+    assert conn.execute('SELECT orders, revenue FROM sales_totals').fetchone() == legacy
+    assert conn.execute('SELECT COUNT(*) FROM sales_hourly').fetchone()[0] == 0
+    assert conn.execute('SELECT COUNT(*) FROM sales_daily').fetchone()[0] == 0
+    conn.execute("INSERT INTO orders (total_price) VALUES (12)")
+    assert conn.execute('SELECT SUM(orders) FROM sales_daily').fetchone()[0] == 1
+
+def test_catalog_search_after_migration(shipped_copy):
+    conn = sqlite3.connect(shipped_copy, isolation_level=None)
+    migrate(conn)
+    catalog = Catalog(conn)
+    assert catalog.has_fts == HAS_TRIGRAM
+    assert [row[1] for row in catalog.search("mosa")] == ["Samosa"]
+
+def test_stock_change_bumps_catalog_only_when_availability_changes(shipped_copy):
+    conn = sqlite3.connect(shipped_copy, isolation_level=None)
+    migrate(conn)
+    version = lambda: conn.execute('SELECT version FROM catalog_meta').fetchone()[0]
+    conn.execute('UPDATE products SET stock = 5 WHERE id = 1')
+    start = version()
+    conn.execute('UPDATE products SET stock = 4 WHERE id = 1')
+    assert version() == start
+    conn.execute('UPDATE products SET stock = 0 WHERE id = 1')
+    assert version() == start + 1
+    conn.execute('UPDATE products SET price = price + 1 WHERE id = 1')
+    assert version() == start + 2
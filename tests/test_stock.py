@@ -0,0 +1,72 @@
+import sqlite3
+import threading
+
+import pytest
+
+from schema import migrate
+from stock import OutOfStock, begin_immediate, open_database, reserve_stock
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "canteen.db")
+    conn = sqlite3.connect(path, isolation_level=None)
+    migrate(conn)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.executemany('INSERT INTO products (id, name, category, price, image, stock) VALUES (?, ?, ?, ?, ?, ?)',
+                     [(1, "Samosa", "Snacks", 10, "", 25), (2, "Tea", "Beverages", 10, "", 40)])
+    conn.close()
+    return path
+
+def stock_of(path):
+    conn = sqlite3.connect(path)
+    try:
+        return dict(conn.execute('SELECT id, stock FROM products'))
+    finally:
+        conn.close()
+
+@pytest.mark.parametrize("allow_partial", [False, True])
+def test_concurrent_writers_never_oversell(db_path, allow_partial):
+    sold = {1: 0, 2: 0}
+    sold_lock = threading.Lock()
+
+    def terminal():
+        conn = open_database(db_path, timeout=30)
+        for _ in range(30):
+            begin_immediate(conn, timeout=30)
+            try:
+                filled = reserve_stock(conn, [(1, 2), (2, 1), (1, 1)], allow_partial)
+            except OutOfStock:
+                conn.execute('ROLLBACK')
+                continue
+            conn.execute('COMMIT')
+            with sold_lock:
+                sold[1] += filled[0] + filled[2]
+                sold[2] += filled[1]
+        conn.close()
+
+    threads = [threading.Thread(target=terminal) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stock = stock_of(db_path)
+    assert stock[1] >= 0 and stock[2] >= 0
+    assert sold == {1: 25 - stock[1], 2: 40 - stock[2]}
+    # Far more was asked for than there was
+    assert stock[1] < 3
+
+def test_shortage_without_partial_raises(db_path):
+    conn = open_database(db_path)
+    begin_immediate(conn)
+    with pytest.raises(OutOfStock) as raised:
+        reserve_stock(conn, [(1, 30), (2, 1)])
+    conn.execute('ROLLBACK')
+    assert raised.value.shortages == [(1, 30, 25)]
+    assert stock_of(db_path) == {1: 25, 2: 40}
+
+def test_partial_fills_what_is_left(db_path):
+    conn = open_database(db_path)
+    begin_immediate(conn)
+    assert reserve_stock(conn, [(1, 20), (1, 10), (2, 1)], allow_partial=True) == [20, 5, 1]
+    conn.execute('COMMIT')
+    assert stock_of(db_path) == {1: 0, 2: 39}
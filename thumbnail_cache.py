@@ -0,0 +1,119 @@
+import hashlib
+import os
+import threading
+import tkinter as tk
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+THUMBNAIL_SIZE = (150, 150)
+
+def thumbnail_key(image_path, size=THUMBNAIL_SIZE):
+    # A changed source file (mtime or size) or tile size gets a new key, so
+    # stale thumbnails are simply never looked up again.
+    stat = os.stat(image_path)
+    raw = f"{os.path.abspath(image_path)}|{stat.st_mtime_ns}|{stat.st_size}|{size[0]}x{size[1]}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+def build_thumbnail(image_path, cache_dir, size=THUMBNAIL_SIZE):
+    # Module level so it can run in a worker process. Returns the path of
+    # the pre-resized PNG, creating it if needed. PIL is imported only here:
+    # it is slow to import and most lookups hit the disk cache.
+    thumb_path = os.path.join(cache_dir, thumbnail_key(image_path, size) + ".png")
+    if not os.path.exists(thumb_path):
+        from PIL import Image
+        img = Image.open(image_path).convert("RGB")
+        img = img.resize(size, Image.Resampling.LANCZOS)
+        tmp_path = f"{thumb_path}.{os.getpid()}.tmp"
+        img.save(tmp_path, "PNG")
+        os.replace(tmp_path, thumb_path)
+    return thumb_path
+
+def warm_thumbnail(args):
+    image_path, cache_dir, size = args
+    try:
+        build_thumbnail(image_path, cache_dir, size)
+        return True
+    except (OSError, ImportError):
+        # PIL's UnidentifiedImageError is an OSError; without PIL the grid
+        # falls back to placeholders
+        return False
+
+# Two-layer thumbnail cache for the product grid: pre-resized PNGs on disk
+# and a bounded LRU of PhotoImage objects in memory. get() must be called
+# from the Tk thread.
+class ThumbnailCache:
+    def __init__(self, cache_dir=".thumbnails", size=THUMBNAIL_SIZE, max_images=256):
+        self.cache_dir = cache_dir
+        self.size = size
+        self.max_images = max_images
+        os.makedirs(cache_dir, exist_ok=True)
+        self.photos = OrderedDict()  # image path -> (key, PhotoImage)
+        self.placeholder = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def warm(self, image_paths, processes=None):
+        # Builds missing disk thumbnails in a background process pool so the
+        # first category switch does not pay for the LANCZOS resizes.
+        jobs = [(path, self.cache_dir, self.size) for path in dict.fromkeys(image_paths)]
+
+        def run():
+            with ProcessPoolExecutor(max_workers=processes) as pool:
+                list(pool.map(warm_thumbnail, jobs))
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def get(self, image_path):
+        try:
+            key = thumbnail_key(image_path, self.size)
+        except OSError as e:
+            print(f"Error loading image {image_path}: {e}")
+            self.errors += 1
+            return self.get_placeholder()
+
+        entry = self.photos.get(image_path)
+        if entry is not None and entry[0] == key:
+            self.photos.move_to_end(image_path)
+            self.memory_hits += 1
+            return entry[1]
+
+        thumb_path = os.path.join(self.cache_dir, key + ".png")
+        if os.path.exists(thumb_path):
+            self.disk_hits += 1
+        else:
+            self.misses += 1
+            try:
+                build_thumbnail(image_path, self.cache_dir, self.size)
+            except (OSError, ImportError) as e:
+                print(f"Error loading image {image_path}: {e}")
+                self.errors += 1
+                return self.get_placeholder()
+
+        # Tk decodes the small PNG natively, no PIL round trip needed
+        photo = tk.PhotoImage(file=thumb_path)
+        self.photos[image_path] = (key, photo)
+        while len(self.photos) > self.max_images:
+            self.photos.popitem(last=False)
+        return photo
+
+    def get_placeholder(self):
+        if self.placeholder is None:
+            width, height = self.size
+            self.placeholder = tk.PhotoImage(width=width, height=height)
+            self.placeholder.put("white", to=(0, 0, width, height))
+        return self.placeholder
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "cached_images": len(self.photos),
+            "hit_ratio": (self.memory_hits / lookups) if lookups else 0.0,
+        }